@@ -7,6 +7,7 @@ from thor.lib.image import (
     ImageInvalidException
 )
 from thor.lib.packer import Packer
+from thor.lib.utils import file_copy
 from thor.lib.aws_resources.parameter_store import ParameterStoreException
 
 
@@ -17,9 +18,12 @@ def build_cmd(args):
     image = Image(args.env, args.image, None)
 
     try:
-        with Compiler(image):
+        with Compiler(image, incremental=args.incremental, jobs=args.jobs,
+                      static_mode=args.static_mode) as compiler:
+            compiler.build()
             # run packer build
-            result = packer.run('build', Image.PACKER_FILE)
+            result = packer.run('build', Image.PACKER_FILE,
+                                workdir=compiler.get_build_dir())
             logger.info('Return code is {}'.format(result))
             if not result == 0:
                 logger.error('Packer build fail')
@@ -84,6 +88,31 @@ def main(args):
         action='store_true',
         required=False
     )
+    build_arg_parser.add_argument(
+        '--incremental',
+        action='store_true',
+        required=False,
+        help='Only recompile outputs whose inputs changed since last build'
+    )
+    build_arg_parser.add_argument(
+        '--jobs',
+        metavar='N',
+        required=False,
+        type=int,
+        default=1,
+        help='Number of templates rendered and static '
+             'files copied at the same time'
+    )
+    build_arg_parser.add_argument(
+        '--static-mode',
+        metavar='MODE',
+        required=False,
+        type=str,
+        choices=file_copy.MODES,
+        default=file_copy.COPY_MODE,
+        help='How static files are placed on build dir: copy (default), '
+             'reflink or hardlink'
+    )
 
     args = build_arg_parser.parse_args(args)
     e = Env(args.env)
@@ -1,8 +1,62 @@
 import argparse
 import logging
-from thor.lib.compiler import Compiler
+from thor.lib.compiler import (
+    Compiler,
+    CompilerException
+)
+from thor.lib.compiler_matrix import CompilerMatrix
 from thor.lib.env import Env
 from thor.lib.image import Image
+from thor.lib.utils import file_copy
+
+
+def get_compiler_options(args):
+    return {
+        'incremental': args.incremental,
+        'jobs': args.jobs,
+        'static_mode': args.static_mode,
+        'params_ttl': args.param_cache_ttl,
+        'wait_clean': args.wait_clean,
+        'profile': args.profile,
+        'deterministic': args.deterministic,
+        'seed': args.seed
+    }
+
+
+def print_profile(profile, top=20):
+    print('')
+    print('{:<40} {:>10}'.format('PHASE', 'SECONDS'))
+    for name, seconds in profile['phases'].items():
+        print('{:<40} {:>10.3f}'.format(name, seconds))
+
+    templates = sorted(profile['templates'].items(),
+                       key=lambda x: x[1]['seconds'], reverse=True)
+    print('')
+    print('{:<40} {:>10} {:>12} {:>8}'.format(
+        'TEMPLATE', 'SECONDS', 'BYTES', 'WRITTEN'))
+    for output, entry in templates[:top]:
+        print('{:<40} {:>10.3f} {:>12} {:>8}'.format(
+            output, entry['seconds'], entry['bytes'],
+            'yes' if entry['written'] else 'no'))
+    if len(templates) > top:
+        print(f'... {len(templates) - top} more on build_info.json')
+
+    filters = sorted(profile['filters'].items(),
+                     key=lambda x: x[1]['seconds'], reverse=True)
+    print('')
+    print('{:<40} {:>10} {:>10}'.format('FILTER', 'CALLS', 'SECONDS'))
+    for name, entry in filters:
+        print('{:<40} {:>10} {:>10.3f}'.format(
+            name, entry['calls'], entry['seconds']))
+
+    static = profile['static']
+    print('')
+    print('Static files: {} files, {} bytes, {:.3f} seconds, {} MB/s'.format(
+        static['files'], static['bytes'], static['seconds'],
+        static.get('mb_per_second', '-')))
+    for name, value in profile['counters'].items():
+        print(f'{name}: {value}')
+    print('')
 
 
 def compiler_cmd(args):
@@ -10,23 +64,21 @@ def compiler_cmd(args):
     logger.info('Starting...')
     image = Image(env=args.env, name=args.image)
 
-    compiler = Compiler(image)
+    compiler = Compiler(image, **get_compiler_options(args))
 
     if args.target is not None:
         build_targets_names = [
             x['name'] for x in compiler.build_targets]
         if args.target in build_targets_names:
-            for target in compiler.build_targets:
-                if target['name'] == args.target:
-                    build_target_func = target['func']
-                    break
-            result = build_target_func()
+            result = compiler.build_target(args.target)
         else:
             build_target_str = ', '.join(build_targets_names)
             logger.error(f'Compiler target must be either {build_target_str}')
             result = 'fail'
     else:
         result = compiler.build_all()
+        if args.profile and result == 'success':
+            print_profile(compiler.profiler.get_report())
 
     if result == 'success':
         logger.info('Completed with no errors :) ')
@@ -36,31 +88,136 @@ def compiler_cmd(args):
         logger.error('Build not returned any expected result. :(')
 
 
-def main(args):
-    '''
-    Compiler module entry point
-    '''
-    compiler_arg_parser = argparse.ArgumentParser(
-        prog='Thor compiler',
-        description='Thor compiler'
-    )
+def compiler_matrix_cmd(args):
+    logger = logging.getLogger('CompileCommand')
+    logger.info('Starting...')
+    matrix = CompilerMatrix(args.env, args.image, args.processes,
+                            **get_compiler_options(args))
+    results = matrix.run()
+    failed = [x for x in results if not x['result'] == 'success']
 
-    # request env for all parameter operations
-    compiler_arg_parser.add_argument(
+    print('')
+    print('{:<20} {:<30} {:<10} {:>10}'.format(
+        'ENVIRONMENT', 'IMAGE', 'RESULT', 'SECONDS'))
+    for result in results:
+        print('{:<20} {:<30} {:<10} {:>10.2f}'.format(
+            result['env'], result['image'], result['result'],
+            result['duration']))
+        if result['error']:
+            print(f'    {result["error"]}')
+    print('')
+    print(f'{len(results) - len(failed)} succeeded, {len(failed)} failed')
+
+    if failed:
+        exit(-1)
+
+
+def precompile_cmd(args):
+    logger = logging.getLogger('PrecompileCommand')
+    failed = 0
+
+    for env_name in args.env:
+        for image_name in args.image:
+            compiler = Compiler(Image(Env(env_name), image_name))
+            try:
+                bundle_file = compiler.precompile()
+                print(f'{env_name} {image_name} => {bundle_file}')
+            except CompilerException as err:
+                logger.error(str(err))
+                failed += 1
+
+    if failed:
+        exit(-1)
+
+
+def split_names(value):
+    if value is None:
+        return []
+    return [x.strip() for x in value.split(',') if x.strip()]
+
+
+def add_names_arguments(arg_parser):
+    arg_parser.add_argument(
         '--env',
         metavar='ENVIRONMENT',
-        required=True,
+        required=False,
         type=str,
-        help='Environent. Run "thor env list" to show available options.'
+        help='Environent. Run "thor env list" to show available options. '
+             'Accepts a comma separated list.'
     )
-    # request image for all parameter operations
-    compiler_arg_parser.add_argument(
+    arg_parser.add_argument(
         '--image',
         metavar='IMAGE',
-        required=True,
+        required=False,
         type=str,
         help='Image. Run "thor image --env=$ENV list"'
-             'to show available options.'
+             'to show available options. Accepts a comma separated list.'
+    )
+    arg_parser.add_argument(
+        '--all',
+        action='store_true',
+        required=False,
+        help='Compile all environments and/or all images when '
+             '--env and/or --image are not set'
+    )
+
+
+def get_names(arg_parser, args):
+    '''
+    Environment and image names from --env, --image and --all.
+    '''
+    env_names = split_names(args.env)
+    image_names = split_names(args.image)
+
+    if args.all:
+        if not env_names:
+            env_names = sorted(Env().list())
+        if not image_names:
+            image_names = CompilerMatrix.list_images()
+
+    if not env_names or not image_names:
+        arg_parser.error('--env and --image are required '
+                         'unless --all is used')
+
+    for env_name in env_names:
+        Env(env_name).is_valid_or_exit()
+    return env_names, image_names
+
+
+def precompile_main(args):
+    precompile_arg_parser = argparse.ArgumentParser(
+        prog='thor compiler precompile',
+        description='Compile templates into a bundle of python modules '
+                    'loaded by later compiles instead of parsing them'
+    )
+    add_names_arguments(precompile_arg_parser)
+    args = precompile_arg_parser.parse_args(args)
+    args.env, args.image = get_names(precompile_arg_parser, args)
+    precompile_cmd(args)
+
+
+def main(args):
+    '''
+    Compiler module entry point
+    '''
+    if args and args[0] == 'precompile':
+        precompile_main(args[1:])
+        return
+
+    compiler_arg_parser = argparse.ArgumentParser(
+        prog='Thor compiler',
+        description='Thor compiler',
+        epilog='Run "thor compiler precompile --help" to precompile '
+               'templates'
+    )
+    add_names_arguments(compiler_arg_parser)
+    compiler_arg_parser.add_argument(
+        '--processes',
+        metavar='N',
+        required=False,
+        type=int,
+        help='Number of images compiled at the same time when '
+             'compiling many images. Defaults to the number of CPUs'
     )
 
     # request image for all parameter operations
@@ -72,12 +229,84 @@ def main(args):
         help='Compiler targets: all (default), static, '
              'templates, config and packer'
     )
+    compiler_arg_parser.add_argument(
+        '--incremental',
+        action='store_true',
+        required=False,
+        help='Only rebuild outputs whose inputs changed since last build'
+    )
+    compiler_arg_parser.add_argument(
+        '--jobs',
+        metavar='N',
+        required=False,
+        type=int,
+        default=1,
+        help='Number of templates rendered and static '
+             'files copied at the same time'
+    )
+    compiler_arg_parser.add_argument(
+        '--static-mode',
+        metavar='MODE',
+        required=False,
+        type=str,
+        choices=file_copy.MODES,
+        default=file_copy.COPY_MODE,
+        help='How static files are placed on build dir: copy (default), '
+             'reflink or hardlink'
+    )
+    compiler_arg_parser.add_argument(
+        '--param-cache-ttl',
+        metavar='SECONDS',
+        required=False,
+        type=int,
+        help='Read parameters again when cached values are older than '
+             'SECONDS. Cached values are kept for the whole compile '
+             'by default'
+    )
+    compiler_arg_parser.add_argument(
+        '--wait-clean',
+        action='store_true',
+        required=False,
+        help='Wait for the replaced build to be deleted before the '
+             'compilation finishes. It is deleted in background by default'
+    )
+    compiler_arg_parser.add_argument(
+        '--profile',
+        action='store_true',
+        required=False,
+        help='Save render, filter and static copy times on '
+             'build_info.json and print them'
+    )
+    compiler_arg_parser.add_argument(
+        '--deterministic',
+        action='store_true',
+        required=False,
+        help='Derive thor.random_string from the input files and leave '
+             'times out of build_info.json, so the same inputs always '
+             'give the same build'
+    )
+    compiler_arg_parser.add_argument(
+        '--seed',
+        metavar='SEED',
+        required=False,
+        type=str,
+        help='Derive thor.random_string from SEED instead of the input '
+             'files. Implies --deterministic'
+    )
 
     args = compiler_arg_parser.parse_args(args)
-    e = Env(args.env)
-    e.is_valid_or_exit()
+    env_names, image_names = get_names(compiler_arg_parser, args)
 
-    # inject environment object on arguments
-    args.env = e
-    # run deploy
-    compiler_cmd(args)
+    if len(env_names) == 1 and len(image_names) == 1:
+        # inject environment object on arguments
+        args.env = Env(env_names[0])
+        args.image = image_names[0]
+        # run deploy
+        compiler_cmd(args)
+    else:
+        if args.target is not None:
+            compiler_arg_parser.error('--target can only be used '
+                                      'compiling a single image')
+        args.env = env_names
+        args.image = image_names
+        compiler_matrix_cmd(args)
@@ -1,7 +1,13 @@
 import argparse
 import logging
-from thor.lib.deploy import DeployBlueGreen
+from thor.cmdline.compiler import split_names
+from thor.lib.deploy import (
+    DeployException,
+    get_deploy
+)
 from thor.lib.compiler import Compiler
+from thor.lib.compiler_matrix import CompilerMatrix
+from thor.lib.deploy_matrix import DeployMatrix
 from thor.lib.env import Env
 from thor.lib.image import Image
 
@@ -11,9 +17,13 @@ def deploy_cmd(args):
     logger.info('Starting...')
     image = Image(env=args.env, name=args.image)
 
-    with Compiler(image):
-        deploy = DeployBlueGreen(image)
-        result = deploy.run()
+    with Compiler(image, incremental=args.incremental) as compiler:
+        compiler.build()
+        try:
+            result = get_deploy(image).run()
+        except DeployException as err:
+            logger.error(str(err))
+            result = 'fail'
 
     if result == 'success':
         logger.info('Completed with no errors :)')
@@ -23,6 +33,28 @@ def deploy_cmd(args):
         logger.error('Deploy fail')
 
 
+def deploy_matrix_cmd(args):
+    logger = logging.getLogger('DeployCommand')
+    logger.info('Starting...')
+    matrix = DeployMatrix(args.env, args.image, args.parallel,
+                          incremental=args.incremental)
+    results = matrix.run()
+    failed = [x for x in results if not x['result'] == 'success']
+
+    print('')
+    print('{:<30} {:<10} {:>10}'.format('IMAGE', 'RESULT', 'SECONDS'))
+    for result in results:
+        print('{:<30} {:<10} {:>10.2f}'.format(
+            result['image'], result['result'], result['duration']))
+        if result['error']:
+            print(f'    {result["error"]}')
+    print('')
+    print(f'{len(results) - len(failed)} succeeded, {len(failed)} failed')
+
+    if failed:
+        exit(-1)
+
+
 def main(args):
     '''
     Deploy module entry point
@@ -45,10 +77,25 @@ def main(args):
     deploy_arg_parser.add_argument(
         '--image',
         metavar='IMAGE',
-        required=True,
+        required=False,
         type=str,
         help='Image. Run "thor image --env=$ENV list"'
-             'to show available options.'
+             'to show available options. Accepts a comma separated list.'
+    )
+    deploy_arg_parser.add_argument(
+        '--all',
+        action='store_true',
+        required=False,
+        help='Deploy all images when --image is not set'
+    )
+    deploy_arg_parser.add_argument(
+        '--parallel',
+        metavar='N',
+        required=False,
+        type=int,
+        default=DeployMatrix.DEFAULT_PARALLEL,
+        help='Number of images deployed at the same time when deploying '
+             'many images (default {})'.format(DeployMatrix.DEFAULT_PARALLEL)
     )
     # allow to set aws region for all parameter operations
     deploy_arg_parser.add_argument(
@@ -74,8 +121,21 @@ def main(args):
         type=str,
         help='Name of AutoScaling group configuration will be copied'
     )
+    # allow to skip compiling outputs whose inputs didn't change
+    deploy_arg_parser.add_argument(
+        '--incremental',
+        action='store_true',
+        required=False,
+        help='Only recompile outputs whose inputs changed since last build'
+    )
 
     args = deploy_arg_parser.parse_args(args)
+    image_names = split_names(args.image)
+    if args.all and not image_names:
+        image_names = CompilerMatrix.list_images()
+    if not image_names:
+        deploy_arg_parser.error('--image is required unless --all is used')
+
     e = Env(args.env)
     e.is_valid_or_exit()
 
@@ -92,5 +152,10 @@ def main(args):
                        args.autoscaling_name)
     # inject environment object on arguments
     args.env = e
-    # run deploy
-    deploy_cmd(args)
+    if len(image_names) == 1:
+        args.image = image_names[0]
+        # run deploy
+        deploy_cmd(args)
+    else:
+        args.image = image_names
+        deploy_matrix_cmd(args)
@@ -27,7 +27,7 @@ def main(args):
         with Env(args.env) as env:
             env.is_valid_or_exit()
             terraform = Terraform()
-            terraform.run(*terraform_args)
+            terraform.run(*terraform_args, workdir=env.get_env_dir())
     else:
         infra_arg_parser.print_usage()
         exit(-1)
@@ -13,6 +13,10 @@ class AutoScalingActivityInProgress(Exception):
 
 class AutoScaling(AwsResource):
 
+    INSTANCE_REFRESH_SUCCESS_STATUS = 'Successful'
+    # any other status means the refresh won't complete
+    INSTANCE_REFRESH_WAITING_STATUS = ['Pending', 'InProgress', 'Baking']
+
     def __init__(self, env):
         super().__init__('autoscaling', env)
 
@@ -115,10 +119,7 @@ class AutoScaling(AwsResource):
                     **policy
                 )
             # wait for autoscaling and instance lifecycle completes
-            self.logger.info('Waiting instances to become available...')
-            self.wait_for(15, 1200, self.__check_instance_ready_state, name,
-                          config['DesiredCapacity'])
-            self.logger.info('Instances available.')
+            self.wait_for_capacity(name, config['DesiredCapacity'])
             self.logger.info('Created')
         except botocore.exceptions.ParamValidationError as err:
             raise AutoScalingException(str(err))
@@ -133,6 +134,86 @@ class AutoScaling(AwsResource):
         except self.client().exceptions.ServiceLinkedRoleFailure as err:
             raise AutoScalingException(str(err))
 
+    def wait_for_capacity(self, name, desired_capacity, timeout=1200):
+        '''
+        Wait until desired_capacity instances are healthy and in
+        service on autoscaling name.
+        '''
+        self.logger.info('Waiting instances to become available...')
+        self.wait_for_backoff(15, timeout, self.__check_instance_ready_state,
+                              name, desired_capacity)
+        self.logger.info('Instances available.')
+
+    def start_instance_refresh(self, name, launch_template_name, version,
+                               preferences):
+        '''
+        Replace instances of autoscaling name by instances of launch
+        template version. The autoscaling is switched to that version
+        when the refresh succeeds. Returns the refresh id.
+        '''
+        try:
+            preferences = self.translate_dict_to_aws_config_names(preferences)
+            self.logger.info('Starting instance refresh of {}...'.format(name))
+            for k, v in preferences.items():
+                self.logger.info('{}={}'.format(k, v))
+            response = self.client().start_instance_refresh(
+                AutoScalingGroupName=name,
+                Strategy='Rolling',
+                DesiredConfiguration={
+                    'LaunchTemplate': {
+                        'LaunchTemplateName': launch_template_name,
+                        'Version': str(version)
+                    }
+                },
+                Preferences=preferences
+            )
+            return response['InstanceRefreshId']
+        except botocore.exceptions.ParamValidationError as err:
+            raise AutoScalingException(str(err))
+        except botocore.exceptions.ClientError as err:
+            raise AutoScalingException(str(err))
+
+    def read_instance_refresh(self, name, refresh_id):
+        try:
+            response = self.client().describe_instance_refreshes(
+                AutoScalingGroupName=name,
+                InstanceRefreshIds=[refresh_id]
+            )
+            if not len(response['InstanceRefreshes']) == 1:
+                raise AutoScalingException(
+                    'Instance refresh {} not found'.format(refresh_id))
+            return response['InstanceRefreshes'][0]
+        except botocore.exceptions.ClientError as err:
+            raise AutoScalingException(str(err))
+
+    def __check_instance_refresh_state(self, name, refresh_id):
+        refresh = self.read_instance_refresh(name, refresh_id)
+        status = refresh['Status']
+        self.logger.info('Instance refresh {} = {}% ({})'.format(
+            refresh_id, refresh.get('PercentageComplete', 0), status))
+
+        if status == AutoScaling.INSTANCE_REFRESH_SUCCESS_STATUS:
+            return True
+        if status not in AutoScaling.INSTANCE_REFRESH_WAITING_STATUS:
+            raise AutoScalingException('Instance refresh {} {}: {}'.format(
+                refresh_id, status, refresh.get('StatusReason', '')))
+        return False
+
+    def wait_for_instance_refresh(self, name, refresh_id, timeout=1800):
+        self.logger.info('Waiting instance refresh to complete...')
+        self.wait_for_backoff(30, timeout,
+                              self.__check_instance_refresh_state,
+                              name, refresh_id)
+        self.logger.info('Instance refresh completed.')
+
+    def cancel_instance_refresh(self, name):
+        try:
+            self.logger.info('Cancelling instance refresh of {}...'.format(
+                name))
+            self.client().cancel_instance_refresh(AutoScalingGroupName=name)
+        except botocore.exceptions.ClientError as err:
+            raise AutoScalingException(str(err))
+
     def destroy(self, name):
         seconds_to_wait_for_autoscaling_activity = 30
         self.logger.info('Terminating {}...'.format(name))
@@ -1,4 +1,6 @@
+import itertools
 import logging
+import random
 import time
 
 
@@ -16,6 +18,7 @@ class AwsResourceParameterException(Exception):
 
 class AwsResource:
 
+    BACKOFF_INITIAL_SECONDS = 2
     MAX_RETRY_INTERVAL_SECONDS = 60
     MAX_TIMEOUT_SECONDS = 1800
     MIN_RETRY_INTERVAL_SECONDS = 1
@@ -26,6 +29,8 @@ class AwsResource:
         self.env = env
         self.alias = alias
         self.__client = None
+        # set from another thread to cancel waits
+        self.cancel_event = None
         if alias is None:
             self.alias = self.client_name
         self.logger = logging.getLogger('Resource.{}'.format(self.alias))
@@ -112,22 +117,7 @@ class AwsResource:
             [results.append(v) for v in response[key] if v]
         return results
 
-    def wait_for(self, retry_interval, timeout, func, *args, **kwargs):
-        '''
-        Wait until the resource reaches a particular states. That happens
-        by checking the result of 'func'. The cycle ends when 'func' returns
-        a 'True' logical value.
-
-        Parameters:
-            retry_interval (int): Retry interval in seconds between calls to 'func'.
-            timeout (int): Max time in seconds that 'func' has to return True.
-            func (callable): Callable object
-            args (*args): 'func' positional args
-            kwargs (**kwargs): 'func' key word args
-
-        Returns:
-            bool: True if 'func' ends before the timeout
-        '''
+    def __validate_wait_parameters(self, retry_interval, timeout):
         if retry_interval < AwsResource.MIN_RETRY_INTERVAL_SECONDS or retry_interval > AwsResource.MAX_RETRY_INTERVAL_SECONDS:
             raise AwsResourceParameterException(
                 'Invalid retry_interval value must be => {} and <= {}'.format(
@@ -142,22 +132,86 @@ class AwsResource:
                     AwsResource.MAX_TIMEOUT_SECONDS
                 )
             )
+
+    def __wait(self, intervals, timeout, func, *args, **kwargs):
         time_start = time.time()
         while True:
-            try:
-                result = func(*args, **kwargs)
-            except Exception as ex:
-                raise ex
+            result = func(*args, **kwargs)
             if result:
                 break
-            if int(time.time() - time_start) >= timeout:
+            elapsed = time.time() - time_start
+            if int(elapsed) >= timeout:
                 raise AwsResourceTimeoutException(
                     'Function {} timed out after {} seconds'.format(
                         func.__name__,
                         timeout
                     )
                 )
-            self.logger.info('Waiting %s seconds for next attempt...',
-                             retry_interval)
-            time.sleep(retry_interval)
+            # never sleep past the timeout
+            interval = min(next(intervals), timeout - elapsed)
+            self.logger.info('Waiting %.1f seconds for next attempt...',
+                             interval)
+            self.sleep(interval)
         return True
+
+    def sleep(self, seconds):
+        '''
+        Sleep between attempts of waits. Raises KeyboardInterrupt as
+        soon as cancel_event is set, so callers handle it as Ctrl-C.
+        '''
+        if self.cancel_event is None:
+            time.sleep(seconds)
+        elif self.cancel_event.wait(seconds):
+            raise KeyboardInterrupt()
+
+    def get_backoff_intervals(self, max_interval):
+        '''
+        Exponential backoff with jitter. Intervals start at
+        BACKOFF_INITIAL_SECONDS and double up to max_interval. Each one
+        is randomized between its half and its full value, so waits
+        started together don't poll in lockstep.
+        '''
+        interval = min(AwsResource.BACKOFF_INITIAL_SECONDS, max_interval)
+        while True:
+            yield random.uniform(interval / 2, interval)
+            interval = min(interval * 2, max_interval)
+
+    def wait_for(self, retry_interval, timeout, func, *args, **kwargs):
+        '''
+        Wait until the resource reaches a particular states. That happens
+        by checking the result of 'func'. The cycle ends when 'func' returns
+        a 'True' logical value.
+
+        Parameters:
+            retry_interval (int): Retry interval in seconds between calls to 'func'.
+            timeout (int): Max time in seconds that 'func' has to return True.
+            func (callable): Callable object
+            args (*args): 'func' positional args
+            kwargs (**kwargs): 'func' key word args
+
+        Returns:
+            bool: True if 'func' ends before the timeout
+        '''
+        self.__validate_wait_parameters(retry_interval, timeout)
+        return self.__wait(itertools.repeat(retry_interval), timeout,
+                           func, *args, **kwargs)
+
+    def wait_for_backoff(self, max_interval, timeout, func, *args, **kwargs):
+        '''
+        Same as 'wait_for', but 'func' is called again after short
+        intervals at first, growing with exponential backoff up to
+        'max_interval' seconds.
+
+        Parameters:
+            max_interval (int): Max interval in seconds between calls to 'func'.
+            timeout (int): Max time in seconds that 'func' has to return True.
+            func (callable): Callable object
+            args (*args): 'func' positional args
+            kwargs (**kwargs): 'func' key word args
+
+        Returns:
+            bool: True if 'func' ends before the timeout
+        '''
+        self.__validate_wait_parameters(max_interval, timeout)
+        return self.__wait(self.get_backoff_intervals(max_interval), timeout,
+                           func, *args, **kwargs)
@@ -27,6 +27,29 @@ class LaunchTemplate(AwsResource):
         except Exception as err:
             raise LaunchTemplateException(str(err))
 
+    def create_version(self, name, data, source_version='$Latest'):
+        '''
+        Add a version to launch template name, based on source_version
+        and replacing the settings found on data. Returns the new
+        version number.
+        '''
+        try:
+            self.logger.info('Creating {} version...'.format(name))
+            data = self.translate_dict_to_aws_config_names(data)
+            for k, v in data.items():
+                self.logger.info('{}={}'.format(k, v))
+            response = self.client().create_launch_template_version(
+                LaunchTemplateName=name,
+                SourceVersion=source_version,
+                VersionDescription='Create by thor',
+                LaunchTemplateData=data
+            )
+            version = response['LaunchTemplateVersion']['VersionNumber']
+            self.logger.info('Created version %s', version)
+            return version
+        except Exception as err:
+            raise LaunchTemplateException(str(err))
+
     def destroy(self, name):
         try:
             self.logger.info('Deleting {}...'.format(name))
@@ -1,3 +1,4 @@
+import botocore
 from thor.lib.aws_resources.aws_resource import AwsResource
 
 
@@ -22,6 +23,8 @@ class ParameterStore(AwsResource):
     STRING_TYPE = 'String'
     STRING_LIST_TYPE = 'StringList'
     SECURE_STRING_TYPE = 'SecureString'
+    # max names accepted by a single GetParameters call
+    MAX_GET_PARAMETERS = 10
 
     def __init__(self, env):
         super().__init__('ssm', env, alias='parameter')
@@ -81,8 +84,7 @@ class ParameterStore(AwsResource):
         except self.client().exceptions.ParameterNotFound:
             raise ParameterStoreNotFoundException()
 
-    def get(self, name):
-        parameter = self.read(name)
+    def __parse_value(self, parameter):
         if 'Value' in parameter:
             if parameter['Type'] == ParameterStore.STRING_LIST_TYPE:
                 return parameter['Value'].split(',')
@@ -93,6 +95,43 @@ class ParameterStore(AwsResource):
         else:
             return None
 
+    def get(self, name):
+        parameter = self.read(name)
+        return self.__parse_value(parameter)
+
+    def get_many(self, names):
+        '''
+        Get values of up to MAX_GET_PARAMETERS parameters in a
+        single request. Unsupported types are left out.
+
+        names (list): parameter full names
+
+        return (tuple): dict mapping names to values and list
+                        of names not found
+        '''
+        if len(names) > ParameterStore.MAX_GET_PARAMETERS:
+            raise ParameterStoreException(
+                'Cannot get more than {} parameters at once'.format(
+                    ParameterStore.MAX_GET_PARAMETERS))
+        try:
+            self.logger.info('Reading {}'.format(', '.join(names)))
+            response = self.client().get_parameters(
+                Names=names,
+                WithDecryption=False
+            )
+        except (self.client().exceptions.InternalServerError,
+                self.client().exceptions.InvalidKeyId,
+                botocore.exceptions.ClientError) as err:
+            raise ParameterStoreException(str(err))
+
+        values = {}
+        for parameter in response.get('Parameters', []):
+            try:
+                values[parameter['Name']] = self.__parse_value(parameter)
+            except ParameterStoreUnsupportedParamTypeException:
+                continue
+        return values, response.get('InvalidParameters', [])
+
     def list(self, path):
         try:
             response = self.tokenized(
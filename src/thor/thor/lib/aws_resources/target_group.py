@@ -0,0 +1,46 @@
+import botocore
+from thor.lib.aws_resources.aws_resource import AwsResource
+
+
+class TargetGroupException(Exception):
+    pass
+
+
+class TargetGroup(AwsResource):
+
+    HEALTHY_STATE = 'healthy'
+
+    def __init__(self, env):
+        super().__init__('elbv2', env, 'target_group')
+
+    def read_health(self, arn):
+        '''
+        Health state of targets registered on target group arn,
+        by target id.
+        '''
+        try:
+            response = self.client().describe_target_health(
+                TargetGroupArn=arn
+            )
+            return {x['Target']['Id']: x['TargetHealth']['State']
+                    for x in response['TargetHealthDescriptions']}
+        except botocore.exceptions.ClientError as err:
+            raise TargetGroupException(str(err))
+
+    def __check_targets_healthy(self, arn, target_ids):
+        health = self.read_health(arn)
+        healthy = [x for x in target_ids
+                   if health.get(x) == TargetGroup.HEALTHY_STATE]
+        self.logger.info('Healthy targets = {}/{}'.format(
+            len(healthy), len(target_ids)))
+        return len(healthy) == len(target_ids)
+
+    def wait_for_healthy(self, arn, target_ids, timeout=1200):
+        '''
+        Wait until all target_ids are registered and healthy on
+        target group arn.
+        '''
+        self.logger.info('Waiting targets to become healthy on %s...', arn)
+        self.wait_for_backoff(15, timeout, self.__check_targets_healthy,
+                              arn, target_ids)
+        self.logger.info('Targets healthy.')
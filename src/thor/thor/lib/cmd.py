@@ -4,7 +4,6 @@ import subprocess
 
 def run(cmdline, workdir=None):
     cmd_list = cmdline
-    current_dir = os.getcwd()
     output = ''
 
     if type(cmdline) is not list:
@@ -16,16 +15,18 @@ def run(cmdline, workdir=None):
                 raise Exception('Couldn\'t stat on dir {}'.format(
                     workdir
                 ))
-            os.chdir(workdir)
 
         print('Running: {}'.format(
             ' '.join(cmd_list)
         ))
+        # workdir is only set for the child process, current
+        # directory is shared by all threads.
         process = subprocess.Popen(
             cmd_list,
             text=True,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+            stderr=subprocess.PIPE,
+            cwd=workdir
         )
 
         while process.stdout.readable():
@@ -34,9 +35,6 @@ def run(cmdline, workdir=None):
                 break
             output += line.strip()
 
-        if workdir:
-            os.chdir(current_dir)
-
         return output
 
     except Exception as err:
@@ -48,7 +46,6 @@ def run(cmdline, workdir=None):
 
 def run_interactive(cmdline, workdir=None):
     cmd_to_run = cmdline
-    current_dir = os.getcwd()
 
     if type(cmdline) is list:
         cmd_to_run = ' '.join(cmdline)
@@ -59,13 +56,9 @@ def run_interactive(cmdline, workdir=None):
                 raise Exception('Couldn\'t stat on dir {}'.format(
                     workdir
                 ))
-            os.chdir(workdir)
 
         print('Running: {}'.format(cmd_to_run))
-        return_code = os.system(cmd_to_run)
-
-        if workdir:
-            os.chdir(current_dir)
+        return_code = subprocess.call(cmd_to_run, shell=True, cwd=workdir)
         return return_code
     except Exception as err:
         print('Error while running command "{cmd}" : {error}'.format(
@@ -1,21 +1,58 @@
 import base64
+import contextvars
+import fcntl
 import hashlib
 import os
 import json
-
+import logging
+import mmap
+import shutil
+import threading
+import time
+import zipfile
+
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait
+)
 from datetime import datetime
 from jinja2 import (
+    BaseLoader,
     Environment,
+    FileSystemBytecodeCache,
     FileSystemLoader,
+    ModuleLoader,
+    TemplateNotFound,
     TemplateSyntaxError,
-    UndefinedError
+    UndefinedError,
+    meta,
+    nodes,
+    pass_context
 )
 from thor.lib.base import Base
 from thor.lib.config import Config
 from thor.lib.thor import Thor
+from thor.lib.utils.file_copy import (
+    COPY_MODE,
+    HARDLINK_MODE,
+    install_file,
+    write_file_atomic
+)
+from thor.lib.utils.hashing import (
+    file_digest,
+    json_digest,
+    string_digest
+)
+from thor.lib.utils.merge import deep_merge
 from thor.lib.utils.names_generator import random_string
+from thor.lib.variables import (
+    Variables,
+    VariablesException
+)
 from thor.lib.aws_resources.parameter_store import (
     ParameterStore,
+    ParameterStoreException,
     ParameterStoreNotFoundException
 )
 
@@ -32,23 +69,726 @@ class CompilerException(Exception):
     pass
 
 
+class CompilerManifest(Base):
+    '''
+    Keeps track of the input digests used to generate each
+    build output, so incremental builds can skip outputs whose
+    inputs did not change since the previous build.
+    '''
+
+    FILE_NAME = 'build_manifest.json'
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.previous = {}
+        self.entries = {}
+        self.random_string = None
+
+    def load(self):
+        if os.path.exists(self.path):
+            self.logger.info(f'Loading manifest file {self.path}')
+            try:
+                with open(self.path, 'r') as f:
+                    content = json.load(f)
+                self.previous = content.get('entries', {})
+                self.random_string = content.get('random_string')
+            except (OSError, ValueError) as err:
+                # a broken manifest only means a full rebuild
+                self.logger.warning(f'Ignoring manifest file: {err}')
+                self.previous = {}
+        return self
+
+    def get_previous(self, output):
+        return self.previous.get(output)
+
+    def record(self, output, digest, params=None):
+        self.entries[output] = {
+            'digest': digest,
+            'params': params or {}
+        }
+
+    def keep(self, output):
+        self.entries[output] = self.previous[output]
+
+    def remove(self):
+        if os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError as err:
+                raise CompilerException(str(err))
+
+    def save(self):
+        manifest = {
+            'random_string': self.random_string,
+            'entries': self.entries
+        }
+        with open(self.path, 'w') as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        self.logger.info(f'Manifest file => {self.path}')
+
+
+class CompilerParamCache(Base):
+    '''
+    Read-through cache of parameter values for a single compile.
+    Parameters not found are cached as well, so each name is
+    requested at most once (or once per ttl seconds).
+    '''
+
+    def __init__(self, env, ttl=None):
+        super().__init__()
+        self.env = env
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    def __is_expired(self, entry):
+        if self.ttl is None:
+            return False
+        return time.monotonic() - entry['time'] > self.ttl
+
+    def __store(self, name, value, found):
+        with self.lock:
+            self.entries[name] = {
+                'value': value,
+                'found': found,
+                'time': time.monotonic()
+            }
+
+    def put(self, name, value):
+        self.__store(name, value, True)
+
+    def put_not_found(self, name):
+        self.__store(name, None, False)
+
+    def get(self, name):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and not self.__is_expired(entry):
+                self.hits += 1
+                if not entry['found']:
+                    self.negative_hits += 1
+                    raise ParameterStoreNotFoundException()
+                return entry['value']
+            self.misses += 1
+
+        try:
+            value = ParameterStore(self.env).get(name)
+        except ParameterStoreNotFoundException:
+            self.put_not_found(name)
+            raise
+        self.put(name, value)
+        return value
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'negative_hits': self.negative_hits,
+            'size': len(self.entries),
+            'ttl': self.ttl
+        }
+
+
+class CompilerBundleLoader(BaseLoader):
+    '''
+    Loads templates from a bundle of precompiled modules, so they
+    are not parsed again. Sources are still read from the template
+    dirs (dependencies, parameter names) and templates missing from
+    the bundle are loaded from there.
+    '''
+
+    def __init__(self, bundle_file, loader):
+        self.module_loader = ModuleLoader(bundle_file)
+        self.loader = loader
+
+    def get_source(self, environment, template):
+        return self.loader.get_source(environment, template)
+
+    def list_templates(self):
+        return self.loader.list_templates()
+
+    def load(self, environment, name, globals=None):
+        try:
+            return self.module_loader.load(environment, name, globals)
+        except TemplateNotFound:
+            return self.loader.load(environment, name, globals)
+
+
+class CompilerValidator(Base):
+    '''
+    Checks templates before the build starts: syntax, unknown filters
+    and tests, and references to undefined variables. References that
+    fail rendering (e.g. var.missing.key) are errors, the ones rendered
+    as empty strings (e.g. var.missing) or only read under a condition
+    (if branches, loops, macros) are warnings.
+    '''
+
+    # names defined by jinja while rendering
+    SPECIAL_NAMES = ['loop', 'self', 'super', 'caller', 'varargs', 'kwargs']
+    # references under these filters and tests may be undefined
+    OPTIONAL_FILTERS = ['default', 'd']
+    OPTIONAL_TESTS = ['defined', 'undefined', 'none']
+
+    def __init__(self, jinja_env, variables=None):
+        super().__init__()
+        self.jinja_env = jinja_env
+        self.variables = variables
+        self.errors = []
+        self.warnings = []
+
+    def validate(self, analyses):
+        '''
+        Validate (name, analysis) templates. Returns all errors found.
+        '''
+        included = set()
+
+        for name, analysis in analyses:
+            included.update(analysis['templates'])
+
+        for name, analysis in analyses:
+            # included templates may use names set by the ones
+            # including them, only their variables are checked.
+            self.validate_analysis(name, analysis, name not in included)
+        return self.errors
+
+    def analyze(self, ast):
+        '''
+        What validation and parameters prefetch need from a template,
+        as json, so it's saved with precompiled bundles and templates
+        are not parsed again.
+        '''
+        compile_error = None
+        try:
+            undeclared = meta.find_undeclared_variables(ast)
+        except TemplateSyntaxError as err:
+            # raised compiling the template, e.g. unknown filters
+            compile_error = [err.lineno, err.message]
+            undeclared = self.find_undeclared_names(ast)
+
+        params = set()
+        for node in ast.find_all(nodes.Filter):
+            if node.name not in CompilerFilters.PARAM_FILTERS:
+                continue
+            if type(node.node) is nodes.Const and \
+                    type(node.node.value) is str:
+                params.add(node.node.value)
+
+        return {
+            'templates': list(meta.find_referenced_templates(ast)),
+            'filters': [[x.name, x.lineno]
+                        for x in ast.find_all(nodes.Filter)],
+            'tests': [[x.name, x.lineno] for x in ast.find_all(nodes.Test)],
+            'compile_error': compile_error,
+            'undeclared': sorted(undeclared),
+            'references': self.find_references(ast),
+            'params': sorted(params)
+        }
+
+    def get_chain(self, node):
+        '''
+        Names of a reference, e.g. ['var', 'a', 'b'] for var.a['b'].
+        Keys after a non literal key can't be known and are dropped.
+        '''
+        keys = []
+        while type(node) in (nodes.Getattr, nodes.Getitem):
+            if type(node) is nodes.Getattr:
+                keys.append(node.attr)
+            elif type(node.arg) is nodes.Const:
+                keys.append(node.arg.value)
+            else:
+                keys = []
+            node = node.node
+
+        if type(node) is not nodes.Name or not node.ctx == 'load':
+            return None
+        return [node.name] + list(reversed(keys))
+
+    def is_guard(self, node, parent, guard):
+        '''
+        Whether node is tested by an if, including the operands of
+        and, or and not, e.g. {% if var.a and var.a.b %}.
+        '''
+        if type(parent) in (nodes.If, nodes.CondExpr):
+            return parent.test is node
+        if type(parent) in (nodes.And, nodes.Or, nodes.Not):
+            return guard
+        return False
+
+    def is_conditional(self, node, parent):
+        '''
+        Whether node may not run when its parent does: if branches,
+        loop bodies, macros and call blocks, and the right operand
+        of and, or.
+        '''
+        if type(parent) is nodes.If:
+            return parent.test is not node
+        if type(parent) is nodes.CondExpr:
+            return parent.test is not node
+        if type(parent) is nodes.For:
+            return parent.iter is not node
+        if type(parent) in (nodes.Macro, nodes.CallBlock):
+            return any(x is node for x in parent.body)
+        if type(parent) in (nodes.And, nodes.Or):
+            return parent.right is node
+        return False
+
+    def is_optional(self, node, parent):
+        if type(parent) is nodes.Filter:
+            return parent.node is node and \
+                parent.name in CompilerValidator.OPTIONAL_FILTERS
+        if type(parent) is nodes.Test:
+            return parent.node is node and \
+                parent.name in CompilerValidator.OPTIONAL_TESTS
+        return False
+
+    def find_references(self, node, parent=None, references=None,
+                        guard=False, conditional=False):
+        '''
+        List (chain, lineno, optional, conditional) of the outermost
+        references. Conditional ones are not read on every render.
+        '''
+        if references is None:
+            references = []
+        reference_types = (nodes.Name, nodes.Getattr, nodes.Getitem)
+        guard = self.is_guard(node, parent, guard)
+        conditional = conditional or self.is_conditional(node, parent)
+
+        if type(node) in reference_types and not (
+                type(parent) in (nodes.Getattr, nodes.Getitem) and
+                parent.node is node):
+            chain = self.get_chain(node)
+            if chain:
+                references.append([chain, node.lineno, guard or
+                                   self.is_optional(node, parent),
+                                   conditional])
+
+        for child in node.iter_child_nodes():
+            self.find_references(child, node, references, guard,
+                                 conditional)
+        return references
+
+    def find_missing_key(self, chain):
+        '''
+        Index of the first key of chain not found on variables,
+        None when it's found or can't be known.
+        '''
+        value = self.variables
+        for i, key in enumerate(chain):
+            if not type(value) is dict:
+                return None
+            if key in value:
+                value = value[key]
+            elif hasattr(value, str(key)):
+                # dict methods, e.g. var.get('a')
+                return None
+            else:
+                return i
+        return None
+
+    def find_undeclared_names(self, ast):
+        '''
+        Approximation of meta.find_undeclared_variables for templates
+        that can't be compiled: names read and never assigned.
+        '''
+        assigned = set()
+        for node in ast.find_all(nodes.Name):
+            if node.ctx in ('store', 'param'):
+                assigned.add(node.name)
+        for node in ast.find_all((nodes.Macro, nodes.Import)):
+            assigned.add(node.name if type(node) is nodes.Macro
+                         else node.target)
+        for node in ast.find_all(nodes.FromImport):
+            for import_name in node.names:
+                assigned.add(import_name if type(import_name) is str
+                             else import_name[1])
+        return set(x.name for x in ast.find_all(nodes.Name)
+                   if x.ctx == 'load' and x.name not in assigned)
+
+    def validate_analysis(self, name, analysis, check_names):
+        errors = set()
+        warnings = set()
+
+        for filter_name, lineno in analysis['filters']:
+            if filter_name not in self.jinja_env.filters:
+                errors.add(f'{name}:{lineno}: unknown filter {filter_name}')
+        for test_name, lineno in analysis['tests']:
+            if test_name not in self.jinja_env.tests:
+                errors.add(f'{name}:{lineno}: unknown test {test_name}')
+
+        if analysis['compile_error'] and not errors:
+            lineno, message = analysis['compile_error']
+            errors.add(f'{name}:{lineno}: {message}')
+        undeclared = set(analysis['undeclared'])
+        references = analysis['references']
+        optional = [x[0] for x in references if x[2]]
+
+        for chain, lineno, _, conditional in references:
+            root = chain[0]
+            if root not in undeclared or \
+                    root in self.jinja_env.globals or \
+                    root in CompilerValidator.SPECIAL_NAMES:
+                continue
+            if root not in self.variables and not check_names:
+                continue
+            if any(chain[:len(x)] == x for x in optional):
+                continue
+
+            index = self.find_missing_key(chain)
+            if index is None:
+                continue
+            missing = '.'.join(str(x) for x in chain[:index + 1])
+            if index == len(chain) - 1:
+                warnings.add(f'{name}:{lineno}: {missing} is undefined')
+            elif conditional:
+                # fails rendering only if the condition holds
+                warnings.add(f'{name}:{lineno}: {missing} is undefined, '
+                             f'can\'t read {chain[index + 1]}')
+            else:
+                errors.add(f'{name}:{lineno}: {missing} is undefined, '
+                           f'can\'t read {chain[index + 1]}')
+
+        self.errors.extend(sorted(errors))
+        self.warnings.extend(sorted(warnings))
+
+
+class CompilerFileCache(Base):
+    '''
+    Content of files included by templates, kept for a single
+    compile. Entries are checked against the file inode, mtime and
+    size, so files changed while compiling are read again.
+    '''
+
+    # files of this size or bigger are mapped instead of read
+    MMAP_MIN_SIZE = 1024 * 1024
+
+    def __init__(self):
+        super().__init__()
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def decode_text(data):
+        text = str(data, 'utf-8')
+        # same newlines as reading the file in text mode
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text
+
+    @staticmethod
+    def encode_b64(data):
+        # data may be a mmap, so the file itself is never copied into
+        # memory. The encoded text is, twice while converted to str.
+        return base64.b64encode(data).decode('ascii')
+
+    def read(self, path, encode):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < CompilerFileCache.MMAP_MIN_SIZE:
+                return encode(f.read())
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return encode(data)
+
+    def get(self, path, encode):
+        '''
+        Content of file on path, transformed by encode function.
+        '''
+        stat = os.stat(path)
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        key = (path, encode.__name__)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['version'] == version:
+                self.hits += 1
+                return entry['value']
+            self.misses += 1
+
+        value = self.read(path, encode)
+        with self.lock:
+            self.entries[key] = {
+                'version': version,
+                'value': value
+            }
+        return value
+
+    def get_text(self, path):
+        return self.get(path, CompilerFileCache.decode_text)
+
+    def get_b64(self, path):
+        return self.get(path, CompilerFileCache.encode_b64)
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.entries)
+        }
+
+
+class CompilerHashCache(Base):
+    '''
+    Digests of files, saved across compiles. Entries are checked
+    against the file mtime and size, so files are only hashed
+    again when they change.
+    '''
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.is_changed = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as err:
+                self.logger.warning(f'Ignoring hash cache file: {err}')
+                self.entries = {}
+        return self
+
+    def save(self):
+        if not self.is_changed:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with self.lock:
+                content = json.dumps(self.entries, sort_keys=True)
+            write_file_atomic(self.path, content)
+            self.is_changed = False
+        except OSError as err:
+            # only means files are hashed again next time
+            self.logger.warning(f'Fail to save hash cache: {err}')
+
+    def get(self, name, path, algorithm='sha256'):
+        '''
+        Digest of file on path. name identifies the file across
+        compiles, path may change (e.g. build stage dirs).
+        '''
+        stat = os.stat(path)
+        key = f'{algorithm}:{name}'
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and \
+                    entry['mtime'] == stat.st_mtime_ns and \
+                    entry['size'] == stat.st_size:
+                self.hits += 1
+                return entry['digest']
+            self.misses += 1
+
+        digest = file_digest(path, algorithm)
+        with self.lock:
+            self.entries[key] = {
+                'mtime': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'digest': digest
+            }
+            self.is_changed = True
+        return digest
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.entries)
+        }
+
+
+class CompilerAnalysisCache(Base):
+    '''
+    Template analyses (see CompilerValidator.analyze) by source
+    digest, saved across compiles in the same format as precompiled
+    bundles, so unchanged sources are not parsed again. Only the
+    entries used by the last compile are kept.
+    '''
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.entries = {}
+        self.used = {}
+        self.is_changed = False
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as err:
+                self.logger.warning(f'Ignoring analysis cache file: {err}')
+                self.entries = {}
+        return self
+
+    def save(self):
+        if not self.is_changed and len(self.used) == len(self.entries):
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_file_atomic(self.path, json.dumps(self.used))
+            self.entries = self.used
+            self.is_changed = False
+        except OSError as err:
+            # only means templates are parsed again next time
+            self.logger.warning(f'Fail to save analysis cache: {err}')
+
+    def get(self, digest):
+        analysis = self.entries.get(digest)
+        if analysis is not None:
+            self.used[digest] = analysis
+        return analysis
+
+    def set(self, digest, analysis):
+        self.used[digest] = analysis
+        self.is_changed = True
+
+
+class CompilerProfiler(Base):
+    '''
+    Optional instrumentation of a compile: phase, template render,
+    filter and static copy times, saved on build_info.json. Records
+    nothing unless enabled.
+    '''
+
+    def __init__(self, enabled=False):
+        super().__init__()
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.templates = {}
+        self.filters = {}
+        self.counters = {}
+        self.static = {'files': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def record_phase(self, name, seconds):
+        if self.enabled:
+            self.phases[name] = round(seconds, 4)
+
+    def record_template(self, output, seconds, size, written):
+        if self.enabled:
+            with self.lock:
+                self.templates[output] = {
+                    'seconds': round(seconds, 4),
+                    'bytes': size,
+                    'written': written
+                }
+
+    def record_copy(self, size, seconds):
+        if self.enabled:
+            with self.lock:
+                self.static['files'] += 1
+                self.static['bytes'] += size
+                self.static['seconds'] += seconds
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_filter(self, name, seconds):
+        with self.lock:
+            entry = self.filters.setdefault(name, {'calls': 0, 'seconds': 0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+
+    def wrap_filter(self, name, func):
+        '''
+        Time every call of filter func. Returns func as it is when
+        profiling is not enabled.
+        '''
+        if not self.enabled:
+            return func
+
+        def filter_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record_filter(name, time.perf_counter() - start)
+
+        # keep the context jinja passes to func, if any
+        pass_arg = getattr(func, 'jinja_pass_arg', None)
+        if pass_arg is not None:
+            filter_wrapper.jinja_pass_arg = pass_arg
+        return filter_wrapper
+
+    def get_report(self):
+        with self.lock:
+            static = dict(self.static)
+            if static['seconds'] > 0:
+                static['mb_per_second'] = round(
+                    static['bytes'] / static['seconds'] / 1024 / 1024, 2)
+            static['seconds'] = round(static['seconds'], 4)
+            return {
+                'phases': dict(self.phases),
+                'templates': dict(self.templates),
+                'filters': {
+                    name: {'calls': x['calls'],
+                           'seconds': round(x['seconds'], 4)}
+                    for name, x in self.filters.items()
+                },
+                'static': static,
+                'counters': dict(self.counters)
+            }
+
+
 class Compiler(Base):
 
-    def __init__(self, image):
+    # max concurrent requests when prefetching parameters
+    PREFETCH_MAX_WORKERS = 4
+    # template analyses saved on precompiled bundles
+    BUNDLE_ANALYSES_FILE = 'analyses.json'
+    # name of the target running on the current thread
+    current_target = contextvars.ContextVar('current_target', default=None)
+
+    # build_info.json fields left out of deterministic builds
+    VOLATILE_BUILD_INFO = ['start_time', 'end_time', 'params_cache',
+                           'file_cache', 'hash_cache', 'targets', 'renders']
+
+    def __init__(self, image, incremental=False, jobs=1,
+                 static_mode=COPY_MODE, params_ttl=None, wait_clean=False,
+                 profile=False, deterministic=False, seed=None):
         super().__init__()
         self.image = image
+        # targets run as soon as the ones they depend on are done.
+        # outputs is the prefix of the build dir paths they write.
         self.build_targets = [
-            {'name': 'clean', 'func': self.build_target_clean},
-            {'name': 'static', 'func': self.build_target_static},
-            {'name': 'templates', 'func': self.build_target_templates},
-            {'name': 'packer', 'func': self.build_target_packer},
-            {'name': 'config', 'func': self.build_target_config}
+            {'name': 'clean', 'func': self.build_target_clean,
+             'depends': [], 'outputs': None},
+            {'name': 'static', 'func': self.build_target_static,
+             'depends': ['clean'], 'outputs': 'static/'},
+            {'name': 'templates', 'func': self.build_target_templates,
+             'depends': ['clean'], 'outputs': 'templates/'},
+            {'name': 'packer', 'func': self.build_target_packer,
+             'depends': ['clean'], 'outputs': 'packer.json'},
+            {'name': 'config', 'func': self.build_target_config,
+             'depends': ['clean'], 'outputs': 'config.json'}
         ]
-        self.build_dir = '{base_build_dir}/{env_name}/{image_name}'.format(
-            base_build_dir=Thor.BUILD_DIR,
-            env_name=image.env.get_name(),
-            image_name=image.get_name()
-        )
+        self.target_events = {}
+        self.target_times = {}
+        # old builds are deleted in background, the process waits
+        # for them before exiting.
+        self.clean_threads = []
+        # removes leftovers of older compiles while building
+        self.reap_thread = None
+        self.wait_clean = wait_clean
+        self.build_dir = image.get_build_dir()
+        # outputs are written on stage_dir and unchanged outputs are
+        # taken from previous_dir. Both are build_dir unless staged.
+        self.stage_dir = self.build_dir
+        self.previous_dir = self.build_dir
+        # held while the stage is written, see get_stale_builds
+        self.stage_lock = None
         # compiler overrides default config file localtion
         # to use the one after build process.
         self.image.config = Config(f'{self.build_dir}/config.json')
@@ -58,45 +798,65 @@ class Compiler(Base):
         self.artifacts = []
         self.random_string = random_string()
         self.variables = None
+        self.variables_digest = None
+        self.incremental = incremental
+        # rendered outputs, unchanged ones keep previous build file
+        self.written_outputs = []
+        self.unchanged_outputs = []
+        self.jobs = max(1, jobs)
+        self.static_mode = static_mode
+        self.manifest = CompilerManifest(
+            f'{self.build_dir}/{CompilerManifest.FILE_NAME}')
+        # parameters read by the template being rendered,
+        # templates can be rendered by different threads.
+        self.render_state = threading.local()
+        self.params_cache = CompilerParamCache(image.env, params_ttl)
+        self.file_cache = CompilerFileCache()
+        self.profiler = CompilerProfiler(profile)
+        self.hash_cache = CompilerHashCache('{}/hashes/{}/{}.json'.format(
+            Thor.CACHE_DIR, image.env.get_name(), image.get_name())).load()
+        self.analysis_cache = CompilerAnalysisCache(
+            '{}/analyses/{}/{}.json'.format(
+                Thor.CACHE_DIR, image.env.get_name(), image.get_name()))
+
+        if self.incremental:
+            self.manifest.load()
+            # keep random string stable, otherwise every output
+            # referencing it would have to be rendered again.
+            if self.manifest.random_string:
+                self.random_string = self.manifest.random_string
+        # a given seed also makes the build deterministic
+        self.deterministic = deterministic or seed is not None
+        self.seed = seed
+        if self.deterministic:
+            self.random_string = random_string(seed=self.get_seed())
+        self.manifest.random_string = self.random_string
         self.is_build_dir_created = False
-        self.__saved_dir = None
+        self.jinja_env = None
+        self.jinja_env_lock = threading.Lock()
+        # template analyses of the precompiled bundle by source digest
+        self.bundle_analyses = {}
 
     def __create_build_dirs(self):
         if not self.is_build_dir_created:
-            if not os.path.exists(self.build_dir):
-                self.logger.info(f'Creating dir {self.build_dir}')
+            if not os.path.exists(self.stage_dir):
+                self.logger.info(f'Creating dir {self.stage_dir}')
                 try:
-                    os.makedirs(self.build_dir)
+                    os.makedirs(self.stage_dir, exist_ok=True)
                     self.is_build_dir_created = True
                 except OSError as err:
-                    self.logger.error(f'Fail to create dir {self.build_dir}')
+                    self.logger.error(f'Fail to create dir {self.stage_dir}')
                     raise CompilerException(str(err))
 
-    def __cd(self, path):
-        try:
-            self.logger.info(f'cd {path}')
-            os.chdir(path)
-        except OSError as err:
-            self.logger.error(f'Fail to cd into {path}')
-            raise CompilerException(str(err))
-
     def __enter__(self):
+        # Kept for backward compatibility. Compiler only works with
+        # absolute paths and never changes the current directory, so
+        # many compilers can run on the same process.
         self.__create_build_dirs()
-        self.__saved_dir = os.getcwd()
-        self.__cd(self.build_dir)
         return self
 
     def __exit__(self, type, value, traceback):
-        self.__cd(self.__saved_dir)
-        self.__saved_dir = None
-
-    def load_json_file(self, path):
-        if os.path.exists(path):
-            self.logger.info(f'Loading variables file {path}')
-            with open(path) as f:
-                return json.load(f)
-        else:
-            return {}
+        pass
 
     def get_artifacts(self):
         return self.artifacts
@@ -109,23 +869,403 @@ class Compiler(Base):
 
     def get_variables(self):
         if self.variables is None:
-            env_vars = self.load_json_file(self.image.env.get_variables_file())
-            img_vars = self.load_json_file(self.image.get_variables_file())
-            merged = dict(env_vars)
-
-            for k, v in img_vars.items():
-                if k in merged:
-                    if type(v) is dict:
-                        merged[k] = {**merged[k], **v}
-                    elif type(v) is list:
-                        merged[k] = merged[k] + v
-                    else:
-                        merged[k] = v
-                else:
-                    merged[k] = v
-            self.variables = merged
+            try:
+                self.variables = Variables(self.image.env, self.image).load()
+            except (OSError, VariablesException) as err:
+                self.abort_build(str(err))
         return self.variables
 
+    def get_variables_digest(self):
+        if self.variables_digest is None:
+            self.variables_digest = json_digest(
+                self.generate_template_variables())
+        return self.variables_digest
+
+    def get_input_files(self):
+        '''
+        List (name, path) of all files read by the build: templates,
+        static files, packer.json, config.json and variables files.
+        '''
+        input_files = []
+        source_dirs = self.get_template_dirs() + [
+            self.image.get_static_dir()]
+
+        for source_dir in source_dirs:
+            for base_dir, sub_dirs, files in os.walk(source_dir):
+                for file_name in files:
+                    input_files.append(f'{base_dir}/{file_name}')
+        input_files += [
+            self.image.get_packer_file(),
+            self.image.env.get_config_file(),
+            self.image.get_config_file()
+        ]
+        input_files += Variables(self.image.env, self.image).get_files()
+        return sorted((os.path.relpath(x, Thor.ROOT_DIR), x)
+                      for x in input_files if os.path.isfile(x))
+
+    def get_inputs_digest(self):
+        '''
+        Digest of the content of all input files. Files are hashed
+        through the hash cache, so unchanged files aren't read again.
+        '''
+        digests = [self.image.env.get_name(), self.image.get_name()]
+        for name, path in self.get_input_files():
+            digests += [name, self.hash_cache.get(f'source:{name}', path)]
+        return string_digest(*digests)
+
+    def get_seed(self):
+        if self.seed is not None:
+            return str(self.seed)
+        return self.get_inputs_digest()
+
+    def get_output_name(self, path):
+        return os.path.relpath(path, self.stage_dir)
+
+    def get_param_full_name(self, name):
+        return f'/thor/{self.image.env.get_name()}/{name}'
+
+    def lookup_param(self, name):
+        return self.params_cache.get(name)
+
+    def get_param(self, name):
+        value = self.lookup_param(name)
+
+        used_params = getattr(self.render_state, 'used_params', None)
+        if used_params is not None:
+            used_params[name] = json_digest(value)
+        return value
+
+    def start_params_tracking(self):
+        self.render_state.used_params = {}
+
+    def stop_params_tracking(self):
+        used_params = self.render_state.used_params
+        self.render_state.used_params = None
+        return used_params
+
+    def is_up_to_date(self, output, digest):
+        '''
+        Check whether an output from the previous build can be kept
+        as it is. Always False when not running an incremental build.
+
+        output (str): path relative to the build dir
+        digest (str): digest of the inputs used to generate output
+        '''
+        if not self.incremental or digest is None:
+            return False
+
+        entry = self.manifest.get_previous(output)
+        if entry is None or not entry['digest'] == digest:
+            return False
+        if not os.path.exists(f'{self.previous_dir}/{output}'):
+            return False
+        # parameters are not part of the digest, they must
+        # be read again to know if they changed.
+        for name, value_digest in entry['params'].items():
+            try:
+                if not json_digest(self.lookup_param(name)) == value_digest:
+                    return False
+            except ParameterStoreNotFoundException:
+                return False
+        try:
+            self.keep_output(output)
+        except OSError as err:
+            self.logger.warning(f'Fail to keep {output}: {err}')
+            return False
+        self.manifest.keep(output)
+        return True
+
+    def is_same_output(self, output, content):
+        '''
+        Check whether the output of the previous build holds exactly
+        content (bytes), comparing sizes and then digests.
+        '''
+        previous_file = f'{self.previous_dir}/{output}'
+        try:
+            if not os.path.getsize(previous_file) == len(content):
+                return False
+            return file_digest(previous_file) == \
+                hashlib.sha256(content).hexdigest()
+        except OSError:
+            return False
+
+    def keep_output(self, output):
+        '''
+        Bring an output of the previous build into the staged one.
+        It's hardlinked, so unchanged files are never written again.
+        '''
+        if self.stage_dir == self.previous_dir:
+            return
+        dst_file = f'{self.stage_dir}/{output}'
+        os.makedirs(os.path.dirname(dst_file), exist_ok=True)
+        install_file(f'{self.previous_dir}/{output}', dst_file,
+                     HARDLINK_MODE)
+
+    def record_output(self, output, digest, params=None):
+        if self.incremental:
+            self.manifest.record(output, digest, params)
+
+    def save_manifest(self):
+        if self.incremental:
+            self.manifest.save()
+        else:
+            # outputs were written without being tracked, so the
+            # manifest left by a previous build no longer holds.
+            self.manifest.remove()
+
+    def get_template_dirs(self):
+        # Last in the list replaces top ones.
+        # This is ordered to resolves conflits, if any.
+        #
+        # 1. global templates
+        # 2. environment templates
+        # 3. image templates
+        return [
+            self.image.get_template_dir(),
+            self.image.env.get_template_dir(),
+            Thor.TEMPLATES_DIR,
+        ]
+
+    @classmethod
+    def get_bytecode_cache(cls):
+        cache_dir = f'{Thor.CACHE_DIR}/jinja'
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as err:
+            logger = logging.getLogger(cls.__name__)
+            logger.warning(f'Bytecode cache disabled: {err}')
+            return None
+        # buckets are validated against the template source checksum,
+        # so a changed template is always compiled again.
+        return FileSystemBytecodeCache(cache_dir)
+
+    def get_bundle_file(self):
+        return '{}/precompiled/{}/{}.zip'.format(
+            Thor.CACHE_DIR, self.image.env.get_name(), self.image.get_name())
+
+    def get_templates_mtime(self):
+        '''
+        Latest change on template dirs. Directories are included,
+        their mtime changes when templates are added or removed.
+        '''
+        mtime = 0
+        for template_dir in self.get_template_dirs():
+            for base_dir, sub_dirs, files in os.walk(template_dir):
+                for name in [base_dir] + [f'{base_dir}/{x}' for x in files]:
+                    mtime = max(mtime, os.stat(name).st_mtime_ns)
+        return mtime
+
+    def get_loader(self):
+        loader = FileSystemLoader(self.get_template_dirs())
+        bundle_file = self.get_bundle_file()
+
+        try:
+            bundle_mtime = os.stat(bundle_file).st_mtime_ns
+        except OSError:
+            return loader
+
+        if bundle_mtime > self.get_templates_mtime():
+            self.logger.info(f'Loading templates from {bundle_file}')
+            self.bundle_analyses = self.read_bundle_analyses(bundle_file)
+            return CompilerBundleLoader(bundle_file, loader)
+        self.logger.info(f'Ignoring outdated bundle {bundle_file}')
+        return loader
+
+    def read_bundle_analyses(self, bundle_file):
+        try:
+            with zipfile.ZipFile(bundle_file) as bundle:
+                return json.loads(
+                    bundle.read(Compiler.BUNDLE_ANALYSES_FILE))
+        except (KeyError, OSError, ValueError, zipfile.BadZipFile) as err:
+            # bundles without analyses, templates are parsed
+            self.logger.debug(f'No template analyses on bundle: {err}')
+            return {}
+
+    def write_bundle_analyses(self, bundle_file, jinja_env):
+        '''
+        Save the analyses of all template sources with the bundle,
+        validation and parameters prefetch use them instead of parsing
+        sources with the same digest.
+        '''
+        validator = CompilerValidator(jinja_env)
+        analyses = {}
+
+        for name, source in self.get_template_sources(jinja_env):
+            try:
+                ast = jinja_env.parse(source, name=name)
+            except TemplateSyntaxError:
+                # reported by validation when compiling
+                continue
+            analyses[string_digest(source)] = validator.analyze(ast)
+
+        with zipfile.ZipFile(bundle_file, 'a') as bundle:
+            bundle.writestr(Compiler.BUNDLE_ANALYSES_FILE,
+                            json.dumps(analyses))
+
+    def precompile(self):
+        '''
+        Compile templates of the template dirs into a zip of python
+        modules, loaded by later compiles instead of the sources
+        while it's newer than them.
+        '''
+        bundle_file = self.get_bundle_file()
+        tmp_bundle_file = f'{bundle_file}.{random_string()}.tmp'
+        jinja_env = Environment(
+            loader=FileSystemLoader(self.get_template_dirs()))
+        # filters are resolved when templates are compiled
+        CompilerFilters(self).register(jinja_env)
+
+        try:
+            os.makedirs(os.path.dirname(bundle_file), exist_ok=True)
+            jinja_env.compile_templates(tmp_bundle_file,
+                                        log_function=self.logger.debug,
+                                        ignore_errors=False)
+            self.write_bundle_analyses(tmp_bundle_file, jinja_env)
+            os.replace(tmp_bundle_file, bundle_file)
+        except TemplateSyntaxError as err:
+            raise CompilerException(
+                f'Fail to precompile {err.filename}:{err.lineno} {err}')
+        except OSError as err:
+            raise CompilerException(f'Fail to precompile: {err}')
+        finally:
+            if os.path.exists(tmp_bundle_file):
+                os.remove(tmp_bundle_file)
+        self.logger.info(f'Templates bundle => {bundle_file}')
+        return bundle_file
+
+    def get_jinja_env(self):
+        '''
+        Jinja environment shared by all targets of this compile.
+        '''
+        with self.jinja_env_lock:
+            if self.jinja_env is None:
+                jinja_env = Environment(
+                    loader=self.get_loader(),
+                    bytecode_cache=self.get_bytecode_cache())
+                CompilerFilters(self).register(jinja_env)
+                self.jinja_env = jinja_env
+        return self.jinja_env
+
+    def get_template_sources(self, jinja_env=None):
+        '''
+        List (name, source) of all templates used by the build:
+        template dirs, packer.json and config.json files.
+        '''
+        if jinja_env is None:
+            jinja_env = self.get_jinja_env()
+        sources = []
+
+        for template in jinja_env.list_templates():
+            source, _, _ = jinja_env.loader.get_source(jinja_env, template)
+            sources.append((template, source))
+
+        source_files = [
+            self.image.get_packer_file(),
+            self.image.env.get_config_file(),
+            self.image.get_config_file()
+        ]
+        for source_file in source_files:
+            if os.path.exists(source_file):
+                with open(source_file, 'r') as f:
+                    sources.append((source_file, f.read()))
+        return sources
+
+    def analyze_templates(self, sources=None):
+        '''
+        Parse all templates used by the build once, for validation and
+        parameters prefetch. Analyses of the same source found on the
+        precompiled bundle or the analysis cache are used instead.
+        Returns (name, analysis) of the ones parsed and the syntax
+        errors found.
+        '''
+        jinja_env = self.get_jinja_env()
+        validator = CompilerValidator(jinja_env)
+        analyses = []
+        errors = []
+
+        if sources is None:
+            sources = self.get_template_sources()
+        self.analysis_cache.load()
+
+        for name, source in sources:
+            digest = string_digest(source)
+            analysis = self.bundle_analyses.get(digest) or \
+                self.analysis_cache.get(digest)
+            if analysis is None:
+                try:
+                    ast = jinja_env.parse(source, name=name)
+                except TemplateSyntaxError as err:
+                    errors.append(f'{name}:{err.lineno}: {err.message}')
+                    continue
+                analysis = validator.analyze(ast)
+                self.analysis_cache.set(digest, analysis)
+            analyses.append((name, analysis))
+
+        self.analysis_cache.save()
+        return analyses, errors
+
+    def validate_templates(self, analyses=None, syntax_errors=None):
+        '''
+        Check all templates before any file is written or parameter
+        read, reporting every error found at once.
+        '''
+        if analyses is None:
+            analyses, syntax_errors = self.analyze_templates()
+        validator = CompilerValidator(self.get_jinja_env(),
+                                      self.generate_template_variables())
+        validator.errors.extend(syntax_errors)
+        errors = validator.validate(analyses)
+
+        for warning in validator.warnings:
+            self.logger.warning(warning)
+        for error in errors:
+            self.logger.error(error)
+        if errors:
+            self.abort_build(f'Found {len(errors)} errors on templates')
+
+    def find_template_params(self, analyses=None):
+        '''
+        Find parameter names given as literals to get_param filters.
+        Templates with syntax errors are left out.
+        '''
+        if analyses is None:
+            analyses, _ = self.analyze_templates()
+        names = set()
+
+        for template, analysis in analyses:
+            for name in analysis['params']:
+                names.add(self.get_param_full_name(name))
+        return sorted(names)
+
+    def prefetch_params(self, analyses=None):
+        '''
+        Read all parameters referenced by templates in batches into
+        the parameters cache, so get_param filters don't wait on one
+        request per call.
+        '''
+        names = self.find_template_params(analyses)
+        if not names:
+            return
+
+        size = ParameterStore.MAX_GET_PARAMETERS
+        batches = [names[i:i+size] for i in range(0, len(names), size)]
+        workers = min(len(batches), Compiler.PREFETCH_MAX_WORKERS)
+        param = ParameterStore(self.image.env)
+        self.logger.info(f'Prefetching {len(names)} parameters...')
+
+        self.profiler.count('ssm_get_parameters', len(batches))
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for values, not_found in pool.map(param.get_many, batches):
+                    for name, value in values.items():
+                        self.params_cache.put(name, value)
+                    for name in not_found:
+                        self.params_cache.put_not_found(name)
+        except ParameterStoreException as err:
+            # parameters missing from cache are read on demand
+            self.logger.warning(f'Fail to prefetch parameters: {err}')
+
     def get_thor_variables(self):
         return {
             'env': self.image.env.get_name(),
@@ -151,9 +1291,27 @@ class Compiler(Base):
         build_info = {
             'start_time': str(self.start_time),
             'end_time': str(self.end_time),
-            'variables': self.generate_template_variables()
+            'variables': self.generate_template_variables(),
+            'params_cache': self.params_cache.get_stats(),
+            'file_cache': self.file_cache.get_stats(),
+            'hash_cache': self.hash_cache.get_stats(),
+            'targets': self.target_times,
+            'renders': {
+                'written': len(self.written_outputs),
+                'unchanged': len(self.unchanged_outputs)
+            }
         }
-        with open(self.build_info_file, 'w') as f:
+        if self.deterministic:
+            # times and stats change on every build, even when
+            # outputs don't, so they are left out.
+            for name in Compiler.VOLATILE_BUILD_INFO:
+                build_info.pop(name)
+        elif self.profiler.enabled:
+            # parameters not found on cache are read one by one
+            self.profiler.count('ssm_get_parameter',
+                                self.params_cache.misses)
+            build_info['profile'] = self.profiler.get_report()
+        with open(f'{self.stage_dir}/build_info.json', 'w') as f:
             json.dump(build_info, f, indent=4)
         self.logger.info(f'Build info file => {self.build_info_file}')
 
@@ -166,8 +1324,8 @@ class Compiler(Base):
         self.logger.info('Building target => static...')
         self.__create_build_dirs()
         static_files = self.image.get_static_files()
-        dest_dir = f'{self.build_dir}/static'
-        count = 0
+        dest_dir = f'{self.stage_dir}/static'
+        copy_list = []
 
         if len(static_files) == 0:
             self.logger.info('No static files to build')
@@ -187,42 +1345,58 @@ class Compiler(Base):
                     os.makedirs(new_base_dir, exist_ok=True)
                 except OSError as err:
                     self.abort_build(str(err))
-            # copy static files
+
             for file_name in files:
-                static_file_name = f'{base_dir}/{file_name}'
-                try:
-                    self.logger.info(f'Copying {static_file_name}')
-                    with open(static_file_name, 'rb') as src:
-                        content = src.read()
-                        dst_file_name = f'{new_base_dir}/{file_name}'
-                        self.logger.info(f'destination => {dst_file_name}')
-                        with open(dst_file_name, 'wb') as dst:
-                            dst.write(content)
-                    self.logger.info('File copy completed with success')
-                    count += 1
-                    self.logger.info('Build completed')
-                    self.logger.info(f'Target => static, Artifacts => {count}')
-                except OSError as err:
-                    self.logger.error('Fail to copy static file')
-                    self.abort_build(str(err))
+                copy_list.append((f'{base_dir}/{file_name}',
+                                  f'{new_base_dir}/{file_name}'))
+        # copy static files
+        try:
+            if self.jobs > 1 and len(copy_list) > 1:
+                with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                    results = list(pool.map(
+                        lambda x: self.copy_static_file(*x), copy_list))
+            else:
+                results = [self.copy_static_file(src, dst)
+                           for src, dst in copy_list]
+        except CompilerException as err:
+            self.abort_build(str(err))
+
+        count = results.count(True)
+        self.logger.info('Build completed')
+        self.logger.info(f'Target => static, Artifacts => {count}')
         return 'success'
 
+    def copy_static_file(self, static_file_name, dst_file_name):
+        output = self.get_output_name(dst_file_name)
+        digest = None
+
+        try:
+            if self.incremental:
+                digest = self.hash_cache.get(static_file_name,
+                                             static_file_name)
+                if self.is_up_to_date(output, digest):
+                    self.logger.info(f'Unchanged {static_file_name}')
+                    return False
+            self.logger.info(f'Copying {static_file_name}')
+            self.logger.info(f'destination => {dst_file_name}')
+            start = time.perf_counter()
+            install_file(static_file_name, dst_file_name, self.static_mode)
+            if self.profiler.enabled:
+                self.profiler.record_copy(os.path.getsize(dst_file_name),
+                                          time.perf_counter() - start)
+            self.logger.info('File copy completed with success')
+        except OSError as err:
+            self.logger.error('Fail to copy static file')
+            raise CompilerException(str(err))
+
+        self.record_output(output, digest)
+        return True
+
     def build_target_templates(self):
         self.logger.info('Building target => templates...')
         self.__create_build_dirs()
-        # Last in the list replaces top ones.
-        # This is ordered to resolves conflits, if any.
-        #
-        # 1. global templates
-        # 2. environment templates
-        # 3. image templates
-        template_list = [
-            self.image.get_template_dir(),
-            self.image.env.get_template_dir(),
-            Thor.TEMPLATES_DIR,
-        ]
-        dest_dir = f'{self.build_dir}/templates'
-        template = CompilerTemplateDir(self, dest_dir, template_list)
+        dest_dir = f'{self.stage_dir}/templates'
+        template = CompilerTemplateDir(self, dest_dir)
         try:
             count = template.render_all(self.generate_template_variables())
             self.logger.info('Build completed')
@@ -239,8 +1413,9 @@ class Compiler(Base):
             with open(packer_file, 'r') as f:
                 packer_file_content = f.read()
             try:
-                template = CompilerTemplateString(self, self.build_dir,
-                                                  packer_file_content)
+                template = CompilerTemplateString(self, self.stage_dir,
+                                                  packer_file_content,
+                                                  packer_file)
                 template.render('packer.json',
                                 self.generate_template_variables())
                 self.logger.info('Build completed')
@@ -255,88 +1430,410 @@ class Compiler(Base):
     def build_target_config(self):
         self.logger.info('Building target => config...')
         self.__create_build_dirs()
+        config_file = f'{self.stage_dir}/config.json'
+        output = self.get_output_name(config_file)
+        # image settings override environment settings
+        config_files = [self.image.env.get_config_file(),
+                        self.image.get_config_file()]
+        sources = []
 
-        tmp_build_dir = f'{self.build_dir}/tmp'
+        for config_file_name in config_files:
+            if os.path.exists(config_file_name):
+                with open(config_file_name, 'r') as f:
+                    sources.append((config_file_name, f.read()))
 
-        if os.path.exists(self.image.env.get_config_file()):
-            with open(self.image.env.get_config_file(), 'r') as f:
-                env_config = f.read()
-            self.logger.info('Rendering env config file...')
-            template = CompilerTemplateString(self, tmp_build_dir,
-                                              env_config)
-            template.render('env_config.json',
-                            self.generate_template_variables())
-            self.logger.info('Rendering completed')
+        # rendered on incremental builds too, files and templates it
+        # includes are not tracked. Unchanged content keeps its mtime.
+        merged_config = {}
+        variables = self.generate_template_variables()
+        self.start_params_tracking()
 
-        if os.path.exists(self.image.get_config_file()):
-            with open(self.image.get_config_file(), 'r') as f:
-                image_config = f.read()
-            self.logger.info('Rendering image config file...')
-            template = CompilerTemplateString(self, tmp_build_dir,
-                                              image_config)
-            template.render('image_config.json',
-                            self.generate_template_variables())
+        try:
+            for config_file_name, content in sources:
+                self.logger.info(f'Rendering {config_file_name}...')
+                template = CompilerTemplateString(self, self.stage_dir,
+                                                  content, config_file_name)
+                rendered_config = json.loads(
+                    template.render_to_string(variables))
+                merged_config = deep_merge(merged_config, rendered_config)
             self.logger.info('Rendering completed')
-
-        if os.path.exists(f'{tmp_build_dir}/env_config.json'):
-            with open(f'{tmp_build_dir}/env_config.json', 'r') as f:
-                rendered_env_config = json.loads(f.read())
-        else:
-            rendered_env_config = {}
-
-        if os.path.exists(f'{tmp_build_dir}/image_config.json'):
-            with open(f'{tmp_build_dir}/image_config.json', 'r') as f:
-                rendered_image_config = json.loads(f.read())
-        else:
-            rendered_image_config = {}
-
-        self.logger.info('Merging config files...')
-        # image settings override environment settings
-        merged_config = json.dumps(
-            {**rendered_env_config, **rendered_image_config}, indent=4)
-
-        self.logger.info('Saving config files...')
-        with open(f'{self.build_dir}/config.json', 'w+') as f:
-            f.write(merged_config)
+        except CompilerTemplateRenderingException as err:
+            self.abort_build(str(err))
+        except ValueError as err:
+            self.abort_build(f'Invalid rendered config {config_file_name}: '
+                             f'{err}')
+        finally:
+            used_params = self.stop_params_tracking()
+
+        self.logger.info('Saving config file...')
+        content = json.dumps(merged_config, indent=4).encode('utf-8')
+        try:
+            if self.is_same_output(output, content):
+                self.keep_output(output)
+                self.unchanged_outputs.append(output)
+            else:
+                write_file_atomic(config_file, content)
+                self.written_outputs.append(output)
+        except OSError as err:
+            self.abort_build(str(err))
+        # image config is handed over already parsed
+        self.image.config.loaded_config = merged_config
+        self.record_output(output, None, used_params)
 
         self.logger.info('Build completed')
         self.logger.info('Target => config, Artifacts => 1')
         return 'success'
 
+    def wait_for_file(self, file_name):
+        '''
+        Targets run concurrently, so a file of the build dir may still
+        be written when a template includes it. Wait for the target
+        writing it, if it comes before the current one on build_targets.
+        '''
+        current = Compiler.current_target.get()
+
+        for target_item in self.build_targets:
+            if target_item['name'] == current:
+                break
+            outputs = target_item['outputs']
+            event = self.target_events.get(target_item['name'])
+            if event and outputs and file_name.startswith(outputs):
+                event.wait()
+
+    def run_target(self, target_item):
+        name = target_item['name']
+        Compiler.current_target.set(name)
+        start = time.monotonic()
+
+        try:
+            return target_item['func']()
+        finally:
+            self.target_times[name] = round(time.monotonic() - start, 3)
+            self.profiler.record_phase(name, time.monotonic() - start)
+            event = self.target_events.get(name)
+            if event:
+                event.set()
+
+    def run_targets(self, targets):
+        '''
+        Run targets on a pool of threads, each one as soon as the
+        targets it depends on are done.
+        '''
+        names = [x['name'] for x in targets]
+        # targets not requested are considered done
+        done = set(x['name'] for x in self.build_targets
+                   if x['name'] not in names)
+        pending = list(targets)
+        running = {}
+        result = 'success'
+        self.target_events = {x: threading.Event() for x in names}
+
+        with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            while pending or running:
+                for target_item in list(pending):
+                    if set(target_item['depends']).issubset(done):
+                        pending.remove(target_item)
+                        future = pool.submit(
+                            contextvars.copy_context().run,
+                            self.run_target, target_item)
+                        running[future] = target_item['name']
+
+                if not running:
+                    pending_names = ', '.join(x['name'] for x in pending)
+                    raise CompilerException(
+                        f'Unresolved target dependencies: {pending_names}')
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    done.add(name)
+                    if not future.result() == 'success':
+                        # don't start any other target, wait
+                        # for running ones to finish.
+                        result = 'fail'
+                        pending = []
+        return result
+
     def build_all(self):
         self.start_time = datetime.now()
-        for target_item in self.build_targets:
-            target = target_item['func']
-            result = target()
-            if not result == 'success':
-                # force the proccess to terminate if we not get
-                # success from target.
-                return 'fail'
-        self.end_time = datetime.now()
-        self.generate_build_info_file()
+        self.reap_trash()
+        start = time.monotonic()
+        analyses, syntax_errors = self.analyze_templates()
+        self.validate_templates(analyses, syntax_errors)
+        self.profiler.record_phase('validate', time.monotonic() - start)
+        start = time.monotonic()
+        self.prefetch_params(analyses)
+        self.profiler.record_phase('prefetch_params', time.monotonic() - start)
+        # builds start on an empty stage dir, nothing to clean
+        targets = [x for x in self.build_targets if not x['name'] == 'clean']
+        self.start_stage()
+
+        try:
+            result = self.run_targets(targets)
+            if result == 'success':
+                self.save_manifest()
+                self.hash_cache.save()
+                self.end_time = datetime.now()
+                self.generate_build_info_file()
+                self.publish()
+        except BaseException:
+            # including SystemExit from aborted builds
+            self.discard_stage()
+            raise
+
+        if not result == 'success':
+            # force the proccess to terminate if we not get
+            # success from target.
+            self.discard_stage()
+            return 'fail'
+        if self.wait_clean:
+            self.wait_for_clean()
         return 'success'
 
-    def __remove_dirs_recursive(self, path):
-        if os.path.exists(path):
-            entries = os.scandir(path=path)
-            for entry in entries:
-                entry_path = f'{path}/{entry.name}'
+    def build_target(self, name):
+        for target_item in self.build_targets:
+            if target_item['name'] == name:
+                result = self.run_target(target_item)
+                self.save_manifest()
+                self.hash_cache.save()
+                return result
+        raise CompilerException(f'Unknown target {name}')
+
+    def get_previous_link(self):
+        return f'{self.build_dir}.previous'
+
+    def new_build_path(self):
+        '''
+        Builds are hidden siblings of build_dir, which links to the
+        current one.
+        '''
+        return '{}/.{}.{}'.format(os.path.dirname(self.build_dir),
+                                  os.path.basename(self.build_dir),
+                                  random_string())
+
+    def get_stale_builds(self):
+        '''
+        Builds not linked by build_dir or its previous link, left by
+        failed compiles or replaced by newer builds.
+        '''
+        parent_dir = os.path.dirname(self.build_dir)
+        prefix = f'.{os.path.basename(self.build_dir)}.'
+        stale = []
+
+        if not os.path.isdir(parent_dir):
+            return stale
+
+        for entry in os.listdir(parent_dir):
+            if entry.startswith(prefix) and entry[len(prefix):].isalnum():
+                path = f'{parent_dir}/{entry}'
+                # stages of compiles still running are locked
+                if not self.is_stage_locked(path):
+                    stale.append(path)
+
+        # links are read after the locks, stages are linked before
+        # being unlocked.
+        keep = [os.path.realpath(self.stage_dir)]
+        for link in [self.build_dir, self.get_previous_link()]:
+            if os.path.islink(link):
+                keep.append(os.path.realpath(link))
+        return [x for x in stale if os.path.realpath(x) not in keep]
+
+    @staticmethod
+    def get_stage_lock_file(path):
+        return f'{path}.lock'
+
+    def is_stage_locked(self, path):
+        try:
+            with open(self.get_stage_lock_file(path), 'r') as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return False
+        except FileNotFoundError:
+            return False
+        except BlockingIOError:
+            return True
+
+    def lock_stage(self):
+        '''
+        Lock the stage dir of this compile, so compiles of the same
+        image publishing meanwhile don't take it for a stale build.
+        '''
+        self.stage_lock = open(self.get_stage_lock_file(self.stage_dir), 'w')
+        fcntl.flock(self.stage_lock, fcntl.LOCK_EX)
+
+    def unlock_stage(self):
+        if self.stage_lock is not None:
+            try:
+                os.remove(self.stage_lock.name)
+            except OSError as err:
+                self.logger.warning(f'Fail to remove stage lock: {err}')
+            self.stage_lock.close()
+            self.stage_lock = None
+
+    def remove_stage_locks(self, paths):
+        # left by compiles that didn't finish
+        for path in paths:
+            try:
+                os.remove(self.get_stage_lock_file(path))
+            except FileNotFoundError:
+                pass
+
+    def replace_link(self, link, target):
+        '''
+        Point link to target. The new link is renamed over the old
+        one, so there is no moment where link doesn't exist.
+        '''
+        link_dir = os.path.dirname(link)
+        tmp_link = '{}/.{}.tmp.{}'.format(link_dir, os.path.basename(link),
+                                          random_string())
+        os.symlink(os.path.relpath(target, link_dir), tmp_link)
+        os.replace(tmp_link, link)
+
+    def start_stage(self):
+        self.previous_dir = os.path.realpath(self.build_dir)
+        self.stage_dir = self.new_build_path()
+        self.logger.info(f'Staging build on {self.stage_dir}')
 
-                try:
-                    if entry.is_dir():
-                        self.__remove_dirs_recursive(f'{entry_path}')
-                        self.logger.info(f'Removing dir {entry_path}')
-                        os.rmdir(entry_path)
-                    else:
-                        self.logger.info(f'Removing file {entry_path}')
-                        os.remove(entry_path)
-                except OSError as err:
-                    self.logger.error(f'Fail to remove {entry_path}')
-                    raise CompilerException(str(err))
+        try:
+            os.makedirs(os.path.dirname(self.stage_dir), exist_ok=True)
+            # locked before it exists, so it's never seen unlocked
+            self.lock_stage()
+            os.makedirs(self.stage_dir)
+        except OSError as err:
+            self.logger.error(f'Fail to create dir {self.stage_dir}')
+            self.unlock_stage()
+            raise CompilerException(str(err))
+        self.is_build_dir_created = True
+        self.manifest.path = f'{self.stage_dir}/{CompilerManifest.FILE_NAME}'
+
+    def discard_stage(self):
+        if not self.stage_dir == self.build_dir:
+            self.logger.info(f'Discarding {self.stage_dir}')
+            try:
+                self.move_to_trash([self.stage_dir])
+            except OSError as err:
+                self.logger.warning(f'Fail to discard stage dir: {err}')
+            self.unlock_stage()
+
+    def publish(self):
+        '''
+        Swap the staged build into build_dir. build_dir is a symbolic
+        link to the build, so the swap is atomic and build_dir always
+        holds a whole build. The replaced build is kept as a fallback
+        on build_dir.previous.
+        '''
+        previous_link = self.get_previous_link()
+
+        try:
+            if os.path.islink(self.build_dir):
+                current = os.path.realpath(self.build_dir)
+            elif os.path.isdir(self.build_dir):
+                # build dir written in place by older versions
+                current = self.new_build_path()
+                os.rename(self.build_dir, current)
+            else:
+                current = None
+
+            self.replace_link(self.build_dir, self.stage_dir)
+            if current:
+                self.replace_link(previous_link, current)
+            stale_builds = self.get_stale_builds()
+            self.move_to_trash(stale_builds)
+            self.remove_stage_locks(stale_builds)
+        except OSError as err:
+            self.logger.error(f'Fail to publish {self.stage_dir}')
+            raise CompilerException(str(err))
+        finally:
+            # once linked, the stage is no longer stale
+            self.unlock_stage()
+        self.logger.info(f'Build published on {self.build_dir}')
+
+    def remove_trash(self, paths):
+        for path in paths:
+            self.logger.debug(f'Removing {path}')
+            shutil.rmtree(path, ignore_errors=True)
+        self.logger.info('Old builds removed')
+
+    def start_remove_trash(self, paths):
+        '''
+        Delete paths on a background thread. It's not a daemon
+        thread, so the process waits for it before exiting instead
+        of leaving the delete half done.
+        '''
+        clean_thread = threading.Thread(target=self.remove_trash,
+                                        args=(paths,))
+        clean_thread.start()
+        return clean_thread
+
+    def reap_trash(self):
+        '''
+        Remove leftovers of deletes that didn't finish (e.g. the
+        process was killed) while the build runs.
+        '''
+        try:
+            # they may belong to other compilers that are still
+            # removing them, errors are ignored.
+            trash = [f'{Thor.TRASH_DIR}/{x}'
+                     for x in os.listdir(Thor.TRASH_DIR)]
+        except FileNotFoundError:
+            return
+        if trash:
+            self.reap_thread = self.start_remove_trash(trash)
+
+    def move_to_trash(self, paths):
+        '''
+        Move paths to trash and delete them on a background thread,
+        so the build goes on at once.
+        '''
+        os.makedirs(Thor.TRASH_DIR, exist_ok=True)
+        trash = []
+
+        for path in paths:
+            trash_path = '{}/{}-{}-{}'.format(
+                Thor.TRASH_DIR, self.image.env.get_name(),
+                self.image.get_name(), random_string())
+            try:
+                os.rename(path, trash_path)
+            except FileNotFoundError:
+                # moved meanwhile by another compile of the image
+                continue
+            trash.append(trash_path)
+
+        if trash:
+            self.clean_threads.append(self.start_remove_trash(trash))
+
+    def wait_for_clean(self):
+        '''
+        Wait for the builds moved to trash by this compile.
+        '''
+        if self.clean_threads:
+            self.logger.info('Waiting for old builds to be removed...')
+        for clean_thread in self.clean_threads:
+            clean_thread.join()
+        self.clean_threads = []
 
     def build_target_clean(self):
+        '''
+        Move builds to trash, so the new build starts at once, and
+        delete them on a background thread.
+        '''
         self.logger.info(f'Cleaning {self.build_dir}')
-        self.__remove_dirs_recursive(self.build_dir)
+        self.reap_trash()
+
+        try:
+            for link in [self.build_dir, self.get_previous_link()]:
+                if os.path.islink(link):
+                    os.remove(link)
+            # no build is linked anymore
+            paths = self.get_stale_builds()
+            if os.path.isdir(self.build_dir):
+                paths.append(self.build_dir)
+            self.move_to_trash(paths)
+            self.remove_stage_locks(paths)
+            os.makedirs(self.build_dir, exist_ok=True)
+        except OSError as err:
+            self.logger.error(f'Fail to clean {self.build_dir}')
+            raise CompilerException(str(err))
+
         self.logger.info('Clean done!')
         return 'success'
 
@@ -347,21 +1844,38 @@ class Compiler(Base):
         return 'success'
 
 
-class CompilerTemplate(Base):
+class CompilerFilters(Base):
+    '''
+    Custom filters available to all templates of a compile.
+    '''
+
+    PARAM_FILTERS = ['getparam', 'get_param']
+    # filters reading files from the build dir
+    FILE_FILTERS = ['include_file', 'include_file_b64', 'md5_file',
+                    'sha256_file', 'sha512_file']
 
-    def __init__(self, compiler, dst_dir, jinja_env):
+    def __init__(self, compiler):
         super().__init__()
         self.compiler = compiler
-        self.dst_dir = dst_dir
-        self.jinja_env = jinja_env
-        self.jinja_env.filters['getparam'] = self.filter_get_param
-        self.jinja_env.filters['include_file'] = self.filter_include_file
-        self.jinja_env.filters['get_param'] = self.filter_get_param
-        self.jinja_env.filters['b64_encode'] = self.filter_b64_encode
-        self.jinja_env.filters['b64_decode'] = self.filter_b64_decode
-        self.jinja_env.filters['sha256'] = self.filter_sha256
-        self.jinja_env.filters['sha512'] = self.filter_sha512
-        self.jinja_env.filters['md5'] = self.filter_md5
+
+    def register(self, jinja_env):
+        filters = {
+            'getparam': self.filter_get_param,
+            'include_file': self.filter_include_file,
+            'include_file_b64': self.filter_include_file_b64,
+            'get_param': self.filter_get_param,
+            'b64_encode': self.filter_b64_encode,
+            'b64_decode': self.filter_b64_decode,
+            'sha256': self.filter_sha256,
+            'sha512': self.filter_sha512,
+            'md5': self.filter_md5,
+            'md5_file': self.filter_md5_file,
+            'sha256_file': self.filter_sha256_file,
+            'sha512_file': self.filter_sha512_file
+        }
+        for name, func in filters.items():
+            jinja_env.filters[name] = self.compiler.profiler.wrap_filter(
+                name, func)
 
     def filter_md5(self, plain_text):
         m = hashlib.md5()
@@ -388,88 +1902,413 @@ class CompilerTemplate(Base):
         decoded_bytes = base64.b64decode(encoded_text_bytes)
         return decoded_bytes.decode()
 
-    def filter_include_file(self, file_name):
-        full_path_file = f'{self.compiler.build_dir}/{file_name}'
+    def read_file(self, file_name, read):
+        self.compiler.wait_for_file(file_name)
+        full_path_file = f'{self.compiler.stage_dir}/{file_name}'
         if not os.path.exists(full_path_file):
             raise RuntimeError(f'Fail to include file {full_path_file}')
 
         try:
-            with open(full_path_file, 'r') as f:
-                return f.read()
-        except OSError as err:
+            return read(full_path_file)
+        except (OSError, ValueError) as err:
             raise RuntimeError(f'Fail to read {full_path_file}: {err}')
 
-    def filter_get_param(self, name):
-        env_name = self.compiler.image.env.get_name()
-        param_full_name = f'/thor/{env_name}/{name}'
-        param = ParameterStore(self.compiler.image.env)
+    # filters reading files or parameters take the render context,
+    # otherwise jinja may call them when compiling templates with
+    # literal arguments and store the result in the bytecode cache.
+
+    @pass_context
+    def filter_include_file(self, context, file_name):
+        return self.read_file(file_name, self.compiler.file_cache.get_text)
+
+    @pass_context
+    def filter_include_file_b64(self, context, file_name):
+        return self.read_file(file_name, self.compiler.file_cache.get_b64)
+
+    def hash_file(self, file_name, algorithm):
+        return self.read_file(file_name, lambda path: (
+            self.compiler.hash_cache.get(file_name, path, algorithm)))
+
+    @pass_context
+    def filter_md5_file(self, context, file_name):
+        return self.hash_file(file_name, 'md5')
+
+    @pass_context
+    def filter_sha256_file(self, context, file_name):
+        return self.hash_file(file_name, 'sha256')
+
+    @pass_context
+    def filter_sha512_file(self, context, file_name):
+        return self.hash_file(file_name, 'sha512')
+
+    @pass_context
+    def filter_get_param(self, context, name):
+        param_full_name = self.compiler.get_param_full_name(name)
 
         try:
-            return param.get(param_full_name)
+            return self.compiler.get_param(param_full_name)
         except ParameterStoreNotFoundException:
             error_msg = f'Parameter {param_full_name} not found'
             raise UndefinedError(error_msg)
 
 
-class CompilerTemplateString(CompilerTemplate):
+class CompilerTemplate(Base):
 
-    def __init__(self, compiler, dst_dir, template_string):
-        super().__init__(compiler, dst_dir, Environment())
-        self.template_string = template_string
+    def __init__(self, compiler, dst_dir):
+        super().__init__()
+        self.compiler = compiler
+        self.dst_dir = dst_dir
+        self.jinja_env = compiler.get_jinja_env()
+
+    def get_dst_path(self, name):
+        template_dst_path = f'{self.dst_dir}/{name}'
+        # remove template extension if exists
+        if '.tmpl' == template_dst_path[-5:]:
+            template_dst_path = template_dst_path[:-5]
+        return template_dst_path
+
+    def dump(self, template, variables, template_dst_path, digest):
+        '''
+        Render template into template_dst_path. Returns False when the
+        output from previous build is kept instead, either because its
+        inputs or the rendered content did not change.
+        '''
+        output = self.compiler.get_output_name(template_dst_path)
+
+        if self.compiler.is_up_to_date(output, digest):
+            self.logger.info(f'Unchanged {output}')
+            self.compiler.unchanged_outputs.append(output)
+            return False
 
-    def render(self, dst_file, variables):
-        self.logger.info(f'Rendering {dst_file}')
-        rendered = self.jinja_env.from_string(self.template_string)
-        stream = rendered.stream(variables)
-        template_dst_path = f'{self.dst_dir}/{dst_file}'
         template_dst_dir = os.path.dirname(template_dst_path)
+        self.compiler.start_params_tracking()
+        start = time.perf_counter()
 
         try:
             os.makedirs(template_dst_dir, exist_ok=True)
-            # remove template extension if exists
-            if '.tmpl' == template_dst_path[-5:]:
-                template_dst_path = template_dst_path[:-5]
-            stream.dump(template_dst_path)
-            self.logger.info('Rendering completed')
+            # rendered in memory, the file is only replaced when the
+            # content changes so its mtime is kept otherwise.
+            content = template.render(variables).encode('utf-8')
+            changed = not self.compiler.is_same_output(output, content)
+            if changed:
+                write_file_atomic(template_dst_path, content)
+                self.logger.info('Rendering completed')
+            else:
+                self.compiler.keep_output(output)
+                self.logger.info(f'Unchanged content {output}')
         except TemplateSyntaxError as err:
             raise CompilerTemplateRenderingException(str(err))
         except UndefinedError as err:
             raise CompilerTemplateRenderingException(str(err))
         except OSError as err:
             raise CompilerTemplateRenderingException(str(err))
+        finally:
+            used_params = self.compiler.stop_params_tracking()
+
+        self.compiler.record_output(output, digest, used_params)
+        self.compiler.profiler.record_template(
+            output, time.perf_counter() - start, len(content), changed)
+        if changed:
+            self.compiler.written_outputs.append(output)
+        else:
+            self.compiler.unchanged_outputs.append(output)
+        return changed
 
 
-class CompilerTemplateDir(CompilerTemplate):
-
-    def __init__(self, compiler, dst_dir, templates_dir):
-        super().__init__(
-            compiler,
-            dst_dir,
-            Environment(loader=FileSystemLoader(templates_dir)))
-
-    def render(self, template, variables):
-        self.logger.info(f'Rendering {template}')
-        stream = self.jinja_env.get_template(template).stream(variables)
-        template_dst_path = f'{self.dst_dir}/{template}'
-        template_dst_dir = os.path.dirname(template_dst_path)
+class CompilerTemplateString(CompilerTemplate):
 
+    def __init__(self, compiler, dst_dir, template_string, source_file=None):
+        super().__init__(compiler, dst_dir)
+        self.template_string = template_string
+        self.source_file = source_file
+
+    def load(self):
+        '''
+        Same as jinja_env.from_string, but compiled code is stored in
+        the bytecode cache when the source file is known.
+        '''
+        bytecode_cache = self.jinja_env.bytecode_cache
+
+        if self.source_file is None or bytecode_cache is None:
+            return self.jinja_env.from_string(self.template_string)
+
+        name = os.path.basename(self.source_file)
+        bucket = bytecode_cache.get_bucket(self.jinja_env, name,
+                                           self.source_file,
+                                           self.template_string)
+        code = bucket.code
+
+        if code is None:
+            code = self.jinja_env.compile(self.template_string, name,
+                                          self.source_file)
+            bucket.code = code
+            bytecode_cache.set_bucket(bucket)
+        return self.jinja_env.template_class.from_code(
+            self.jinja_env, code, self.jinja_env.make_globals(None))
+
+    def render_to_string(self, variables):
         try:
-            os.makedirs(template_dst_dir, exist_ok=True)
-            # remove template extension if exists
-            if '.tmpl' == template_dst_path[-5:]:
-                template_dst_path = template_dst_path[:-5]
-            stream.dump(template_dst_path)
-            self.logger.info('Rendering completed')
+            return self.load().render(variables)
         except TemplateSyntaxError as err:
             raise CompilerTemplateRenderingException(str(err))
         except UndefinedError as err:
             raise CompilerTemplateRenderingException(str(err))
-        except OSError as err:
-            raise CompilerTemplateRenderingException(str(err))
+
+    def render(self, dst_file, variables):
+        '''
+        Always rendered, even on incremental builds: dependencies of
+        the string (includes, include_file) are not tracked. Unchanged
+        content still keeps the previous build file.
+        '''
+        self.logger.info(f'Rendering {dst_file}')
+        rendered = self.load()
+        template_dst_path = self.get_dst_path(dst_file)
+        return self.dump(rendered, variables, template_dst_path, None)
+
+
+class CompilerTemplateGraph(Base):
+    '''
+    Dependencies between templates of the template dirs. Direct
+    dependencies of each template are saved on the build dir and
+    parsed again only when the template source changes.
+    '''
+
+    FILE_NAME = 'dependencies.json'
+    VARIABLE_NAMES = ['artifacts', 'thor', 'var']
+    # dependency only known when rendering
+    ANY = '*'
+
+    def __init__(self, jinja_env, path, wait_for_file=None):
+        super().__init__()
+        self.jinja_env = jinja_env
+        self.path = path
+        # called before reading an included file
+        self.wait_for_file = wait_for_file
+        self.previous = {}
+        self.nodes = {}
+        self.sources = {}
+
+    def load(self, path=None):
+        path = path or self.path
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.previous = json.load(f)
+            except (OSError, ValueError) as err:
+                self.logger.warning(f'Ignoring dependencies file: {err}')
+                self.previous = {}
+        return self
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.nodes, f, indent=4, sort_keys=True)
+        self.logger.info(f'Dependencies file => {self.path}')
+
+    def get_source(self, template):
+        '''
+        Source of template resolved by the loader, which takes the
+        search path overrides (image > env > global) into account.
+        '''
+        if template not in self.sources:
+            try:
+                source, _, _ = self.jinja_env.loader.get_source(
+                    self.jinja_env, template)
+                self.sources[template] = (source, string_digest(source))
+            except TemplateNotFound:
+                self.sources[template] = (None, None)
+        return self.sources[template]
+
+    def parse(self, source):
+        ast = self.jinja_env.parse(source)
+        templates = list(meta.find_referenced_templates(ast))
+        files = []
+        variables = set()
+        names_with_key = set()
+
+        if None in templates:
+            templates = [CompilerTemplateGraph.ANY]
+
+        for node in ast.find_all(nodes.Filter):
+            if node.name not in CompilerFilters.FILE_FILTERS:
+                continue
+            if type(node.node) is nodes.Const and \
+                    type(node.node.value) is str:
+                files.append(node.node.value)
+            else:
+                files.append(CompilerTemplateGraph.ANY)
+
+        for node in ast.find_all((nodes.Getattr, nodes.Getitem)):
+            if type(node.node) is not nodes.Name or \
+                    node.node.name not in CompilerTemplateGraph.VARIABLE_NAMES:
+                continue
+            if type(node) is nodes.Getattr:
+                key = node.attr
+            elif type(node.arg) is nodes.Const:
+                key = str(node.arg.value)
+            else:
+                continue
+            variables.add(f'{node.node.name}.{key}')
+            names_with_key.add(id(node.node))
+
+        for node in ast.find_all(nodes.Name):
+            if node.name in CompilerTemplateGraph.VARIABLE_NAMES and \
+                    id(node) not in names_with_key:
+                # used as a whole, e.g. {{ var | tojson }}
+                variables.add(node.name)
+
+        return {
+            'templates': sorted(set(templates)),
+            'files': sorted(set(files)),
+            'variables': sorted(variables)
+        }
+
+    def get_node(self, template):
+        if template not in self.nodes:
+            source, digest = self.get_source(template)
+            previous = self.previous.get(template)
+
+            if source is None:
+                node = {'templates': [], 'files': [], 'variables': []}
+            elif previous is not None and previous['digest'] == digest:
+                node = previous
+            else:
+                node = self.parse(source)
+            node['digest'] = digest
+            self.nodes[template] = node
+        return self.nodes[template]
+
+    def get_closure(self, template):
+        '''
+        Transitive dependencies of template.
+
+        return (tuple): sets of templates (template included),
+                        files and variables
+        '''
+        templates = set()
+        files = set()
+        variables = set()
+        pending = [template]
+
+        while pending:
+            name = pending.pop()
+            if name in templates:
+                continue
+            templates.add(name)
+            node = self.get_node(name)
+            files.update(node['files'])
+            variables.update(node['variables'])
+
+            for dependency in node['templates']:
+                if dependency == CompilerTemplateGraph.ANY:
+                    pending.extend(self.jinja_env.list_templates())
+                else:
+                    pending.append(dependency)
+        return templates, files, variables
+
+    def get_variable_value(self, variables, reference):
+        name, _, key = reference.partition('.')
+        value = variables.get(name)
+
+        if key:
+            if type(value) is dict:
+                return value.get(key)
+            return None
+        return value
+
+    def get_digest(self, template, variables, files_dir):
+        '''
+        Digest of everything template output depends on. Returns None
+        when dependencies can't be known before rendering.
+        '''
+        try:
+            templates, files, references = self.get_closure(template)
+        except TemplateSyntaxError:
+            # reported when the template is rendered
+            return None
+
+        if CompilerTemplateGraph.ANY in files:
+            return None
+
+        parts = []
+        for name in sorted(templates):
+            parts.append(name)
+            parts.append(self.get_source(name)[1])
+
+        for file_name in sorted(files):
+            if self.wait_for_file:
+                self.wait_for_file(file_name)
+            file_path = f'{files_dir}/{file_name}'
+            parts.append(file_name)
+            if os.path.exists(file_path):
+                parts.append(file_digest(file_path))
+            else:
+                parts.append(None)
+
+        values = {}
+        for reference in references:
+            values[reference] = self.get_variable_value(variables, reference)
+        parts.append(json_digest(values))
+        return string_digest(*parts)
+
+
+class CompilerTemplateDir(CompilerTemplate):
+
+    def __init__(self, compiler, dst_dir):
+        super().__init__(compiler, dst_dir)
+        self.graph = CompilerTemplateGraph(
+            self.jinja_env,
+            f'{compiler.stage_dir}/{CompilerTemplateGraph.FILE_NAME}',
+            compiler.wait_for_file)
+
+        if self.compiler.incremental:
+            self.graph.load(f'{compiler.previous_dir}/'
+                            f'{CompilerTemplateGraph.FILE_NAME}')
+
+    def render(self, template, variables):
+        self.logger.info(f'Rendering {template}')
+        rendered = self.jinja_env.get_template(template)
+        template_dst_path = self.get_dst_path(template)
+        digest = None
+
+        if self.compiler.incremental:
+            digest = self.graph.get_digest(template, variables,
+                                           self.compiler.stage_dir)
+        return self.dump(rendered, variables, template_dst_path, digest)
 
     def render_all(self, variables):
-        count = 0
-        for template in self.jinja_env.list_templates():
-            self.render(template, variables)
-            count += 1
+        templates = self.jinja_env.list_templates()
+
+        if self.compiler.jobs > 1 and len(templates) > 1:
+            results = self.render_pool(templates, variables)
+        else:
+            results = [self.render(x, variables) for x in templates]
+
+        if self.compiler.incremental:
+            self.graph.save()
+
+        count = results.count(True)
+        unchanged = results.count(False)
+        if unchanged:
+            self.logger.info(f'Unchanged templates => {unchanged}')
         return count
+
+    def render_pool(self, templates, variables):
+        '''
+        Render templates using a pool of compiler.jobs threads. The
+        search path (image > env > global) is resolved by the loader,
+        so rendering order doesn't change which template wins.
+        '''
+        self.logger.info(f'Rendering with {self.compiler.jobs} jobs')
+
+        with ThreadPoolExecutor(max_workers=self.compiler.jobs) as pool:
+            # workers run on the current target context
+            futures = [pool.submit(contextvars.copy_context().run,
+                                   self.render, x, variables)
+                       for x in templates]
+            try:
+                # results (and the first error) in template order
+                return [future.result() for future in futures]
+            except CompilerTemplateRenderingException:
+                for future in futures:
+                    future.cancel()
+                raise
@@ -0,0 +1,104 @@
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from jinja2 import (
+    Environment,
+    FileSystemLoader,
+    TemplateError
+)
+from thor.lib.base import Base
+from thor.lib.compiler import (
+    Compiler,
+    CompilerFilters
+)
+from thor.lib.env import Env
+from thor.lib.image import Image
+from thor.lib.thor import Thor
+
+
+def compile_image(env_name, image_name, options):
+    '''
+    Compile a single image. Runs on pool worker processes, so it
+    only takes (and returns) picklable values.
+    '''
+    start = time.monotonic()
+    error = ''
+
+    try:
+        image = Image(Env(env_name), image_name)
+        result = Compiler(image, **options).build_all()
+    except SystemExit:
+        # compiler aborts the build calling exit()
+        result = 'fail'
+    except Exception as err:
+        result = 'fail'
+        error = str(err)
+
+    return {
+        'env': env_name,
+        'image': image_name,
+        'result': result,
+        'error': error,
+        'duration': time.monotonic() - start
+    }
+
+
+class CompilerMatrix(Base):
+    '''
+    Compile every (env, image) pair using a pool of processes.
+    '''
+
+    def __init__(self, env_names, image_names, processes=None, **options):
+        super().__init__()
+        self.env_names = env_names
+        self.image_names = image_names
+        self.processes = processes or os.cpu_count()
+        self.options = options
+
+    @staticmethod
+    def list_images():
+        if os.path.isdir(Thor.IMAGES_DIR):
+            return sorted(os.listdir(Thor.IMAGES_DIR))
+        return []
+
+    def get_pairs(self):
+        return [(env_name, image_name)
+                for env_name in self.env_names
+                for image_name in self.image_names]
+
+    def warm_global_templates(self):
+        '''
+        Compile global templates into the bytecode cache before
+        workers start, so they are parsed only once.
+        '''
+        bytecode_cache = Compiler.get_bytecode_cache()
+        if bytecode_cache is None:
+            return
+
+        # filters are resolved when templates are compiled, so they
+        # must be the ones registered by compiles.
+        env_name, image_name = self.get_pairs()[0]
+        compiler = Compiler(Image(Env(env_name), image_name))
+        jinja_env = Environment(loader=FileSystemLoader(Thor.TEMPLATES_DIR),
+                                bytecode_cache=bytecode_cache)
+        CompilerFilters(compiler).register(jinja_env)
+
+        for template in jinja_env.list_templates():
+            try:
+                jinja_env.get_template(template)
+            except TemplateError as err:
+                # reported by each compile using it
+                self.logger.warning(f'Not warming {template}: {err}')
+
+    def run(self):
+        pairs = self.get_pairs()
+        self.logger.info(f'Compiling {len(pairs)} images with '
+                         f'{self.processes} processes...')
+        self.warm_global_templates()
+
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            futures = [pool.submit(compile_image, env_name, image_name,
+                                   self.options)
+                       for env_name, image_name in pairs]
+            return [future.result() for future in futures]
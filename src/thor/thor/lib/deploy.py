@@ -1,15 +1,26 @@
 import abc
+import math
 import time
 from datetime import datetime
 from thor.lib.base import Base
+from thor.lib.aws_resources.aws_resource import (
+    AwsResource,
+    AwsResourceParameterException,
+    AwsResourceTimeoutException
+)
 from thor.lib.aws_resources.autoscaling import (
     AutoScaling,
+    AutoScalingActivityInProgress,
     AutoScalingException
 )
 from thor.lib.aws_resources.launch_template import (
     LaunchTemplate,
     LaunchTemplateException
 )
+from thor.lib.aws_resources.target_group import (
+    TargetGroup,
+    TargetGroupException
+)
 from thor.lib.utils.names_generator import random_string
 
 
@@ -30,6 +41,8 @@ class Deploy(Base):
     __metaclass__ = abc.ABCMeta
 
     DEFAULT_DESIRED_CAPACITY = 1
+    DEFAULT_SETTLE_DOWN_SECONDS = 20
+    DEFAULT_READY_TIMEOUT_SECONDS = 1200
 
     def __init__(self, image):
         super().__init__()
@@ -37,6 +50,31 @@ class Deploy(Base):
         self.autoscaling_config = DeployAutoScalingConfig(image)
         self.created_resources = {}
         self.running_resources = {}
+        # set from another thread to cancel the deploy
+        self.cancel_event = None
+
+    def get_deploy_config(self, name, default=None):
+        '''
+        Setting under 'deploy' on config.json, all of them optional.
+        '''
+        config = self.image.get_config().get() or {}
+        return (config.get('deploy') or {}).get(name, default)
+
+    def get_timeout_config(self, name, default):
+        '''
+        Timeout setting under 'deploy', in the range accepted by the
+        AWS resources waits, so a wrong value fails the deploy before
+        waiting and it's rolled back.
+        '''
+        timeout = self.get_deploy_config(name, default)
+        if type(timeout) not in (int, float) or \
+                timeout < AwsResource.MIN_TIMEOUT_SECONDS or \
+                timeout > AwsResource.MAX_TIMEOUT_SECONDS:
+            raise DeployException(
+                f'Invalid deploy.{name} {timeout}, must be '
+                f'>= {AwsResource.MIN_TIMEOUT_SECONDS} and '
+                f'<= {AwsResource.MAX_TIMEOUT_SECONDS} seconds')
+        return timeout
 
     @abc.abstractmethod
     def abort(self):
@@ -109,10 +147,58 @@ class DeployBlueGreen(Deploy):
         self.autoscaling = AutoScaling(image.env)
         self.is_first_deploy_ever = False
         self.launch_template = LaunchTemplate(image.env)
+        self.target_group = TargetGroup(image.env)
+
+    def set_cancel_event(self, cancel_event):
+        '''
+        Event cancelling the deploy from another thread. It's checked
+        while waiting for green, where KeyboardInterrupt is raised so
+        the deploy is rolled back as on Ctrl-C.
+        '''
+        self.cancel_event = cancel_event
+        for resource in [self.autoscaling, self.launch_template,
+                         self.target_group]:
+            resource.cancel_event = cancel_event
 
     def settle_down(self, seconds=30):
         self.logger.info('Settle down for %s seconds', seconds)
-        time.sleep(30)
+        if self.cancel_event is None:
+            time.sleep(seconds)
+        elif self.cancel_event.wait(seconds):
+            raise KeyboardInterrupt()
+
+    def wait_for_green_step(self, autoscaling_name):
+        '''
+        Autoscaling creation already waits for instances to be in
+        service. With deploy.wait_for_target_health, instances must
+        also be healthy on the autoscaling target groups, so blue is
+        terminated as soon as green is serving. Otherwise wait for
+        deploy.settle_down_seconds.
+        '''
+        if not self.get_deploy_config('wait_for_target_health', False):
+            self.settle_down(self.get_deploy_config(
+                'settle_down_seconds', Deploy.DEFAULT_SETTLE_DOWN_SECONDS))
+            return
+
+        try:
+            asg_data = self.autoscaling.read(autoscaling_name)
+            target_group_arns = asg_data.get('TargetGroupARNs', [])
+            instance_ids = [x['InstanceId']
+                            for x in asg_data.get('Instances', [])
+                            if x['LifecycleState'] == 'InService']
+
+            if not target_group_arns:
+                self.logger.warning('%s has no target groups to wait for',
+                                    autoscaling_name)
+            timeout = self.get_timeout_config(
+                'ready_timeout', Deploy.DEFAULT_READY_TIMEOUT_SECONDS)
+            for arn in target_group_arns:
+                self.target_group.wait_for_healthy(arn, instance_ids,
+                                                   timeout)
+        except (AutoScalingException, TargetGroupException,
+                AwsResourceParameterException,
+                AwsResourceTimeoutException) as err:
+            raise DeployException(str(err))
 
     def abort(self):
         self.logger.info('Aborting...')
@@ -156,13 +242,7 @@ class DeployBlueGreen(Deploy):
 
         self.logger.info('Pre init step completed.')
 
-    def create_launch_template_from_config(self):
-        # create new launch configuration
-        name = 'LT_{image}_{env}_{rand}'.format(
-            image=self.image.get_name(),
-            env=self.image.env.get_name(),
-            rand=random_string()
-        )
+    def get_launch_template_config(self):
         config = self.image.get_config().get('launch_template')
         if config is None:
             raise DeployException('launch_template is not defined '
@@ -172,6 +252,16 @@ class DeployBlueGreen(Deploy):
             raise DeployException('instance_type not defined in config file')
 
         config['image_id'] = self.ami_id
+        return config
+
+    def create_launch_template_from_config(self):
+        # create new launch configuration
+        name = 'LT_{image}_{env}_{rand}'.format(
+            image=self.image.get_name(),
+            env=self.image.env.get_name(),
+            rand=random_string()
+        )
+        config = self.get_launch_template_config()
 
         try:
             self.launch_template.create(name, config)
@@ -181,7 +271,30 @@ class DeployBlueGreen(Deploy):
         self.created_resources['launch_template'] = name
         return name
 
-    def create_autoscaling(self, launch_template_name):
+    def get_desired_capacity(self, autoscaling_config):
+        if 'desired_capacity' in autoscaling_config:
+            return autoscaling_config['desired_capacity']
+
+        if self.is_first_deploy_ever:
+            if 'min_size' in autoscaling_config:
+                desired_capacity = autoscaling_config['min_size']
+            else:
+                raise DeployException(
+                    'You must to set autoscaling min_size to config.json')
+        else:
+            current_autoscaling = self.running_resources['autoscaling']
+            try:
+                desired_capacity = current_autoscaling['DesiredCapacity']
+                # we force new autoscaling to have at least the
+                # minimum size
+                if desired_capacity < autoscaling_config['min_size']:
+                    desired_capacity = autoscaling_config['min_size']
+            except KeyError:
+                raise DeployException('Cannot find desired capacity '
+                                      'for running auto scaling.')
+        return desired_capacity
+
+    def create_autoscaling(self, launch_template_name, desired_capacity=None):
         new_autoscaling_name = 'ASG_{image}_{env}_{rand}'.format(
             image=self.image.get_name(),
             env=self.image.env.get_name(),
@@ -190,26 +303,15 @@ class DeployBlueGreen(Deploy):
 
         autoscaling_config = self.image.get_config().get('scaling')
 
-        if 'desired_capacity' not in autoscaling_config:
-            if self.is_first_deploy_ever:
-                if 'min_size' in autoscaling_config:
-                    desired_capacity = autoscaling_config['min_size']
-                else:
-                    raise DeployException(
-                        'You must to set autoscaling min_size to config.json')
-            else:
-                current_autoscaling = self.running_resources['autoscaling']
-                try:
-                    desired_capacity = current_autoscaling['DesiredCapacity']
-                    # we force new autoscaling to have at least the
-                    # minimum size
-                    if desired_capacity < autoscaling_config['min_size']:
-                        desired_capacity = autoscaling_config['min_size']
-                except KeyError:
-                    raise DeployException('Cannot find desired capacity '
-                                          'for running auto scaling.')
-
-            autoscaling_config['desired_capacity'] = desired_capacity
+        if desired_capacity is None:
+            desired_capacity = self.get_desired_capacity(autoscaling_config)
+        else:
+            # autoscaling starts below its final capacity
+            autoscaling_config = dict(autoscaling_config)
+            autoscaling_config['min_size'] = min(
+                autoscaling_config.get('min_size', desired_capacity),
+                desired_capacity)
+        autoscaling_config['desired_capacity'] = desired_capacity
 
         try:
             self.autoscaling.create(new_autoscaling_name,
@@ -244,20 +346,29 @@ class DeployBlueGreen(Deploy):
                 # launch templates on the aws account.
                 self.logger.warning('Could not delete launch template')
 
+    def deploy_step(self):
+        '''
+        Deploy the AMI, returns the name of the autoscaling
+        running it.
+        '''
+        green_autoscaling = self.create_green_environment_step()
+        self.wait_for_green_step(green_autoscaling)
+
+        if not self.is_first_deploy_ever:
+            self.terminate_blue_environment_step()
+        return green_autoscaling
+
     def run(self):
         try:
             with DeployLock(self.image):
                 self.pre_init_step()
-                green_autoscaling = self.create_green_environment_step()
-                self.settle_down(20)
-
-                if not self.is_first_deploy_ever:
-                    self.terminate_blue_environment_step()
-
-                self.image.params.autoscaling_name = green_autoscaling
+                autoscaling_name = self.deploy_step()
+                self.image.params.autoscaling_name = autoscaling_name
                 return 'success'
         except KeyboardInterrupt:
             self.logger.info('Deploy CANCELLED by user')
+            # rollback waits are not cancelled
+            self.set_cancel_event(None)
             self.do_blue_green_rollback()
             return 'cancelled'
         except DeployLockAlreadyAcquiredException:
@@ -273,7 +384,204 @@ class DeployBlueGreen(Deploy):
         self.logger.info('Running rollback actions...')
 
         if 'autoscaling' in self.created_resources:
-            self.autoscaling.destroy(self.created_resources['name'])
+            self.autoscaling.destroy(self.created_resources['autoscaling'])
         if 'launch_template' in self.created_resources:
             self.launch_template.destroy(
                 self.created_resources['launch_template'])
+
+
+class DeployCanary(DeployBlueGreen):
+    '''
+    Blue/green deploy moving capacity in steps. Green grows to each
+    step of deploy.canary_steps (percentages of the final capacity)
+    and, once it passes the health gate, blue shrinks by the same
+    amount. Blue is terminated after the last step.
+    '''
+
+    DEFAULT_STEPS = [10, 50, 100]
+
+    def __init__(self, image):
+        super().__init__(image)
+        self.blue_capacity = None
+
+    def get_step_capacities(self, desired_capacity):
+        steps = self.get_deploy_config('canary_steps',
+                                       DeployCanary.DEFAULT_STEPS)
+        capacities = []
+
+        for step in sorted(steps):
+            if step <= 0 or step > 100:
+                raise DeployException(f'Invalid canary step {step}, '
+                                      'steps are percentages')
+            capacity = max(1, math.ceil(desired_capacity * step / 100))
+            if not capacities or capacity > capacities[-1]:
+                capacities.append(capacity)
+        if not capacities or capacities[-1] < desired_capacity:
+            capacities.append(desired_capacity)
+        return capacities
+
+    def scale(self, autoscaling_name, min_size, desired_capacity):
+        try:
+            self.autoscaling.update(autoscaling_name, {
+                'min_size': min_size,
+                'desired_capacity': desired_capacity
+            })
+        except (AutoScalingException, AutoScalingActivityInProgress) as err:
+            raise DeployException(str(err))
+
+    def scale_blue(self, desired_capacity):
+        blue = self.running_resources['autoscaling']
+        self.logger.info('Blue capacity %s -> %s', self.blue_capacity,
+                         desired_capacity)
+        self.scale(blue['AutoScalingGroupName'],
+                   min(blue['MinSize'], desired_capacity), desired_capacity)
+        self.blue_capacity = desired_capacity
+
+    def scale_green(self, autoscaling_name, min_size, desired_capacity):
+        timeout = self.get_timeout_config(
+            'ready_timeout', Deploy.DEFAULT_READY_TIMEOUT_SECONDS)
+        self.logger.info('Green capacity -> %s', desired_capacity)
+        self.scale(autoscaling_name, min(min_size, desired_capacity),
+                   desired_capacity)
+        try:
+            self.autoscaling.wait_for_capacity(autoscaling_name,
+                                               desired_capacity, timeout)
+        except (AutoScalingException, AwsResourceParameterException,
+                AwsResourceTimeoutException) as err:
+            raise DeployException(str(err))
+
+    def create_green_environment_step(self):
+        if self.is_first_deploy_ever:
+            # nothing to move traffic from
+            return super().create_green_environment_step()
+
+        autoscaling_config = self.image.get_config().get('scaling')
+        desired_capacity = self.get_desired_capacity(autoscaling_config)
+        min_size = autoscaling_config.get('min_size', desired_capacity)
+        capacities = self.get_step_capacities(desired_capacity)
+        self.blue_capacity = \
+            self.running_resources['autoscaling']['DesiredCapacity']
+        self.logger.info('Canary steps = %s', capacities)
+
+        launch_template_name = self.create_launch_template_from_config()
+        autoscaling_name = self.create_autoscaling(launch_template_name,
+                                                   capacities[0])
+        previous_capacity = 0
+        for i, capacity in enumerate(capacities):
+            if i > 0:
+                self.scale_green(autoscaling_name, min_size, capacity)
+            if capacity == capacities[-1]:
+                # gated by run() before blue is terminated
+                break
+            self.wait_for_green_step(autoscaling_name)
+            # blue shrinks by what green grew, it may be smaller than
+            # the green final capacity.
+            self.scale_blue(max(0, self.blue_capacity -
+                                (capacity - previous_capacity)))
+            previous_capacity = capacity
+        return autoscaling_name
+
+    def do_blue_green_rollback(self):
+        blue = self.running_resources.get('autoscaling')
+
+        if blue and self.blue_capacity is not None and \
+                not self.blue_capacity == blue['DesiredCapacity']:
+            self.logger.info('Restoring blue capacity...')
+            try:
+                self.scale(blue['AutoScalingGroupName'], blue['MinSize'],
+                           blue['DesiredCapacity'])
+            except DeployException as err:
+                self.logger.error(str(err))
+        super().do_blue_green_rollback()
+
+
+class DeployInstanceRefresh(DeployBlueGreen):
+    '''
+    Deploy on the running autoscaling: a new version of its launch
+    template gets the new AMI and an instance refresh replaces the
+    running instances. The first deploy creates them as blue/green.
+    '''
+
+    DEFAULT_MIN_HEALTHY_PERCENTAGE = 90
+
+    def __init__(self, image):
+        super().__init__(image)
+        self.refresh_autoscaling = None
+
+    def get_refresh_preferences(self):
+        preferences = {
+            'min_healthy_percentage': self.get_deploy_config(
+                'min_healthy_percentage',
+                DeployInstanceRefresh.DEFAULT_MIN_HEALTHY_PERCENTAGE),
+            # instances already on the new version are kept
+            'skip_matching': True
+        }
+        instance_warmup = self.get_deploy_config('instance_warmup')
+        if instance_warmup is not None:
+            preferences['instance_warmup'] = instance_warmup
+        return preferences
+
+    def refresh_step(self):
+        autoscaling_name = \
+            self.running_resources['autoscaling']['AutoScalingGroupName']
+        launch_template_name = self.running_resources.get('launch_template')
+
+        if not launch_template_name:
+            raise DeployException(f'{autoscaling_name} has no launch '
+                                  'template to add a version to')
+        # checked before the refresh starts
+        timeout = self.get_timeout_config('refresh_timeout',
+                                          AwsResource.MAX_TIMEOUT_SECONDS)
+        try:
+            version = self.launch_template.create_version(
+                launch_template_name, self.get_launch_template_config())
+            refresh_id = self.autoscaling.start_instance_refresh(
+                autoscaling_name, launch_template_name, version,
+                self.get_refresh_preferences())
+            self.refresh_autoscaling = autoscaling_name
+            self.autoscaling.wait_for_instance_refresh(
+                autoscaling_name, refresh_id, timeout)
+            self.refresh_autoscaling = None
+        except (AutoScalingException, LaunchTemplateException,
+                AwsResourceParameterException,
+                AwsResourceTimeoutException) as err:
+            raise DeployException(str(err))
+        return autoscaling_name
+
+    def deploy_step(self):
+        if self.is_first_deploy_ever:
+            return super().deploy_step()
+        return self.refresh_step()
+
+    def do_blue_green_rollback(self):
+        if self.refresh_autoscaling is not None:
+            # replaced instances are kept, the autoscaling keeps
+            # its launch template version.
+            try:
+                self.autoscaling.cancel_instance_refresh(
+                    self.refresh_autoscaling)
+            except AutoScalingException as err:
+                self.logger.error(str(err))
+        super().do_blue_green_rollback()
+
+
+DEPLOY_STRATEGIES = {
+    'blue_green': DeployBlueGreen,
+    'canary': DeployCanary,
+    'instance_refresh': DeployInstanceRefresh
+}
+
+
+def get_deploy(image):
+    '''
+    Deploy of the strategy set on deploy.strategy of the image
+    config.json, blue_green by default.
+    '''
+    config = image.get_config().get() or {}
+    strategy = (config.get('deploy') or {}).get('strategy', 'blue_green')
+
+    if strategy not in DEPLOY_STRATEGIES:
+        raise DeployException('Unknown deploy strategy {}, must be '
+                              'either {}'.format(
+                                  strategy, ', '.join(DEPLOY_STRATEGIES)))
+    return DEPLOY_STRATEGIES[strategy](image)
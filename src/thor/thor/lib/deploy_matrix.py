@@ -0,0 +1,137 @@
+import contextvars
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from thor.lib.base import Base
+from thor.lib.compiler import Compiler
+from thor.lib.deploy import get_deploy
+from thor.lib.image import Image
+
+
+class DeployMatrixLogFilter(logging.Filter):
+    '''
+    Set the image being deployed by the current thread on log records
+    (image attribute, None outside of deploys).
+    '''
+
+    def filter(self, record):
+        record.image = DeployMatrix.current_image.get()
+        return True
+
+
+class DeployMatrixLogFormatter(logging.Formatter):
+    '''
+    Prefix the output of a handler formatter with the image of the
+    record, so output of concurrent deploys can be told apart. Records
+    are shared by all handlers and are not changed.
+    '''
+
+    def __init__(self, formatter=None):
+        super().__init__()
+        self.formatter = formatter or logging.Formatter()
+
+    def format(self, record):
+        message = self.formatter.format(record)
+        image_name = getattr(record, 'image', None)
+        if image_name is None:
+            return message
+        return f'[{image_name}] {message}'
+
+
+class DeployMatrix(Base):
+    '''
+    Compile and deploy many images of an environment using a pool
+    of threads. Each deploy holds the lock of its own image.
+    '''
+
+    DEFAULT_PARALLEL = 4
+
+    current_image = contextvars.ContextVar('current_image', default=None)
+
+    def __init__(self, env, image_names, parallel=None, incremental=False):
+        super().__init__()
+        self.env = env
+        self.image_names = image_names
+        self.parallel = max(1, parallel or DeployMatrix.DEFAULT_PARALLEL)
+        self.incremental = incremental
+        # set on Ctrl-C, running deploys roll back on their next wait
+        self.cancel_event = threading.Event()
+
+    def deploy_image(self, image_name):
+        DeployMatrix.current_image.set(image_name)
+        start = time.monotonic()
+        error = ''
+
+        try:
+            image = Image(self.env, image_name)
+            with Compiler(image, incremental=self.incremental) as compiler:
+                result = compiler.build_all()
+            if self.cancel_event.is_set():
+                result = 'cancelled'
+            elif result == 'success':
+                deploy = get_deploy(image)
+                deploy.set_cancel_event(self.cancel_event)
+                result = deploy.run()
+        except SystemExit:
+            # compiler and deploy abort calling exit()
+            result = 'fail'
+        except Exception as err:
+            self.logger.error(str(err))
+            result = 'fail'
+            error = str(err)
+
+        return self.get_result(image_name, result, error,
+                               time.monotonic() - start)
+
+    def get_result(self, image_name, result, error='', duration=0):
+        return {
+            'image': image_name,
+            'result': result,
+            'error': error,
+            'duration': duration
+        }
+
+    def wait_result(self, image_name, future):
+        '''
+        Result of a deploy after a cancel, waiting for its rollback.
+        '''
+        if future is None or future.cancelled():
+            return self.get_result(image_name, 'cancelled')
+        return future.result()
+
+    def deploy_all(self):
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+            try:
+                for image_name in self.image_names:
+                    futures[image_name] = pool.submit(self.deploy_image,
+                                                      image_name)
+                return [futures[x].result() for x in self.image_names]
+            except KeyboardInterrupt:
+                self.logger.info('Deploy CANCELLED by user, rolling back '
+                                 'running deploys...')
+                for future in futures.values():
+                    future.cancel()
+                self.cancel_event.set()
+                return [self.wait_result(x, futures.get(x))
+                        for x in self.image_names]
+
+    def run(self):
+        self.logger.info(f'Deploying {len(self.image_names)} images, '
+                         f'{self.parallel} at the same time...')
+        log_filter = DeployMatrixLogFilter()
+        handlers = logging.getLogger().handlers
+        formatters = [x.formatter for x in handlers]
+
+        for handler, formatter in zip(handlers, formatters):
+            handler.addFilter(log_filter)
+            handler.setFormatter(DeployMatrixLogFormatter(formatter))
+        try:
+            return self.deploy_all()
+        finally:
+            for handler, formatter in zip(handlers, formatters):
+                handler.removeFilter(log_filter)
+                handler.setFormatter(formatter)
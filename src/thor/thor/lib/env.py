@@ -1,4 +1,5 @@
 import os
+import threading
 
 from thor.lib.aws import Aws
 from thor.lib.base import Base
@@ -33,8 +34,10 @@ class Env(Base):
 
     CONFIG_FILE = 'config.json'
     VARIABLES_FILE = 'variables.json'
+    VARIABLES_DIR = 'variables.d'
 
     __AWS_CLIENT_CACHE = {}
+    __AWS_CLIENT_LOCK = threading.Lock()
 
     def __init__(self, name=None):
         super().__init__()
@@ -42,7 +45,6 @@ class Env(Base):
         self.env_dir = f'{Thor.ENVIRONMENTS_DIR}/{self.name}'
         self.__env_list_cache = None
         self.__config = Config(f'{self.env_dir}/config.json')
-        self.__saved_dir = None
 
     def aws_client(self, service):
         try:
@@ -54,9 +56,11 @@ class Env(Base):
         profile = self.get_name()
         key = '{}.{}'.format(region, service)
 
-        if key not in Env.__AWS_CLIENT_CACHE:
-            aws = Aws(region, profile)
-            Env.__AWS_CLIENT_CACHE[key] = aws.client(service)
+        # clients are shared by threads (e.g. parallel rendering)
+        with Env.__AWS_CLIENT_LOCK:
+            if key not in Env.__AWS_CLIENT_CACHE:
+                aws = Aws(region, profile)
+                Env.__AWS_CLIENT_CACHE[key] = aws.client(service)
         return Env.__AWS_CLIENT_CACHE[key]
 
     def is_valid(self):
@@ -106,6 +110,9 @@ class Env(Base):
     def get_variables_file(self):
         return f'{self.env_dir}/{Env.VARIABLES_FILE}'
 
+    def get_variables_dir(self):
+        return f'{self.env_dir}/{Env.VARIABLES_DIR}'
+
     def get_config_file(self):
         return f'{self.env_dir}/{Env.CONFIG_FILE}'
 
@@ -119,19 +126,15 @@ class Env(Base):
             return []
 
     def __enter__(self):
-        try:
-            self.__saved_dir = os.getcwd()
-            self.logger.info('cd %s', self.env_dir)
-            os.chdir(self.env_dir)
-            return self
-        except Exception as err:
-            self.logger.error(f'Cannot change dir to {self.env}')
-            raise EnvException(str(err))
+        # Kept for backward compatibility, all paths are absolute
+        # so the current directory is never changed.
+        if not os.path.isdir(self.env_dir):
+            self.logger.error(f'Invalid environment dir {self.env_dir}')
+            raise EnvException(f'Invalid environment {self.name}')
+        return self
 
     def __exit__(self, type, value, traceback):
-        self.logger.info(f'leaving directory {self.__saved_dir}')
-        os.chdir(self.__saved_dir)
-        self.__saved_dir = None
+        pass
 
     def destroy(self):
         pass
@@ -49,7 +49,7 @@ class Executable(Base):
             exec_name=self.exec_name
         )
 
-    def run(self, *args):
+    def run(self, *args, workdir=None):
         executable_cmd = [
             '{exec_bin}'.format(exec_bin=self.get_exec_path()),
         ]
@@ -57,6 +57,6 @@ class Executable(Base):
             for arg in args:
                 executable_cmd.append(arg)
         self.logger.info('Running {}'.format(' '.join(executable_cmd)))
-        result = cmd.run_interactive(executable_cmd)
+        result = cmd.run_interactive(executable_cmd, workdir)
         self.logger.info('Return code is {}'.format(result))
         return result
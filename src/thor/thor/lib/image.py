@@ -3,6 +3,7 @@ import os
 
 from thor.lib.base import Base
 from thor.lib.config import Config
+from thor.lib.env import Env
 from thor.lib.thor import Thor
 from thor.lib.aws_resources.parameter_store import (
     ParameterStore,
@@ -113,25 +114,26 @@ class Image(Base):
         self.static_dir = f'{self.image_dir}/static'
         self.image_files_list = None
         self.instance_type = instance_type
+        self.build_dir = '{base_build_dir}/{env_name}/{image_name}'.format(
+            base_build_dir=Thor.BUILD_DIR,
+            env_name=env.get_name(),
+            image_name=name
+        )
         self.params = ImageParams(self)
-        self.config = Config(Image.CONFIG_FILE)
-        self.__saved_dir = None
+        self.config = Config(f'{self.build_dir}/{Image.CONFIG_FILE}')
 
     def __enter__(self):
-        try:
-            self.__saved_dir = os.getcwd()
-            os.chdir(self.image_dir)
-            return self
-        except FileNotFoundError:
+        # Kept for backward compatibility, all paths are absolute
+        # so the current directory is never changed.
+        if not os.path.isdir(self.image_dir):
             raise ImageInvalidException(f'Invalid image {self.name}')
+        return self
 
     def __exit__(self, type, value, traceback):
-        os.chdir(self.__saved_dir)
-        self.__saved_dir = None
         self.clean_image_manifest_file()
 
     def clean_image_manifest_file(self):
-        manifest_file_path = Image.PACKER_MANIFEST_FILE
+        manifest_file_path = self.get_manifest_file()
         if os.path.exists(manifest_file_path):
             try:
                 self.logger.info('Removing manifest file...')
@@ -178,9 +180,19 @@ class Image(Base):
     def get_name(self):
         return self.name
 
+    def get_build_dir(self):
+        return self.build_dir
+
+    def get_manifest_file(self):
+        # packer writes the manifest on its working dir
+        return f'{self.build_dir}/{Image.PACKER_MANIFEST_FILE}'
+
     def get_variables_file(self):
         return f'{self.image_dir}/variables.json'
 
+    def get_variables_dir(self):
+        return f'{self.image_dir}/{Env.VARIABLES_DIR}'
+
     def get_packer_file(self):
         return f'{self.image_dir}/{Image.PACKER_FILE}'
 
@@ -234,7 +246,7 @@ class Image(Base):
         return latest_build['artifact_id']
 
     def get_manifest_file_content(self):
-        manifest_file = Image.PACKER_MANIFEST_FILE
+        manifest_file = self.get_manifest_file()
         manifest_content = ''
 
         if os.path.exists(manifest_file):
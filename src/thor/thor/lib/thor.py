@@ -6,6 +6,10 @@ class Thor:
     ROOT_DIR = os.getcwd()
     # Main build directory
     BUILD_DIR = f'{ROOT_DIR}/build'
+    # Cache shared by all builds
+    CACHE_DIR = f'{BUILD_DIR}/.cache'
+    # Old build dirs waiting to be deleted
+    TRASH_DIR = f'{BUILD_DIR}/.trash'
     # Environments folder
     ENVIRONMENTS_DIR = f'{ROOT_DIR}/environments'
     # Images directory
@@ -0,0 +1,151 @@
+import errno
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+CHUNK_SIZE = 1024 * 1024
+# ioctl to clone (reflink) a file on copy-on-write filesystems
+FICLONE = 0x40049409
+
+COPY_MODE = 'copy'
+REFLINK_MODE = 'reflink'
+HARDLINK_MODE = 'hardlink'
+MODES = [COPY_MODE, REFLINK_MODE, HARDLINK_MODE]
+
+# errors meaning the syscall can't be used for these files,
+# the copy falls back to the next available strategy.
+_UNSUPPORTED_ERRNOS = (
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EBADF,
+    errno.EMLINK,
+    errno.EPERM,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY
+)
+
+
+def _kernel_copy(func, src_fd, dst_fd, size):
+    '''
+    Copy size bytes using func(src_fd, dst_fd, count) until it's done.
+    Returns False when func is not supported for these files.
+    '''
+    copied = 0
+
+    while copied < size:
+        try:
+            sent = func(src_fd, dst_fd, min(CHUNK_SIZE, size - copied))
+        except OSError as err:
+            if copied == 0 and err.errno in _UNSUPPORTED_ERRNOS:
+                return False
+            raise
+        if sent == 0:
+            # file was truncated while copying
+            break
+        copied += sent
+    return True
+
+
+def _copy_file_range(src_fd, dst_fd, count):
+    return os.copy_file_range(src_fd, dst_fd, count)
+
+
+def _sendfile(src_fd, dst_fd, count):
+    return os.sendfile(dst_fd, src_fd, None, count)
+
+
+def copy_file(src, dst):
+    '''
+    Copy src into dst without loading the file in memory. Data
+    is copied by the kernel (copy_file_range or sendfile) when
+    possible, otherwise it's copied in chunks.
+    '''
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        strategies = []
+
+        if hasattr(os, 'copy_file_range'):
+            strategies.append(_copy_file_range)
+        if hasattr(os, 'sendfile'):
+            strategies.append(_sendfile)
+
+        for strategy in strategies:
+            if _kernel_copy(strategy, fsrc.fileno(), fdst.fileno(), size):
+                return
+        shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+
+
+def reflink_file(src, dst):
+    '''
+    Clone src into dst sharing the same data blocks. Only works
+    on copy-on-write filesystems (btrfs, xfs...), falls back to
+    copy_file otherwise.
+    '''
+    if fcntl is not None:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError as err:
+                if err.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+    copy_file(src, dst)
+
+
+def hardlink_file(src, dst):
+    '''
+    Hard link dst to src. Falls back to copy_file when both
+    are not on the same filesystem or links are not supported.
+    '''
+    try:
+        os.link(src, dst)
+    except OSError as err:
+        if err.errno not in _UNSUPPORTED_ERRNOS:
+            raise
+        copy_file(src, dst)
+
+
+def install_file(src, dst, mode=COPY_MODE):
+    '''
+    Place src on dst using one of the MODES.
+    '''
+    # dst may be a link to some other file, it must never be
+    # written through.
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if mode == HARDLINK_MODE:
+        hardlink_file(src, dst)
+        return
+    elif mode == REFLINK_MODE:
+        reflink_file(src, dst)
+    else:
+        copy_file(src, dst)
+    # copies keep src mtime, so they look the same to tools
+    # comparing mtime and size (e.g. rsync) on every build.
+    stat = os.stat(src)
+    os.utime(dst, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def write_file_atomic(path, content):
+    '''
+    Write content into a temporary file next to path and rename it,
+    so readers never see a partially written file.
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix=f'.{os.path.basename(path)}.')
+    try:
+        with os.fdopen(fd, 'wb' if type(content) is bytes else 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,35 @@
+import hashlib
+import json
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path, algorithm='sha256', chunk_size=CHUNK_SIZE):
+    '''
+    Hash file content reading it in chunks, so memory usage does
+    not depend on the file size.
+    '''
+    m = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            m.update(chunk)
+            chunk = f.read(chunk_size)
+    return m.hexdigest()
+
+
+def string_digest(*values, algorithm='sha256'):
+    m = hashlib.new(algorithm)
+    for value in values:
+        if type(value) is not bytes:
+            value = str(value).encode()
+        m.update(value)
+        # separator avoids ('ab', 'c') and ('a', 'bc') colliding
+        m.update(b'\0')
+    return m.hexdigest()
+
+
+def json_digest(value, algorithm='sha256'):
+    encoded = json.dumps(value, sort_keys=True, default=str)
+    return string_digest(encoded, algorithm=algorithm)
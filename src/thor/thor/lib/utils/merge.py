@@ -0,0 +1,18 @@
+def deep_merge(base, override, concat_lists=False):
+    '''
+    Merge override into base returning a new value. Dictionaries are
+    merged recursively, lists are replaced (or concatenated when
+    concat_lists is set) and any other value in override wins.
+    '''
+    if type(base) is dict and type(override) is dict:
+        merged = dict(base)
+        for key, value in override.items():
+            if key in merged:
+                merged[key] = deep_merge(merged[key], value, concat_lists)
+            else:
+                merged[key] = value
+        return merged
+
+    if concat_lists and type(base) is list and type(override) is list:
+        return base + override
+    return override
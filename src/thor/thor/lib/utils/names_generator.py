@@ -2,7 +2,14 @@ import random
 import string
 
 
-def random_string(size=10):
+def random_string(size=10, seed=None):
+    '''
+    Random alphanumeric string. The same seed always gives
+    the same string.
+    '''
+    choice = random.choice
+    if seed is not None:
+        choice = random.Random(seed).choice
     random_string = ''
     if size < 3 or size > 32:
         return random_string
@@ -10,5 +17,5 @@ def random_string(size=10):
     char_range += string.digits
 
     for char in range(size):
-        random_string += random.choice(char_range)
+        random_string += choice(char_range)
     return random_string
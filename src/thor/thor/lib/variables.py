@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+from thor.lib.base import Base
+from thor.lib.utils.merge import deep_merge
+
+
+class VariablesException(Exception):
+    pass
+
+
+class Variables(Base):
+    '''
+    Variables of an image. Environment variables.json and
+    variables.d/*.json fragments are merged first, then the image
+    ones. Dictionaries are merged recursively, lists concatenated and
+    any other value of a later file wins. Parsed files are shared by
+    all images compiled by the same process while they don't change.
+    '''
+
+    # parsed files shared by all images compiled by this process
+    __FILE_CACHE = {}
+    __FILE_CACHE_LOCK = threading.Lock()
+
+    def __init__(self, env, image):
+        super().__init__()
+        self.env = env
+        self.image = image
+
+    def get_files(self):
+        '''
+        Variables files in merge order.
+        '''
+        files = []
+        sources = [
+            (self.env.get_variables_file(), self.env.get_variables_dir()),
+            (self.image.get_variables_file(), self.image.get_variables_dir())
+        ]
+
+        for variables_file, fragments_dir in sources:
+            if os.path.isfile(variables_file):
+                files.append(variables_file)
+            if os.path.isdir(fragments_dir):
+                files += sorted(f'{fragments_dir}/{x}'
+                                for x in os.listdir(fragments_dir)
+                                if x.endswith('.json'))
+        return files
+
+    def load_file(self, path):
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with Variables.__FILE_CACHE_LOCK:
+            entry = Variables.__FILE_CACHE.get(path)
+            if entry is not None and entry['version'] == version:
+                return entry['variables']
+
+        self.logger.info(f'Loading variables file {path}')
+        try:
+            with open(path, 'r') as f:
+                variables = json.load(f)
+        except ValueError as err:
+            raise VariablesException(f'Invalid variables file {path}: {err}')
+        if type(variables) is not dict:
+            raise VariablesException(f'Invalid variables file {path}: '
+                                     'content must be an object')
+
+        with Variables.__FILE_CACHE_LOCK:
+            Variables.__FILE_CACHE[path] = {
+                'version': version,
+                'variables': variables
+            }
+        return variables
+
+    def load(self):
+        variables = {}
+        for path in self.get_files():
+            variables = deep_merge(variables, self.load_file(path),
+                                   concat_lists=True)
+        return variables
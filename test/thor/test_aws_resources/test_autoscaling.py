@@ -1,6 +1,24 @@
-from thor.lib.aws_resources.autoscaling import AutoScaling
+from thor.lib.aws_resources.autoscaling import (
+    AutoScaling,
+    AutoScalingException
+)
 from thor.lib.env import Env
 from unittest import TestCase
+from unittest.mock import (
+    MagicMock,
+    patch
+)
+
+
+def fake_instance_refresh(status, reason=''):
+    return {
+        'InstanceRefreshes': [{
+            'InstanceRefreshId': 'r-1',
+            'Status': status,
+            'StatusReason': reason,
+            'PercentageComplete': 50
+        }]
+    }
 
 
 class TestAutoScalingGroup(TestCase):
@@ -23,3 +41,26 @@ class TestAutoScalingGroup(TestCase):
             'LifecycleState': 'InService'
         }
         self.assertFalse(autoscaling._AutoScaling__is_instance_health(fake_health_input))
+
+    @patch('thor.lib.aws_resources.aws_resource.time.sleep')
+    def test_wait_for_instance_refresh(self, sleep):
+        autoscaling = AutoScaling(self.env)
+        client = MagicMock()
+        client.describe_instance_refreshes.side_effect = [
+            fake_instance_refresh('Pending'),
+            fake_instance_refresh('InProgress'),
+            fake_instance_refresh('Successful')
+        ]
+        with patch.object(AutoScaling, 'client', return_value=client):
+            autoscaling.wait_for_instance_refresh('asg', 'r-1')
+        self.assertEqual(sleep.call_count, 2)
+
+    @patch('thor.lib.aws_resources.aws_resource.time.sleep')
+    def test_wait_for_instance_refresh_failed(self, sleep):
+        autoscaling = AutoScaling(self.env)
+        client = MagicMock()
+        client.describe_instance_refreshes.return_value = \
+            fake_instance_refresh('Failed', 'unhealthy instances')
+        with patch.object(AutoScaling, 'client', return_value=client):
+            with self.assertRaises(AutoScalingException):
+                autoscaling.wait_for_instance_refresh('asg', 'r-1')
@@ -1,3 +1,5 @@
+import itertools
+import threading
 import time
 from thor.lib.env import Env
 from thor.lib.aws_resources.aws_resource import (
@@ -6,6 +8,7 @@ from thor.lib.aws_resources.aws_resource import (
     AwsResourceParameterException
 )
 from unittest import TestCase
+from unittest.mock import patch
 
 
 def fake_api_call(sleep_for=1, exit_status=True):
@@ -34,4 +37,34 @@ class TestAwsResource(TestCase):
         with self.assertRaises(AwsResourceParameterException):
             aws_resource.wait_for(retry_interval=1, timeout=0, func=fake_api_call)
         with self.assertRaises(AwsResourceParameterException):
-            aws_resource.wait_for(retry_interval=0, timeout=1, func=fake_api_call)
\ No newline at end of file
+            aws_resource.wait_for(retry_interval=0, timeout=1, func=fake_api_call)
+
+    def test_wait_for_backoff(self):
+        aws_resource = AwsResource('testresource', self.env)
+        results = iter([False] * 5 + [True])
+        with patch('thor.lib.aws_resources.aws_resource.time.sleep') as sleep:
+            self.assertTrue(aws_resource.wait_for_backoff(
+                5, 60, lambda: next(results)))
+        intervals = [x.args[0] for x in sleep.call_args_list]
+        self.assertEqual(len(intervals), 5)
+        # 2, 4, 5, 5, 5 with jitter
+        for interval, limit in zip(intervals, [2, 4, 5, 5, 5]):
+            self.assertGreaterEqual(interval, limit / 2)
+            self.assertLessEqual(interval, limit)
+
+    def test_wait_cancelled(self):
+        aws_resource = AwsResource('testresource', self.env)
+        aws_resource.cancel_event = threading.Event()
+        aws_resource.cancel_event.set()
+        calls = []
+        with self.assertRaises(KeyboardInterrupt):
+            aws_resource.wait_for_backoff(
+                60, 600, lambda: calls.append(1))
+        self.assertEqual(len(calls), 1)
+
+    def test_backoff_intervals(self):
+        aws_resource = AwsResource('testresource', self.env)
+        intervals = list(itertools.islice(
+            aws_resource.get_backoff_intervals(60), 10))
+        self.assertLessEqual(intervals[0], 2)
+        self.assertGreaterEqual(intervals[-1], 30)
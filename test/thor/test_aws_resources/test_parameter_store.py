@@ -0,0 +1,33 @@
+from thor.lib.aws_resources.parameter_store import (
+    ParameterStore,
+    ParameterStoreException
+)
+from thor.lib.env import Env
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+
+class TestParameterStore(TestCase):
+
+    def setUp(self):
+        self.param = ParameterStore(Env('test'))
+        self.client = MagicMock()
+        self.param._AwsResource__client = self.client
+
+    def test_get_many(self):
+        self.client.get_parameters.return_value = {
+            'Parameters': [
+                {'Name': '/a', 'Type': 'String', 'Value': 'a'},
+                {'Name': '/b', 'Type': 'StringList', 'Value': 'b,c'},
+                {'Name': '/c', 'Type': 'SecureString', 'Value': 'secret'}
+            ],
+            'InvalidParameters': ['/d']
+        }
+        values, not_found = self.param.get_many(['/a', '/b', '/c', '/d'])
+        self.assertDictEqual(values, {'/a': 'a', '/b': ['b', 'c']})
+        self.assertListEqual(not_found, ['/d'])
+
+    def test_get_many_max_names(self):
+        names = [f'/{i}' for i in range(ParameterStore.MAX_GET_PARAMETERS+1)]
+        with self.assertRaises(ParameterStoreException):
+            self.param.get_many(names)
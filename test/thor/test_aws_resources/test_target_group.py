@@ -0,0 +1,55 @@
+from thor.lib.aws_resources.aws_resource import AwsResourceTimeoutException
+from thor.lib.aws_resources.target_group import TargetGroup
+from thor.lib.env import Env
+from unittest import TestCase
+from unittest.mock import (
+    MagicMock,
+    patch
+)
+
+
+def fake_target_health(*states):
+    return {
+        'TargetHealthDescriptions': [
+            {'Target': {'Id': f'i-{i}'}, 'TargetHealth': {'State': state}}
+            for i, state in enumerate(states)
+        ]
+    }
+
+
+class TestTargetGroup(TestCase):
+
+    def setUp(self):
+        self.target_group = TargetGroup(Env('test'))
+        self.client = MagicMock()
+        patcher = patch.object(TargetGroup, 'client',
+                               return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('thor.lib.aws_resources.aws_resource.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_read_health(self):
+        self.client.describe_target_health.return_value = \
+            fake_target_health('healthy', 'initial')
+        self.assertDictEqual(self.target_group.read_health('arn'),
+                             {'i-0': 'healthy', 'i-1': 'initial'})
+
+    def test_wait_for_healthy(self):
+        self.client.describe_target_health.side_effect = [
+            fake_target_health('initial', 'initial'),
+            fake_target_health('healthy', 'initial'),
+            fake_target_health('healthy', 'healthy')
+        ]
+        self.target_group.wait_for_healthy('arn', ['i-0', 'i-1'])
+        self.assertEqual(self.client.describe_target_health.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_wait_for_healthy_timeout(self):
+        self.client.describe_target_health.return_value = \
+            fake_target_health('unhealthy')
+        with patch('thor.lib.aws_resources.aws_resource.time.time',
+                   side_effect=[0, 0, 5]):
+            with self.assertRaises(AwsResourceTimeoutException):
+                self.target_group.wait_for_healthy('arn', ['i-0'], timeout=5)
@@ -0,0 +1,710 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from thor.lib.compiler import (
+    Compiler,
+    CompilerBundleLoader,
+    CompilerFileCache,
+    CompilerParamCache
+)
+from thor.lib.env import Env
+from thor.lib.image import Image
+from thor.lib.aws_resources.parameter_store import (
+    ParameterStore,
+    ParameterStoreNotFoundException
+)
+from thor.lib.thor import Thor
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestCompiler(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = self.tmp_dir.name
+        patches = {
+            'BUILD_DIR': f'{root}/build',
+            'CACHE_DIR': f'{root}/build/.cache',
+            'TRASH_DIR': f'{root}/build/.trash',
+            'ENVIRONMENTS_DIR': f'{root}/environments',
+            'IMAGES_DIR': f'{root}/images',
+            'TEMPLATES_DIR': f'{root}/templates'
+        }
+        for attr, value in patches.items():
+            patcher = patch.object(Thor, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.write_file('environments/test/variables.json',
+                        json.dumps({'region': 'us-east-1'}))
+        self.write_file('images/test/variables.json',
+                        json.dumps({'name': 'test'}))
+        self.write_file('images/test/static/dir/file.txt', 'static')
+        self.write_file('images/test/templates/app.conf.tmpl',
+                        'name={{ var.name }}')
+        self.write_file('images/test/packer.json',
+                        '{"region": "{{ var.region }}"}')
+        self.env = Env('test')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, path, content):
+        full_path = f'{self.tmp_dir.name}/{path}'
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            f.write(content)
+
+    def read_build_file(self, path):
+        with open(f'{Thor.BUILD_DIR}/test/test/{path}') as f:
+            return f.read()
+
+    def build_mtime(self, path):
+        return os.stat(f'{Thor.BUILD_DIR}/test/test/{path}').st_mtime_ns
+
+    def compile(self, incremental=False, jobs=1):
+        compiler = Compiler(Image(self.env, 'test'), incremental=incremental,
+                            jobs=jobs)
+        self.assertEqual(compiler.build_all(), 'success')
+        return compiler
+
+    def test_build_all(self):
+        self.compile()
+        self.assertEqual(self.read_build_file('static/dir/file.txt'),
+                         'static')
+        self.assertEqual(self.read_build_file('templates/app.conf'),
+                         'name=test')
+        self.assertEqual(self.read_build_file('packer.json'),
+                         '{"region": "us-east-1"}')
+
+    def test_clean_moves_build_to_trash(self):
+        self.compile()
+        self.write_file('build/test/test/old.txt', 'old')
+        os.makedirs(f'{Thor.TRASH_DIR}/leftover/dir')
+
+        compiler = Compiler(Image(self.env, 'test'), wait_clean=True)
+        self.assertEqual(compiler.build_target('clean'), 'success')
+        compiler.wait_for_clean()
+        compiler.reap_thread.join()
+        self.assertListEqual(os.listdir(f'{Thor.BUILD_DIR}/test/test'), [])
+        self.assertListEqual(os.listdir(f'{Thor.BUILD_DIR}/test'), ['test'])
+        self.assertListEqual(os.listdir(Thor.TRASH_DIR), [])
+
+    def test_trash_reaped_while_building(self):
+        # the third one replaces the build kept as previous
+        self.compile()
+        self.compile()
+        os.makedirs(f'{Thor.TRASH_DIR}/leftover/dir')
+
+        compiler = Compiler(Image(self.env, 'test'))
+        self.assertEqual(compiler.build_all(), 'success')
+        # the process waits for deletes before exiting
+        threads = [compiler.reap_thread] + compiler.clean_threads
+        self.assertEqual(len(threads), 2)
+        self.assertFalse(any(x.daemon for x in threads))
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(os.listdir(Thor.TRASH_DIR), [])
+
+    def test_staged_build_published(self):
+        # build dir written in place by older versions
+        self.write_file('build/test/test/old.txt', 'old')
+        self.compile()
+        build_dir = f'{Thor.BUILD_DIR}/test/test'
+        self.assertTrue(os.path.islink(build_dir))
+        self.assertFalse(os.path.exists(f'{build_dir}/old.txt'))
+        self.assertTrue(os.path.exists(f'{build_dir}.previous/old.txt'))
+
+        first = os.path.realpath(build_dir)
+        compiler = Compiler(Image(self.env, 'test'), wait_clean=True)
+        compiler.build_all()
+        self.assertEqual(os.path.realpath(f'{build_dir}.previous'), first)
+        # the legacy build dir was replaced
+        self.assertEqual(len(os.listdir(f'{Thor.BUILD_DIR}/test')), 4)
+
+    def test_failed_build_not_published(self):
+        self.compile()
+        build_dir = f'{Thor.BUILD_DIR}/test/test'
+        published = os.path.realpath(build_dir)
+        # only known to be broken when rendering
+        self.write_file('images/test/templates/broken.conf',
+                        '{{ var[var.name].key }}')
+
+        compiler = Compiler(Image(self.env, 'test'), wait_clean=True)
+        with self.assertRaises(SystemExit):
+            compiler.build_all()
+        compiler.wait_for_clean()
+        self.assertEqual(os.path.realpath(build_dir), published)
+        self.assertFalse(os.path.exists(compiler.stage_dir))
+        self.assertEqual(self.read_build_file('templates/app.conf'),
+                         'name=test')
+
+    def test_overlapping_builds(self):
+        build_dir = f'{Thor.BUILD_DIR}/test/test'
+        # left by a compile that didn't finish
+        leftover = f'{Thor.BUILD_DIR}/test/.test.leftover'
+        os.makedirs(leftover)
+        running = Compiler(Image(self.env, 'test'))
+        running.start_stage()
+
+        self.compile()
+        self.assertTrue(os.path.isdir(running.stage_dir))
+        self.assertFalse(os.path.exists(leftover))
+
+        self.assertEqual(running.run_targets(running.build_targets[1:]),
+                         'success')
+        running.publish()
+        self.assertEqual(os.path.realpath(build_dir), running.stage_dir)
+        self.assertEqual(self.read_build_file('templates/app.conf'),
+                         'name=test')
+        self.assertListEqual(
+            [x for x in os.listdir(f'{Thor.BUILD_DIR}/test')
+             if x.endswith('.lock')], [])
+
+    def test_concurrent_builds(self):
+        def compile_image(i):
+            return Compiler(Image(self.env, 'test')).build_all()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(compile_image, range(8)))
+        self.assertListEqual(results, ['success'] * 8)
+        self.assertEqual(self.read_build_file('templates/app.conf'),
+                         'name=test')
+
+    def test_identical_outputs_not_written(self):
+        self.compile()
+        app_mtime = self.build_mtime('templates/app.conf')
+        packer_mtime = self.build_mtime('packer.json')
+        self.write_file('environments/test/variables.json',
+                        json.dumps({'region': 'eu-west-1'}))
+
+        compiler = self.compile()
+        self.assertEqual(app_mtime, self.build_mtime('templates/app.conf'))
+        self.assertNotEqual(packer_mtime, self.build_mtime('packer.json'))
+        self.assertEqual(self.read_build_file('packer.json'),
+                         '{"region": "eu-west-1"}')
+        with open(compiler.get_build_info_file()) as f:
+            build_info = json.load(f)
+        # app.conf and config.json
+        self.assertDictEqual(build_info['renders'],
+                             {'written': 1, 'unchanged': 2})
+
+    def test_incremental_links_unchanged(self):
+        self.compile(incremental=True)
+        previous = os.stat(f'{Thor.BUILD_DIR}/test/test/templates/app.conf')
+        self.compile(incremental=True)
+        current = os.stat(f'{Thor.BUILD_DIR}/test/test/templates/app.conf')
+        self.assertEqual(previous.st_ino, current.st_ino)
+        self.assertEqual(current.st_nlink, 2)
+
+    def test_build_config(self):
+        self.write_file('environments/test/config.json', json.dumps({
+            'launch_template': {'instance_type': 't3.micro',
+                                'key_name': '{{ var.region }}'},
+            'scaling': {'min_size': 1}
+        }))
+        self.write_file('images/test/config.json', json.dumps({
+            'launch_template': {'instance_type': 't3.large'}
+        }))
+        image = Image(self.env, 'test')
+        Compiler(image).build_all()
+
+        expected = {
+            'launch_template': {'instance_type': 't3.large',
+                                'key_name': 'us-east-1'},
+            'scaling': {'min_size': 1}
+        }
+        self.assertDictEqual(image.config.get(), expected)
+        self.assertDictEqual(json.loads(self.read_build_file('config.json')),
+                             expected)
+        self.assertFalse(os.path.exists(f'{Thor.BUILD_DIR}/test/test/tmp'))
+
+    def test_build_keeps_current_dir(self):
+        cwd = os.getcwd()
+        with Compiler(Image(self.env, 'test')) as compiler:
+            compiler.build_all()
+            self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_concurrent_compilers(self):
+        self.write_file('environments/prod/variables.json',
+                        json.dumps({'region': 'eu-west-1'}))
+
+        def compile_env(env_name):
+            compiler = Compiler(Image(Env(env_name), 'test'))
+            return compiler.build_all()
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            results = list(pool.map(compile_env, ['test', 'prod']))
+        self.assertListEqual(results, ['success', 'success'])
+        with open(f'{Thor.BUILD_DIR}/prod/test/packer.json') as f:
+            self.assertEqual(f.read(), '{"region": "eu-west-1"}')
+
+    def test_incremental_skips_unchanged(self):
+        first = self.compile(incremental=True)
+        static_mtime = self.build_mtime('static/dir/file.txt')
+        template_mtime = self.build_mtime('templates/app.conf')
+
+        second = self.compile(incremental=True)
+        self.assertEqual(first.random_string, second.random_string)
+        self.assertEqual(static_mtime,
+                         self.build_mtime('static/dir/file.txt'))
+        self.assertEqual(template_mtime,
+                         self.build_mtime('templates/app.conf'))
+
+    def test_deterministic_build(self):
+        self.write_file('images/test/templates/id.tmpl',
+                        '{{ thor.random_string }}')
+        first = Compiler(Image(self.env, 'test'), deterministic=True)
+        self.assertEqual(first.build_all(), 'success')
+        build_info = self.read_build_file('build_info.json')
+        self.assertNotIn('start_time', json.loads(build_info))
+
+        second = Compiler(Image(self.env, 'test'), deterministic=True)
+        self.assertEqual(second.build_all(), 'success')
+        self.assertEqual(self.read_build_file('templates/id'),
+                         first.random_string)
+        self.assertEqual(self.read_build_file('build_info.json'),
+                         build_info)
+
+        self.write_file('images/test/static/dir/file.txt', 'changed')
+        changed = Compiler(Image(self.env, 'test'), deterministic=True)
+        self.assertNotEqual(changed.random_string, first.random_string)
+
+        seeded = Compiler(Image(self.env, 'test'), seed='release-1')
+        self.assertTrue(seeded.deterministic)
+        self.assertEqual(seeded.random_string,
+                         Compiler(Image(self.env, 'test'),
+                                  seed='release-1').random_string)
+
+    def test_incremental_rebuilds_changed(self):
+        self.compile(incremental=True)
+        self.write_file('images/test/static/dir/file.txt', 'changed')
+        self.write_file('images/test/variables.json',
+                        json.dumps({'name': 'changed'}))
+
+        self.compile(incremental=True)
+        self.assertEqual(self.read_build_file('static/dir/file.txt'),
+                         'changed')
+        self.assertEqual(self.read_build_file('templates/app.conf'),
+                         'name=changed')
+
+    def test_incremental_packer_and_config(self):
+        self.write_file('images/test/packer.json',
+                        "{\"file\": \"{{ 'static/dir/file.txt' "
+                        "| include_file }}\"}")
+        self.write_file('templates/partial.tmpl', 'first')
+        self.write_file('images/test/config.json',
+                        "{\"name\": \"{% include 'partial.tmpl' %}\"}")
+        self.compile(incremental=True)
+        packer_mtime = self.build_mtime('packer.json')
+        config_mtime = self.build_mtime('config.json')
+
+        self.compile(incremental=True)
+        self.assertEqual(packer_mtime, self.build_mtime('packer.json'))
+        self.assertEqual(config_mtime, self.build_mtime('config.json'))
+
+        # dependencies changed, sources did not
+        self.write_file('images/test/static/dir/file.txt', 'changed')
+        self.write_file('templates/partial.tmpl', 'second')
+        self.compile(incremental=True)
+        self.assertEqual(self.read_build_file('packer.json'),
+                         '{"file": "changed"}')
+        self.assertEqual(
+            json.loads(self.read_build_file('config.json'))['name'],
+            'second')
+
+    def test_incremental_removes_stale_outputs(self):
+        self.compile(incremental=True)
+        os.remove(f'{Thor.IMAGES_DIR}/test/static/dir/file.txt')
+
+        self.compile(incremental=True)
+        self.assertFalse(os.path.exists(
+            f'{Thor.BUILD_DIR}/test/test/static/dir/file.txt'))
+
+    def test_incremental_dependencies(self):
+        self.write_file('templates/partial.tmpl', '{{ var.region }}')
+        self.write_file('images/test/templates/a.conf',
+                        "{% include 'partial.tmpl' %}")
+        self.write_file('images/test/templates/b.conf', '{{ var.name }}')
+        self.compile(incremental=True)
+        self.assertEqual(self.read_build_file('templates/a.conf'),
+                         'us-east-1')
+        b_mtime = self.build_mtime('templates/b.conf')
+
+        # image template overrides the global one
+        self.write_file('images/test/templates/partial.tmpl', 'image')
+        self.compile(incremental=True)
+        self.assertEqual(self.read_build_file('templates/a.conf'), 'image')
+        self.assertEqual(b_mtime, self.build_mtime('templates/b.conf'))
+
+        # variable not referenced by b.conf
+        self.write_file('environments/test/variables.json',
+                        json.dumps({'region': 'eu-west-1', 'other': 1}))
+        a_mtime = self.build_mtime('templates/a.conf')
+        self.compile(incremental=True)
+        self.assertEqual(a_mtime, self.build_mtime('templates/a.conf'))
+        self.assertEqual(b_mtime, self.build_mtime('templates/b.conf'))
+
+    def test_parallel_render(self):
+        for i in range(10):
+            self.write_file(f'images/test/templates/conf/{i}.conf',
+                            f'{i}={{{{ var.name }}}}')
+        # environment template is overridden by image template
+        self.write_file('environments/test/templates/app.conf.tmpl',
+                        'name=env')
+        self.compile(jobs=4)
+
+        self.assertEqual(self.read_build_file('templates/app.conf'),
+                         'name=test')
+        for i in range(10):
+            self.assertEqual(self.read_build_file(f'templates/conf/{i}.conf'),
+                             f'{i}=test')
+
+    def test_parallel_render_error(self):
+        self.write_file('images/test/templates/broken.conf',
+                        '{{ var.missing.key }}')
+        compiler = Compiler(Image(self.env, 'test'), jobs=4)
+        compiler.build_target_static()
+        with self.assertRaises(SystemExit):
+            compiler.build_target_templates()
+
+    def test_targets_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait_other_target(compiler):
+            barrier.wait()
+            return 'success'
+
+        # static and packer only finish when both are running
+        with patch.object(Compiler, 'build_target_static',
+                          wait_other_target), \
+                patch.object(Compiler, 'build_target_packer',
+                             wait_other_target):
+            compiler = self.compile()
+
+        with open(compiler.get_build_info_file()) as f:
+            build_info = json.load(f)
+        self.assertSetEqual(set(build_info['targets']),
+                            {'static', 'templates', 'packer', 'config'})
+
+    def test_include_waits_for_static(self):
+        self.write_file('images/test/templates/include.conf',
+                        "{{ 'static/dir/file.txt' | include_file }}")
+        build_target_static = Compiler.build_target_static
+
+        def slow_static(compiler):
+            time.sleep(0.2)
+            return build_target_static(compiler)
+
+        with patch.object(Compiler, 'build_target_static', slow_static):
+            self.compile()
+        self.assertEqual(self.read_build_file('templates/include.conf'),
+                         'static')
+
+    def test_include_file_cached(self):
+        self.write_file('images/test/static/cert.pem', 'line1\r\nline2')
+        for name in ['a', 'b']:
+            self.write_file(f'images/test/templates/{name}.conf',
+                            "{{ 'static/cert.pem' | include_file }}|"
+                            "{{ 'static/cert.pem' | include_file_b64 }}")
+        compiler = self.compile()
+
+        encoded = base64.b64encode(b'line1\r\nline2').decode()
+        self.assertEqual(self.read_build_file('templates/a.conf'),
+                         f'line1\nline2|{encoded}')
+        self.assertEqual(self.read_build_file('templates/b.conf'),
+                         f'line1\nline2|{encoded}')
+        self.assertDictEqual(compiler.file_cache.get_stats(),
+                             {'hits': 2, 'misses': 2, 'size': 2})
+
+    def test_hash_file_filters(self):
+        self.write_file('images/test/templates/hash.conf',
+                        "{{ 'static/dir/file.txt' | sha256_file }} "
+                        "{{ 'static/dir/file.txt' | md5_file }}")
+        compiler = self.compile()
+        self.assertEqual(self.read_build_file('templates/hash.conf'),
+                         f'{hashlib.sha256(b"static").hexdigest()} '
+                         f'{hashlib.md5(b"static").hexdigest()}')
+        self.assertEqual(compiler.hash_cache.get_stats()['misses'], 2)
+
+        # static copies keep the source mtime
+        compiler = self.compile()
+        self.assertEqual(compiler.hash_cache.get_stats()['hits'], 2)
+        self.assertEqual(compiler.hash_cache.get_stats()['misses'], 0)
+
+    def test_profile(self):
+        self.write_file('images/test/templates/params.conf',
+                        "{{ 'db/host' | get_param }}"
+                        "{{ 'db/host' | get_param }}")
+        values = {'/thor/test/db/host': 'localhost'}
+        compiler = Compiler(Image(self.env, 'test'), profile=True)
+        with patch.object(ParameterStore, 'get_many',
+                          return_value=(values, [])):
+            self.assertEqual(compiler.build_all(), 'success')
+
+        with open(compiler.get_build_info_file()) as f:
+            profile = json.load(f)['profile']
+        self.assertSetEqual(set(profile['templates']),
+                            {'templates/app.conf', 'templates/params.conf',
+                             'packer.json'})
+        params_conf = profile['templates']['templates/params.conf']
+        self.assertEqual(params_conf['bytes'], len('localhostlocalhost'))
+        self.assertEqual(profile['filters']['get_param']['calls'], 2)
+        self.assertEqual(profile['static']['files'], 1)
+        self.assertEqual(profile['counters']['ssm_get_parameters'], 1)
+        self.assertEqual(profile['counters']['ssm_get_parameter'], 0)
+        self.assertIn('prefetch_params', profile['phases'])
+
+    def test_precompiled_bundle(self):
+        self.write_file('templates/partial.tmpl', '{{ var.region }}')
+        self.write_file('images/test/templates/a.conf',
+                        "{% include 'partial.tmpl' %}")
+        bundle_file = Compiler(Image(self.env, 'test')).precompile()
+        self.assertTrue(os.path.exists(bundle_file))
+
+        # sources older than the bundle are not read
+        self.write_file('templates/partial.tmpl', 'source')
+        os.utime(f'{Thor.TEMPLATES_DIR}/partial.tmpl', ns=(0, 0))
+        compiler = self.compile()
+        self.assertIsInstance(compiler.get_jinja_env().loader,
+                              CompilerBundleLoader)
+        self.assertEqual(self.read_build_file('templates/a.conf'),
+                         'us-east-1')
+
+        # templates changed after the bundle was built
+        os.utime(bundle_file, ns=(0, 0))
+        compiler = self.compile()
+        self.assertNotIsInstance(compiler.get_jinja_env().loader,
+                                 CompilerBundleLoader)
+        self.assertEqual(self.read_build_file('templates/a.conf'),
+                         'source')
+
+    def test_precompiled_bundle_analyses(self):
+        self.write_file('images/test/templates/params.conf',
+                        "{{ 'db/host' | get_param }}")
+        Compiler(Image(self.env, 'test')).precompile()
+
+        compiler = Compiler(Image(self.env, 'test'))
+        jinja_env = compiler.get_jinja_env()
+        values = {'/thor/test/db/host': 'localhost'}
+        with patch.object(jinja_env, 'parse',
+                          wraps=jinja_env.parse) as parse, \
+                patch.object(ParameterStore, 'get_many',
+                             return_value=(values, [])) as get_many:
+            self.assertEqual(compiler.build_all(), 'success')
+        # packer.json and config.json are analyzed with the templates
+        parse.assert_not_called()
+        get_many.assert_called_once_with(['/thor/test/db/host'])
+        self.assertEqual(self.read_build_file('templates/params.conf'),
+                         'localhost')
+
+        # sources changed since the bundle was built are parsed
+        self.write_file('images/test/packer.json', '{}')
+        compiler = Compiler(Image(self.env, 'test'))
+        jinja_env = compiler.get_jinja_env()
+        with patch.object(jinja_env, 'parse',
+                          wraps=jinja_env.parse) as parse, \
+                patch.object(ParameterStore, 'get_many',
+                             return_value=(values, [])):
+            self.assertEqual(compiler.build_all(), 'success')
+        self.assertEqual(parse.call_count, 1)
+
+    def test_validate_templates(self):
+        self.write_file('images/test/templates/errors.conf',
+                        '{{ var.missing.key }}\n'
+                        '{{ var.name | unknown }}\n'
+                        '{{ undefined_name.key }}')
+        self.write_file('images/test/templates/syntax.conf', '{% if %}')
+        self.write_file('images/test/templates/valid.conf',
+                        '{{ var.missing }}'
+                        '{{ var.other.key | default("") }}'
+                        '{% if var.opt is defined %}{{ var.opt.key }}'
+                        '{% endif %}'
+                        "{{ var.get('x') }}{{ thor.env }}"
+                        '{% for x in range(2) %}{{ loop.index }}'
+                        '{% endfor %}'
+                        "{% set local = {'a': 1} %}{{ local.a }}")
+        compiler = Compiler(Image(self.env, 'test'))
+
+        with patch.object(ParameterStore, 'get_many') as get_many, \
+                self.assertLogs(compiler.logger, 'WARNING') as logs, \
+                self.assertRaises(SystemExit):
+            compiler.build_all()
+        get_many.assert_not_called()
+        self.assertFalse(os.path.exists(compiler.stage_dir))
+
+        errors = [x for x in logs.output if x.startswith('ERROR')]
+        warnings = [x for x in logs.output if x.startswith('WARNING')]
+        # last one aborts the build
+        self.assertEqual(len(errors), 5)
+        self.assertIn('syntax.conf:1:', errors[0])
+        self.assertIn('errors.conf:1: var.missing is undefined, '
+                      "can't read key", errors[1])
+        self.assertIn('errors.conf:2: unknown filter unknown', errors[2])
+        self.assertIn('errors.conf:3: undefined_name is undefined',
+                      errors[3])
+        self.assertEqual(len(warnings), 1)
+        self.assertIn('valid.conf:1: var.missing is undefined', warnings[0])
+
+    def test_validate_guards(self):
+        self.write_file('images/test/templates/guards.conf',
+                        '{% if var.x and var.x.y %}{{ var.x.y }}{% endif %}'
+                        '{% if not var.z or var.z.y %}{% endif %}'
+                        '{{ var.w.y if var.w is defined and var.w.y }}ok')
+        compiler = Compiler(Image(self.env, 'test'))
+        jinja_env = compiler.get_jinja_env()
+
+        with patch.object(jinja_env, 'parse',
+                          wraps=jinja_env.parse) as parse:
+            self.assertEqual(compiler.build_all(), 'success')
+        self.assertEqual(self.read_build_file('templates/guards.conf'), 'ok')
+        # templates, packer.json and config.json are parsed once
+        sources = compiler.get_template_sources()
+        self.assertEqual(parse.call_count, len(sources))
+
+    def test_analysis_cache(self):
+        self.compile()
+        self.write_file('images/test/templates/app.conf.tmpl',
+                        'changed={{ var.name }}')
+
+        compiler = Compiler(Image(self.env, 'test'))
+        jinja_env = compiler.get_jinja_env()
+        with patch.object(jinja_env, 'parse',
+                          wraps=jinja_env.parse) as parse:
+            self.assertEqual(compiler.build_all(), 'success')
+        # only the changed source
+        self.assertEqual(parse.call_count, 1)
+        with open(compiler.analysis_cache.path) as f:
+            self.assertEqual(len(json.load(f)),
+                             len(compiler.get_template_sources()))
+
+    def test_validate_conditional_reads(self):
+        self.write_file('images/test/templates/conditional.conf',
+                        '{% if var.use_db %}host={{ var.db.host }}'
+                        '{% endif %}ok')
+        compiler = Compiler(Image(self.env, 'test'))
+
+        with self.assertLogs(compiler.logger, 'WARNING') as logs:
+            self.assertEqual(compiler.build_all(), 'success')
+        self.assertEqual(self.read_build_file('templates/conditional.conf'),
+                         'ok')
+        self.assertIn('conditional.conf:1: var.db is undefined, '
+                      "can't read host", logs.output[-1])
+
+    def test_shared_jinja_env(self):
+        compiler = self.compile()
+        self.assertIs(compiler.get_jinja_env(), compiler.get_jinja_env())
+        self.assertIn('get_param', compiler.get_jinja_env().filters)
+
+    def test_bytecode_cache(self):
+        self.compile()
+        # app.conf.tmpl and packer.json
+        cache_files = os.listdir(f'{Thor.CACHE_DIR}/jinja')
+        self.assertEqual(len(cache_files), 2)
+
+        self.compile()
+        self.assertEqual(os.listdir(f'{Thor.CACHE_DIR}/jinja'), cache_files)
+        self.assertEqual(self.read_build_file('packer.json'),
+                         '{"region": "us-east-1"}')
+
+    def test_prefetch_params(self):
+        self.write_file('images/test/templates/params.conf',
+                        "{{ 'db/host' | get_param }} "
+                        "{{ 'db/port' | getparam }}"
+                        "{% set name = 'other' %}{{ name | get_param }}")
+        compiler = Compiler(Image(self.env, 'test'))
+        self.assertListEqual(compiler.find_template_params(),
+                             ['/thor/test/db/host', '/thor/test/db/port'])
+
+        values = {'/thor/test/db/host': 'localhost'}
+        not_found = ['/thor/test/db/port']
+        with patch.object(ParameterStore, 'get_many',
+                          return_value=(values, not_found)) as get_many:
+            compiler.prefetch_params()
+            get_many.assert_called_once_with(
+                ['/thor/test/db/host', '/thor/test/db/port'])
+
+        with patch.object(ParameterStore, 'get') as get:
+            self.assertEqual(compiler.get_param('/thor/test/db/host'),
+                             'localhost')
+            get.assert_not_called()
+
+    def test_params_not_stored_on_bytecode_cache(self):
+        self.write_file('images/test/templates/params.conf',
+                        "{{ 'db/host' | get_param }}")
+        for host in ['first', 'second']:
+            values = {'/thor/test/db/host': host}
+            with patch.object(ParameterStore, 'get_many',
+                              return_value=(values, [])):
+                self.compile()
+            self.assertEqual(self.read_build_file('templates/params.conf'),
+                             host)
+
+
+class TestCompilerFileCache(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = f'{self.tmp_dir.name}/file'
+        self.cache = CompilerFileCache()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, content):
+        with open(self.path, 'wb') as f:
+            f.write(content)
+
+    def test_file_changed(self):
+        self.write(b'first')
+        self.assertEqual(self.cache.get_text(self.path), 'first')
+        self.assertEqual(self.cache.get_text(self.path), 'first')
+        self.write(b'second')
+        self.assertEqual(self.cache.get_text(self.path), 'second')
+        self.assertEqual(self.cache.get_stats()['hits'], 1)
+        self.assertEqual(self.cache.get_stats()['misses'], 2)
+
+    def test_mmap(self):
+        content = os.urandom(1024 * 3 + 1)
+        self.write(content)
+        with patch.object(CompilerFileCache, 'MMAP_MIN_SIZE', 1024):
+            self.assertEqual(self.cache.get_b64(self.path),
+                             base64.b64encode(content).decode())
+
+
+class TestCompilerParamCache(TestCase):
+
+    def setUp(self):
+        self.cache = CompilerParamCache(Env('test'))
+
+    def test_read_through(self):
+        with patch.object(ParameterStore, 'get', return_value='v') as get:
+            for i in range(3):
+                self.assertEqual(self.cache.get('/thor/test/a'), 'v')
+            get.assert_called_once_with('/thor/test/a')
+        self.assertEqual(self.cache.get_stats()['hits'], 2)
+        self.assertEqual(self.cache.get_stats()['misses'], 1)
+
+    def test_negative_cache(self):
+        not_found = ParameterStoreNotFoundException()
+        with patch.object(ParameterStore, 'get', side_effect=not_found) as get:
+            for i in range(2):
+                with self.assertRaises(ParameterStoreNotFoundException):
+                    self.cache.get('/thor/test/missing')
+            get.assert_called_once()
+        self.assertEqual(self.cache.get_stats()['negative_hits'], 1)
+
+    def test_ttl(self):
+        self.cache.ttl = 10
+        self.cache.put('/thor/test/a', 'old')
+        self.cache.entries['/thor/test/a']['time'] -= 11
+        with patch.object(ParameterStore, 'get', return_value='new'):
+            self.assertEqual(self.cache.get('/thor/test/a'), 'new')
+        self.assertEqual(self.cache.get_stats()['misses'], 1)
@@ -0,0 +1,81 @@
+import os
+import tempfile
+from thor.lib.compiler_matrix import (
+    CompilerMatrix,
+    compile_image
+)
+from thor.lib.thor import Thor
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestCompilerMatrix(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = self.tmp_dir.name
+        patches = {
+            'BUILD_DIR': f'{root}/build',
+            'CACHE_DIR': f'{root}/build/.cache',
+            'TRASH_DIR': f'{root}/build/.trash',
+            'ENVIRONMENTS_DIR': f'{root}/environments',
+            'IMAGES_DIR': f'{root}/images',
+            'TEMPLATES_DIR': f'{root}/templates'
+        }
+        for attr, value in patches.items():
+            patcher = patch.object(Thor, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        for env_name in ['dev', 'prod']:
+            self.write_file(f'environments/{env_name}/variables.json', '{}')
+        for image_name in ['app', 'web']:
+            self.write_file(f'images/{image_name}/packer.json',
+                            '{"env": "{{ thor.env }}"}')
+        self.write_file('templates/global.conf', '{{ thor.image }}')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, path, content):
+        full_path = f'{self.tmp_dir.name}/{path}'
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            f.write(content)
+
+    def test_list_images(self):
+        self.assertListEqual(CompilerMatrix.list_images(), ['app', 'web'])
+
+    def test_compile_image(self):
+        result = compile_image('dev', 'app', {})
+        self.assertEqual(result['result'], 'success')
+        with open(f'{Thor.BUILD_DIR}/dev/app/templates/global.conf') as f:
+            self.assertEqual(f.read(), 'app')
+
+    def test_compile_image_fail(self):
+        self.write_file('templates/broken.conf', '{{ var.missing.key }}')
+        result = compile_image('dev', 'app', {})
+        self.assertEqual(result['result'], 'fail')
+
+    def test_warm_global_templates(self):
+        self.write_file('templates/param.conf', "{{ 'db/host' | get_param }}")
+        self.write_file('templates/file.conf',
+                        "{{ 'static/a' | include_file | sha256 }}")
+        self.write_file('templates/broken.conf', '{{ var | unknown }}')
+        matrix = CompilerMatrix(['dev'], ['app'])
+
+        with self.assertLogs('CompilerMatrix', 'WARNING') as logs:
+            matrix.warm_global_templates()
+        self.assertEqual(len(os.listdir(f'{Thor.CACHE_DIR}/jinja')), 3)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('broken.conf', logs.output[0])
+
+    def test_run(self):
+        matrix = CompilerMatrix(['dev', 'prod'], ['app', 'web'], 2)
+        results = matrix.run()
+        self.assertListEqual(
+            [(x['env'], x['image'], x['result']) for x in results],
+            [('dev', 'app', 'success'), ('dev', 'web', 'success'),
+             ('prod', 'app', 'success'), ('prod', 'web', 'success')])
+        with open(f'{Thor.BUILD_DIR}/prod/web/packer.json') as f:
+            self.assertEqual(f.read(), '{"env": "prod"}')
@@ -0,0 +1,70 @@
+from thor.lib.deploy import (
+    DeployBlueGreen,
+    DeployException
+)
+from thor.lib.aws_resources.aws_resource import AwsResourceTimeoutException
+from thor.lib.env import Env
+from thor.lib.image import Image
+from unittest import TestCase
+from unittest.mock import (
+    MagicMock,
+    patch
+)
+
+
+class TestDeployBlueGreen(TestCase):
+
+    def setUp(self):
+        self.image = Image(Env('test'), 'test')
+        self.set_deploy_config({})
+        self.deploy = DeployBlueGreen(self.image)
+        self.deploy.autoscaling = MagicMock()
+        self.deploy.target_group = MagicMock()
+        self.deploy.autoscaling.read.return_value = {
+            'TargetGroupARNs': ['arn'],
+            'Instances': [
+                {'InstanceId': 'i-0', 'LifecycleState': 'InService'},
+                {'InstanceId': 'i-1', 'LifecycleState': 'Terminating'}
+            ]
+        }
+
+    def set_deploy_config(self, deploy_config):
+        self.image.get_config().loaded_config = {
+            'scaling': {},
+            'deploy': deploy_config
+        }
+
+    @patch('thor.lib.deploy.time.sleep')
+    def test_settle_down(self, sleep):
+        self.deploy.settle_down(5)
+        sleep.assert_called_once_with(5)
+
+    @patch('thor.lib.deploy.time.sleep')
+    def test_wait_for_green_settle_down(self, sleep):
+        self.set_deploy_config({'settle_down_seconds': 3})
+        self.deploy.wait_for_green_step('green')
+        sleep.assert_called_once_with(3)
+        self.deploy.target_group.wait_for_healthy.assert_not_called()
+
+    @patch('thor.lib.deploy.time.sleep')
+    def test_wait_for_green_target_health(self, sleep):
+        self.set_deploy_config({'wait_for_target_health': True,
+                                'ready_timeout': 600})
+        self.deploy.wait_for_green_step('green')
+        sleep.assert_not_called()
+        self.deploy.target_group.wait_for_healthy.assert_called_once_with(
+            'arn', ['i-0'], 600)
+
+    def test_wait_for_green_timeout(self):
+        self.set_deploy_config({'wait_for_target_health': True})
+        self.deploy.target_group.wait_for_healthy.side_effect = \
+            AwsResourceTimeoutException('timed out')
+        with self.assertRaises(DeployException):
+            self.deploy.wait_for_green_step('green')
+
+    def test_wait_for_green_invalid_timeout(self):
+        self.set_deploy_config({'wait_for_target_health': True,
+                                'ready_timeout': 3600})
+        with self.assertRaises(DeployException):
+            self.deploy.wait_for_green_step('green')
+        self.deploy.target_group.wait_for_healthy.assert_not_called()
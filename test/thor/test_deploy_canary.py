@@ -0,0 +1,132 @@
+import threading
+from thor.lib.deploy import (
+    DeployBlueGreen,
+    DeployCanary,
+    DeployException,
+    get_deploy
+)
+from thor.lib.env import Env
+from thor.lib.image import Image
+from unittest import TestCase
+from unittest.mock import (
+    MagicMock,
+    call,
+    patch
+)
+
+
+class TestDeployCanary(TestCase):
+
+    def setUp(self):
+        self.image = Image(Env('test'), 'test')
+        self.set_deploy_config({'strategy': 'canary',
+                                'settle_down_seconds': 0})
+        self.deploy = DeployCanary(self.image)
+        self.deploy.autoscaling = MagicMock()
+        self.deploy.launch_template = MagicMock()
+        self.deploy.running_resources['autoscaling'] = {
+            'AutoScalingGroupName': 'blue',
+            'MinSize': 4,
+            'DesiredCapacity': 10
+        }
+        patcher = patch('thor.lib.deploy.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('thor.lib.deploy.random_string', return_value='x')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def set_deploy_config(self, deploy_config):
+        self.image.get_config().loaded_config = {
+            'scaling': {'min_size': 2, 'max_size': 20},
+            'launch_template': {'instance_type': 't3.micro'},
+            'deploy': deploy_config
+        }
+
+    def test_get_deploy(self):
+        self.assertIsInstance(get_deploy(self.image), DeployCanary)
+        self.set_deploy_config({})
+        self.assertIsInstance(get_deploy(self.image), DeployBlueGreen)
+        self.set_deploy_config({'strategy': 'unknown'})
+        with self.assertRaises(DeployException):
+            get_deploy(self.image)
+
+    def test_step_capacities(self):
+        self.assertListEqual(self.deploy.get_step_capacities(10),
+                             [1, 5, 10])
+        self.assertListEqual(self.deploy.get_step_capacities(1), [1])
+        self.set_deploy_config({'canary_steps': [25, 50]})
+        self.assertListEqual(self.deploy.get_step_capacities(3), [1, 2, 3])
+        self.set_deploy_config({'canary_steps': [0]})
+        with self.assertRaises(DeployException):
+            self.deploy.get_step_capacities(3)
+
+    def test_create_green_environment_step(self):
+        green = self.deploy.create_green_environment_step()
+        self.assertEqual(green, 'ASG_test_test_x')
+
+        create_config = self.deploy.autoscaling.create.call_args.args[2]
+        self.assertEqual(create_config['desired_capacity'], 1)
+        self.assertEqual(create_config['min_size'], 1)
+        self.assertListEqual(self.deploy.autoscaling.update.call_args_list, [
+            call('blue', {'min_size': 4, 'desired_capacity': 9}),
+            call(green, {'min_size': 2, 'desired_capacity': 5}),
+            call('blue', {'min_size': 4, 'desired_capacity': 5}),
+            call(green, {'min_size': 2, 'desired_capacity': 10})
+        ])
+        self.assertEqual(self.deploy.blue_capacity, 5)
+
+    def test_blue_smaller_than_green(self):
+        scaling = self.image.get_config().loaded_config['scaling']
+        scaling['desired_capacity'] = 10
+        self.deploy.running_resources['autoscaling']['DesiredCapacity'] = 4
+        green = self.deploy.create_green_environment_step()
+
+        # blue never grows, it shrinks by what green grew
+        self.assertListEqual(self.deploy.autoscaling.update.call_args_list, [
+            call('blue', {'min_size': 3, 'desired_capacity': 3}),
+            call(green, {'min_size': 2, 'desired_capacity': 5}),
+            call('blue', {'min_size': 0, 'desired_capacity': 0}),
+            call(green, {'min_size': 2, 'desired_capacity': 10})
+        ])
+        self.assertEqual(self.deploy.blue_capacity, 0)
+
+    def test_rollback_restores_blue(self):
+        self.deploy.autoscaling.wait_for_capacity.side_effect = [
+            DeployException('timed out')]
+        with self.assertRaises(DeployException):
+            self.deploy.create_green_environment_step()
+        self.deploy.do_blue_green_rollback()
+
+        self.assertEqual(self.deploy.autoscaling.update.call_args_list[-1],
+                         call('blue', {'min_size': 4, 'desired_capacity': 10}))
+        self.deploy.autoscaling.destroy.assert_called_once_with(
+            'ASG_test_test_x')
+
+    def test_invalid_ready_timeout(self):
+        self.set_deploy_config({'strategy': 'canary',
+                                'settle_down_seconds': 0,
+                                'ready_timeout': 3600})
+        self.deploy.pre_init_step = MagicMock()
+        self.deploy.image.params = MagicMock(deploy_lock=None)
+
+        self.assertEqual(self.deploy.run(), 'fail')
+        self.deploy.autoscaling.wait_for_capacity.assert_not_called()
+        self.assertEqual(self.deploy.autoscaling.update.call_args_list[-1],
+                         call('blue', {'min_size': 4, 'desired_capacity': 10}))
+        self.deploy.autoscaling.destroy.assert_called_once_with(
+            'ASG_test_test_x')
+
+    def test_cancel_rolls_back(self):
+        cancel_event = threading.Event()
+        cancel_event.set()
+        self.deploy.set_cancel_event(cancel_event)
+        self.deploy.pre_init_step = MagicMock()
+        self.deploy.image.params = MagicMock(deploy_lock=None)
+
+        # cancelled while settling down the first step
+        self.assertEqual(self.deploy.run(), 'cancelled')
+        self.assertIsNone(self.deploy.autoscaling.cancel_event)
+        self.assertEqual(self.deploy.autoscaling.update.call_count, 0)
+        self.deploy.autoscaling.destroy.assert_called_once_with(
+            'ASG_test_test_x')
@@ -0,0 +1,81 @@
+from thor.lib.aws_resources.autoscaling import AutoScalingException
+from thor.lib.aws_resources.aws_resource import (
+    AwsResourceParameterException
+)
+from thor.lib.deploy import (
+    DeployException,
+    DeployInstanceRefresh,
+    get_deploy
+)
+from thor.lib.env import Env
+from thor.lib.image import Image
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+
+class TestDeployInstanceRefresh(TestCase):
+
+    def setUp(self):
+        self.image = Image(Env('test'), 'test')
+        self.image.get_config().loaded_config = {
+            'scaling': {'min_size': 2},
+            'launch_template': {'instance_type': 't3.micro'},
+            'deploy': {
+                'strategy': 'instance_refresh',
+                'min_healthy_percentage': 50,
+                'instance_warmup': 60
+            }
+        }
+        self.deploy = get_deploy(self.image)
+        self.deploy.ami_id = 'ami-1'
+        self.deploy.autoscaling = MagicMock()
+        self.deploy.autoscaling.start_instance_refresh.return_value = 'r-1'
+        self.deploy.launch_template = MagicMock()
+        self.deploy.launch_template.create_version.return_value = 2
+        self.deploy.running_resources = {
+            'autoscaling': {'AutoScalingGroupName': 'asg'},
+            'launch_template': 'lt'
+        }
+
+    def test_deploy_step(self):
+        self.assertIsInstance(self.deploy, DeployInstanceRefresh)
+        self.assertEqual(self.deploy.deploy_step(), 'asg')
+
+        self.deploy.launch_template.create_version.assert_called_once_with(
+            'lt', {'instance_type': 't3.micro', 'image_id': 'ami-1'})
+        self.deploy.autoscaling.start_instance_refresh.assert_called_once_with(
+            'asg', 'lt', 2, {'min_healthy_percentage': 50,
+                             'skip_matching': True,
+                             'instance_warmup': 60})
+        self.deploy.autoscaling.wait_for_instance_refresh \
+            .assert_called_once_with('asg', 'r-1', 1800)
+        self.deploy.autoscaling.create.assert_not_called()
+        self.deploy.autoscaling.destroy.assert_not_called()
+
+    def test_rollback_cancels_refresh(self):
+        self.deploy.autoscaling.wait_for_instance_refresh.side_effect = \
+            AutoScalingException('Instance refresh r-1 Failed')
+        self.deploy.pre_init_step = MagicMock()
+        self.deploy.image.params = MagicMock(deploy_lock=None)
+
+        self.assertEqual(self.deploy.run(), 'fail')
+        self.deploy.autoscaling.cancel_instance_refresh \
+            .assert_called_once_with('asg')
+        self.deploy.autoscaling.destroy.assert_not_called()
+
+    def test_invalid_refresh_timeout(self):
+        deploy_config = self.image.get_config().loaded_config['deploy']
+        deploy_config['refresh_timeout'] = 3600
+        with self.assertRaises(DeployException):
+            self.deploy.deploy_step()
+        self.deploy.autoscaling.start_instance_refresh.assert_not_called()
+
+    def test_rollback_cancels_refresh_on_parameter_error(self):
+        self.deploy.autoscaling.wait_for_instance_refresh.side_effect = \
+            AwsResourceParameterException('Invalid timeout value')
+        self.deploy.pre_init_step = MagicMock()
+        self.deploy.image.params = MagicMock(deploy_lock=None)
+
+        self.assertEqual(self.deploy.run(), 'fail')
+        self.deploy.autoscaling.cancel_instance_refresh \
+            .assert_called_once_with('asg')
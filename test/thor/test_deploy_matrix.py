@@ -0,0 +1,89 @@
+import _thread
+import logging
+import threading
+from thor.lib.deploy_matrix import (
+    DeployMatrix,
+    DeployMatrixLogFilter,
+    DeployMatrixLogFormatter
+)
+from thor.lib.env import Env
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestDeployMatrix(TestCase):
+
+    def setUp(self):
+        self.env = Env('test')
+        patcher = patch('thor.lib.deploy_matrix.Compiler')
+        self.compiler = patcher.start().return_value.__enter__.return_value
+        self.compiler.build_all.return_value = 'success'
+        self.addCleanup(patcher.stop)
+        patcher = patch('thor.lib.deploy_matrix.get_deploy')
+        self.deploy = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_run(self):
+        # both deploys must be running at the same time to pass
+        barrier = threading.Barrier(2, timeout=5)
+
+        def run_deploy():
+            barrier.wait()
+            return 'success'
+
+        self.deploy.return_value.run.side_effect = run_deploy
+        results = DeployMatrix(self.env, ['app', 'web'], 2).run()
+        self.assertListEqual([(x['image'], x['result']) for x in results],
+                             [('app', 'success'), ('web', 'success')])
+
+    def test_compile_fail(self):
+        self.compiler.build_all.side_effect = SystemExit(-1)
+        results = DeployMatrix(self.env, ['app']).run()
+        self.assertEqual(results[0]['result'], 'fail')
+        self.deploy.assert_not_called()
+
+    def test_deploy_exception(self):
+        self.deploy.return_value.run.side_effect = Exception('no lock')
+        results = DeployMatrix(self.env, ['app']).run()
+        self.assertEqual(results[0]['result'], 'fail')
+        self.assertEqual(results[0]['error'], 'no lock')
+
+    def test_cancel(self):
+        matrix = DeployMatrix(self.env, ['app', 'web'], 1)
+
+        def run_deploy():
+            _thread.interrupt_main()
+            # Deploy.run rolls back on its next wait
+            self.assertTrue(matrix.cancel_event.wait(5))
+            return 'cancelled'
+
+        self.deploy.return_value.run.side_effect = run_deploy
+        results = matrix.run()
+        self.deploy.return_value.set_cancel_event.assert_called_once_with(
+            matrix.cancel_event)
+        self.assertListEqual([(x['image'], x['result']) for x in results],
+                             [('app', 'cancelled'), ('web', 'cancelled')])
+        # web was never started
+        self.assertEqual(self.deploy.return_value.run.call_count, 1)
+
+    def test_log_filter(self):
+        record = logging.LogRecord('test', logging.INFO, __file__, 1,
+                                   'Deploying %s', ('green',), None)
+        token = DeployMatrix.current_image.set('app')
+        try:
+            DeployMatrixLogFilter().filter(record)
+        finally:
+            DeployMatrix.current_image.reset(token)
+        self.assertEqual(record.image, 'app')
+        self.assertEqual(record.getMessage(), 'Deploying green')
+
+        # each handler prefixes its own output once
+        formatters = [
+            DeployMatrixLogFormatter(logging.Formatter('%(message)s')),
+            DeployMatrixLogFormatter(logging.Formatter('%(levelname)s '
+                                                       '%(message)s'))
+        ]
+        self.assertListEqual([x.format(record) for x in formatters],
+                             ['[app] Deploying green',
+                              '[app] INFO Deploying green'])
+        self.assertEqual(record.getMessage(), 'Deploying green')
@@ -0,0 +1,59 @@
+import os
+import tempfile
+from thor.lib.utils import file_copy
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestFileCopy(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = f'{self.tmp_dir.name}/src'
+        self.dst = f'{self.tmp_dir.name}/dst'
+        # bigger than one chunk to exercise the copy loop
+        self.content = os.urandom(file_copy.CHUNK_SIZE * 2 + 10)
+        with open(self.src, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_dst(self):
+        with open(self.dst, 'rb') as f:
+            return f.read()
+
+    def test_copy_file(self):
+        file_copy.copy_file(self.src, self.dst)
+        self.assertEqual(self.read_dst(), self.content)
+
+    def test_copy_file_chunked_fallback(self):
+        def unsupported(*args):
+            raise OSError(file_copy.errno.ENOSYS, 'not supported')
+
+        with patch.object(file_copy, '_copy_file_range', unsupported), \
+                patch.object(file_copy, '_sendfile', unsupported):
+            file_copy.copy_file(self.src, self.dst)
+        self.assertEqual(self.read_dst(), self.content)
+
+    def test_install_file_hardlink(self):
+        file_copy.install_file(self.src, self.dst, file_copy.HARDLINK_MODE)
+        self.assertTrue(os.path.samefile(self.src, self.dst))
+
+    def test_install_file_never_writes_through_links(self):
+        file_copy.install_file(self.src, self.dst, file_copy.HARDLINK_MODE)
+        file_copy.install_file(self.src, self.dst, file_copy.REFLINK_MODE)
+        self.assertFalse(os.path.samefile(self.src, self.dst))
+        self.assertEqual(self.read_dst(), self.content)
+
+    def test_install_file_keeps_mtime(self):
+        os.utime(self.src, ns=(0, 1000000000))
+        file_copy.install_file(self.src, self.dst)
+        self.assertEqual(os.stat(self.dst).st_mtime_ns, 1000000000)
+
+    def test_write_file_atomic(self):
+        file_copy.write_file_atomic(self.dst, 'content')
+        with open(self.dst) as f:
+            self.assertEqual(f.read(), 'content')
+        self.assertListEqual(sorted(os.listdir(self.tmp_dir.name)),
+                             ['dst', 'src'])
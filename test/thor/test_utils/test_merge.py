@@ -0,0 +1,23 @@
+from thor.lib.utils.merge import deep_merge
+from unittest import TestCase
+
+
+class TestMerge(TestCase):
+
+    def test_deep_merge(self):
+        base = {'a': {'b': 1, 'c': [1]}, 'd': 'base'}
+        override = {'a': {'c': [2], 'e': 3}, 'd': 'override'}
+        merged = deep_merge(base, override)
+        self.assertDictEqual(merged, {'a': {'b': 1, 'c': [2], 'e': 3},
+                                      'd': 'override'})
+        # inputs are not modified
+        self.assertDictEqual(base['a'], {'b': 1, 'c': [1]})
+
+    def test_deep_merge_concat_lists(self):
+        merged = deep_merge({'a': {'b': [1]}}, {'a': {'b': [2]}},
+                            concat_lists=True)
+        self.assertDictEqual(merged, {'a': {'b': [1, 2]}})
+
+    def test_deep_merge_type_change(self):
+        self.assertEqual(deep_merge({'a': {'b': 1}}, {'a': 'value'}),
+                         {'a': 'value'})
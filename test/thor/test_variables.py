@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+from thor.lib.env import Env
+from thor.lib.image import Image
+from thor.lib.thor import Thor
+from thor.lib.variables import (
+    Variables,
+    VariablesException
+)
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestVariables(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = self.tmp_dir.name
+        patches = {
+            'ENVIRONMENTS_DIR': f'{root}/environments',
+            'IMAGES_DIR': f'{root}/images'
+        }
+        for attr, value in patches.items():
+            patcher = patch.object(Thor, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = patch.dict(Variables._Variables__FILE_CACHE, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.write_file('environments/test/variables.json', {
+            'region': 'us-east-1',
+            'app': {'port': 80, 'hosts': ['a'], 'tls': {'enabled': False}}
+        })
+        self.write_file('environments/test/variables.d/10-tls.json', {
+            'app': {'tls': {'enabled': True, 'cert': 'env.pem'}}
+        })
+        self.write_file('images/test/variables.json', {
+            'app': {'hosts': ['b'], 'tls': {'cert': 'image.pem'}}
+        })
+        self.write_file('images/test/variables.d/20-name.json',
+                        {'name': 'fragment'})
+        self.write_file('images/test/variables.d/10-name.json',
+                        {'name': 'first'})
+        env = Env('test')
+        self.variables = Variables(env, Image(env, 'test'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, path, content):
+        full_path = f'{self.tmp_dir.name}/{path}'
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            json.dump(content, f)
+
+    def test_load(self):
+        self.assertDictEqual(self.variables.load(), {
+            'region': 'us-east-1',
+            'name': 'fragment',
+            'app': {
+                'port': 80,
+                'hosts': ['a', 'b'],
+                'tls': {'enabled': True, 'cert': 'image.pem'}
+            }
+        })
+
+    def test_cache(self):
+        expected = self.variables.load()
+
+        # files are parsed once per process
+        with patch('thor.lib.variables.json.load') as load:
+            self.assertDictEqual(self.variables.load(), expected)
+            load.assert_not_called()
+
+        self.write_file('images/test/variables.d/30-name.json',
+                        {'name': 'changed'})
+        self.assertEqual(self.variables.load()['name'], 'changed')
+
+    def test_invalid_file(self):
+        self.write_file('images/test/variables.d/30-list.json', ['a'])
+        with self.assertRaises(VariablesException):
+            self.variables.load()